@@ -8,8 +8,14 @@ from flask import Flask
 
 from servicio_gestion.config import Config
 
+from servicio_gestion import base_datos, calentamiento, compresion, perfilado, trazas
 from servicio_gestion.extensions import db
+from servicio_gestion.migraciones import crear_busqueda_pacientes, crear_indices
+from servicio_gestion.migraciones import eliminar_restricciones, inicializar_archivo_citas
+from servicio_gestion.migraciones import inicializar_eventos_citas, inicializar_idempotencia
+from servicio_gestion.migraciones import inicializar_outbox
 from servicio_gestion.routes import main, auth, admin
+from servicio_citas import cola_escritura
 from servicio_citas.routes import cita
 
 app = Flask(__name__)
@@ -18,6 +24,16 @@ app = Flask(__name__)
 app.config.from_object(Config)
 # Indicamos a la app a qué base de datos se tiene que conectar
 db.init_app(app)
+# Plazo por sentencia, métricas del pool y conexiones propias en cada worker
+base_datos.init_app(app)
+# Compresión negociada de las respuestas
+compresion.init_app(app)
+# Identificador de petición (X-Request-ID) y trazas por petición (TRAZAS)
+trazas.init_app(app)
+# Perfilado bajo demanda de endpoints (PERFILADO)
+perfilado.init_app(app)
+# Commit agrupado de las escrituras de citas (ESCRITURA_AGRUPADA)
+cola_escritura.init_app(app)
 # Registra los Blueprints
 with app.app_context():
 
@@ -26,6 +42,22 @@ with app.app_context():
     app.register_blueprint(admin.admin_bp, url_prefix='/admin')
     app.register_blueprint(cita.citas_bp, url_prefix='/citas')
 
+# Actualiza las restricciones y crea los índices nuevos en bases de datos ya existentes
+eliminar_restricciones(app)
+crear_indices(app)
+# Crea la tabla outbox de eventos de cambios si no existe
+inicializar_outbox(app)
+# Crea el índice de búsqueda de pacientes si no existe
+crear_busqueda_pacientes(app)
+# Crea la tabla de archivo de citas pasadas si no existe
+inicializar_archivo_citas(app)
+# Crea la tabla de claves de idempotencia si no existe
+inicializar_idempotencia(app)
+# Crea la tabla de eventos de cambios de citas si no existe
+inicializar_eventos_citas(app)
+# Abre conexiones, compila consultas y rellena cachés antes de marcar /ready
+calentamiento.iniciar(app)
+
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001) # El servicio de citas debe ir en el 5002
@@ -0,0 +1,88 @@
+'''
+Benchmark del archivo de citas pasadas.
+
+Se carga un histórico de --historico citas antiguas y --recientes citas
+alrededor de hoy. Se miden las consultas más habituales antes y después de
+archivar, el ritmo del archivado por lotes y las consultas históricas, que
+después de archivar leen la unión de las dos tablas (los listados sin
+rango de fechas la leen siempre, salvo con historico=false).
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_archivo --historico 1000000
+'''
+
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import comun
+from servicio_citas import archivo
+from servicio_citas.models.citas import CitaArchivada, CitaMedica
+
+
+def medir(cliente, headers, url, repeticiones):
+    'Mediana de la latencia (ms) de una petición GET'
+    latencias = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        respuesta = cliente.get(url, headers=headers)
+        latencias.append(time.perf_counter() - t0)
+        assert respuesta.status_code in (200, 201), respuesta.status_code
+    return comun.percentil(latencias, 50) * 1000
+
+
+def main():
+    'Carga los datos, mide las consultas, archiva y vuelve a medir'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--historico', type=int, default=1000000)
+    parser.add_argument('--recientes', type=int, default=20000)
+    parser.add_argument('--doctores', type=int, default=50)
+    parser.add_argument('--lote', type=int, default=1000)
+    parser.add_argument('--repeticiones', type=int, default=10)
+    args = parser.parse_args()
+
+    hoy = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
+    with tempfile.TemporaryDirectory() as carpeta:
+        app = comun.crear_app(os.path.join(carpeta, 'bench.db'))
+        comun.sembrar(app, n_doctores=args.doctores)
+        comun.sembrar_citas(app, args.historico, n_doctores=args.doctores,
+                            inicio=datetime(2015, 1, 5, 9, 0))
+        comun.sembrar_citas(app, args.recientes, n_doctores=args.doctores,
+                            inicio=hoy - timedelta(days=7))
+        cliente = app.test_client()
+        headers = {'Authorization': f'Bearer {comun.token()}'}
+        semana = (hoy - timedelta(days=2)).strftime('%d-%m-%Y')
+        consultas = {
+            'listar doctor': '/citas/listar_citas?id_doctor=3&fields=id_cita,fecha',
+            'listar estado': '/citas/listar_citas?estado=cancelada&fields=id_cita',
+            # Solo la tabla de citas activas, sin la unión con el archivo
+            'listar doctor act': ('/citas/listar_citas?id_doctor=3&fields=id_cita,fecha'
+                                  '&historico=false'),
+            'agenda actual': f'/citas/agenda?id_centro=1&fecha={semana}&vista=semana',
+            'agenda 2016': '/citas/agenda?id_doctor=3&fecha=04-01-2016&vista=semana',
+        }
+
+        antes = {nombre: medir(cliente, headers, url, args.repeticiones)
+                 for nombre, url in consultas.items()}
+
+        with app.app_context():
+            t0 = time.perf_counter()
+            movidas, _ = archivo.archivar(lote=args.lote)
+            segundos = time.perf_counter() - t0
+            activas = CitaMedica.query.count()
+            archivadas = CitaArchivada.query.count()
+        print(f'archivadas {movidas} citas en {segundos:.1f} s '
+              f'({movidas / segundos:.0f} citas/s, lotes de {args.lote}); '
+              f'tabla activa: {activas}, archivo: {archivadas}')
+
+        print(f'{"consulta":>18} | {"antes_ms":>9} | {"después_ms":>10}')
+        for nombre, url in consultas.items():
+            despues = medir(cliente, headers, url, args.repeticiones)
+            print(f'{nombre:>18} | {antes[nombre]:9.1f} | {despues:10.1f}')
+
+
+if __name__ == '__main__':
+    main()
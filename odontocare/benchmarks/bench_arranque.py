@@ -0,0 +1,95 @@
+'''
+Benchmark de las primeras peticiones tras arrancar servicio_citas, con y
+sin calentamiento (CALENTAMIENTO).
+
+Cada medida arranca app_citas en un proceso nuevo sobre el mismo fichero
+SQLite (validación de referencias 'sql'), espera a que GET /ready responda
+200 y mide la latencia de las primeras peticiones de agendar y de consulta.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_arranque --repeticiones 5
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import comun
+
+
+# Se ejecuta en el proceso hijo: arranca el servicio y mide las primeras peticiones
+HIJO = '''
+import json, time
+import requests
+t0 = time.perf_counter()
+from benchmarks import comun
+from app_citas import app
+servidor, url = comun.arrancar_servidor(app)
+while requests.get(url + '/ready').status_code != 200:
+    time.sleep(0.005)
+listo = time.perf_counter() - t0
+headers = {'Authorization': 'Bearer ' + comun.token()}
+datos = {'fecha': '07-01-2041 09:00', 'motivo': 'Revision', 'estado': 'activa',
+         'id_usuario': 1, 'id_paciente': 1, 'id_doctor': 1, 'id_centro': 1}
+tiempos = {}
+for nombre, metodo, ruta, cuerpo in [
+        ('agendar', 'post', '/citas/agendar', datos),
+        ('agendar_2', 'post', '/citas/agendar', dict(datos, id_doctor=2)),
+        ('agenda', 'get', '/citas/agenda?id_centro=1&fecha=07-01-2041&vista=semana', None),
+        ('doctores', 'get', '/admin/doctores', None)]:
+    t = time.perf_counter()
+    respuesta = getattr(requests, metodo)(url + ruta, json=cuerpo, headers=headers)
+    tiempos[nombre] = (time.perf_counter() - t) * 1000
+    assert respuesta.status_code in (200, 201), (ruta, respuesta.status_code)
+print(json.dumps({'listo_s': listo, 'tiempos': tiempos,
+                  'ready': requests.get(url + '/ready').json()}))
+servidor.shutdown()
+'''
+
+
+def medir(ruta, calentamiento):
+    'Arranca el servicio en un proceso nuevo y devuelve sus medidas'
+    entorno = dict(os.environ, DB_PATH=ruta, REFERENCIAS_BACKEND='sql',
+                   ARCHIVO_INTERVALO='0', CALENTAMIENTO_HTTP='false',
+                   CALENTAMIENTO=str(calentamiento).lower())
+    salida = subprocess.run([sys.executable, '-c', HIJO], env=entorno, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def main():
+    'Compara el arranque con y sin calentamiento'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta = os.path.join(carpeta, 'bench.db')
+        comun.sembrar(comun.crear_app(ruta))
+
+        print(f'{"calentamiento":>13} | {"listo_s":>7} | {"agendar_ms":>10} | '
+              f'{"agendar_2_ms":>12} | {"agenda_ms":>9} | {"doctores_ms":>11}')
+        for calentamiento in (False, True):
+            medidas = []
+            for _ in range(args.repeticiones):
+                medidas.append(medir(ruta, calentamiento))
+                # Cada repetición vuelve a agendar las mismas citas
+                with comun.crear_app(ruta).app_context():
+                    comun.db.session.execute(comun.CitaMedica.__table__.delete())
+                    comun.db.session.commit()
+
+            def mediana(clave):
+                return comun.percentil([m['tiempos'][clave] for m in medidas], 50)
+            listo = comun.percentil([m['listo_s'] for m in medidas], 50)
+            print(f'{"sí" if calentamiento else "no":>13} | {listo:7.2f} | '
+                  f'{mediana("agendar"):10.1f} | {mediana("agendar_2"):12.1f} | '
+                  f'{mediana("agenda"):9.1f} | {mediana("doctores"):11.1f}')
+        print('pasos del calentamiento (ms):', medidas[-1]['ready']['pasos_ms'])
+
+
+if __name__ == '__main__':
+    main()
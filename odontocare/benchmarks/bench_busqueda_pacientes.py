@@ -0,0 +1,116 @@
+'''
+Benchmark de la búsqueda de pacientes: índice FTS5 (/admin/pacientes/buscar)
+frente a un recorrido con LIKE '%texto%' sobre nombre y teléfono.
+
+Se cargan pacientes con nombres y apellidos españoles (muchos con tilde)
+y para cada búsqueda se mide la latencia y el número de resultados: LIKE
+distingue los acentos, así que 'vizcaino' no encuentra 'Vizcaíno'.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_busqueda_pacientes --pacientes 1000000
+'''
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import or_
+
+from benchmarks import comun
+from servicio_gestion.extensions import db
+from servicio_gestion.models import busqueda_pacientes
+from servicio_gestion.models.pacientes import Paciente
+from servicio_gestion.models.usuarios import Usuario
+
+
+NOMBRES = ['Lucía', 'María', 'José', 'Martín', 'Inés', 'Óscar', 'Sofía', 'Raúl',
+           'Álvaro', 'Carmen', 'Andrés', 'Begoña', 'Iñigo', 'Jesús', 'Ramón', 'Elena']
+APELLIDOS = ['García', 'Martínez', 'López', 'Sánchez', 'Pérez', 'Gómez', 'Fernández',
+             'Vizcaíno', 'Núñez', 'Ibáñez', 'Muñoz', 'Jiménez', 'Ruiz', 'Díaz', 'Álvarez',
+             'Romero', 'Navarro', 'Domínguez', 'Gil', 'Castaño', 'Peña', 'Beltrán']
+
+# Textos buscados (los mismos para FTS5 y para LIKE)
+BUSQUEDAS = ['vizcai', 'vizcaíno núñez', 'ibanez', 'lucia garc', '612 34', '61234567']
+
+
+def sembrar_pacientes(app, n_pacientes, lote=50000):
+    'Carga usuarios y pacientes con nombres y teléfonos aleatorios; devuelve filas/s'
+    aleatorio = random.Random(1)
+    t0 = time.perf_counter()
+    with app.app_context():
+        for base in range(0, n_pacientes, lote):
+            fin = min(base + lote, n_pacientes)
+            db.session.execute(Usuario.__table__.insert(), [
+                {'id_usuario': i + 1, 'username': f'paciente_{i}',
+                 'password': f'hash_{i}', 'rol': 'paciente'} for i in range(base, fin)])
+            db.session.execute(Paciente.__table__.insert(), [
+                {'id_paciente': i + 1, 'id_usuario': i + 1,
+                 'nombre': f'{aleatorio.choice(NOMBRES)} {aleatorio.choice(APELLIDOS)} '
+                           f'{aleatorio.choice(APELLIDOS)}',
+                 'telefono': f'+34 {aleatorio.randrange(600, 700)} '
+                             f'{aleatorio.randrange(1000):03d} {aleatorio.randrange(1000):03d}',
+                 'estado': 'ACTIVO'} for i in range(base, fin)])
+            db.session.commit()
+    return n_pacientes / (time.perf_counter() - t0)
+
+
+def buscar_like(texto, limite):
+    'Búsqueda con LIKE: cada palabra debe aparecer en el nombre o en el teléfono'
+    consulta = Paciente.query
+    for palabra in texto.split():
+        patron = f'%{palabra}%'
+        consulta = consulta.filter(or_(Paciente.nombre.like(patron),
+                                       Paciente.telefono.like(patron)))
+    return consulta.limit(limite).all()
+
+
+def medir(funcion, repeticiones):
+    'Mediana de la latencia (ms) de una función y su último resultado'
+    latencias = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = funcion()
+        latencias.append(time.perf_counter() - t0)
+    return comun.percentil(latencias, 50) * 1000, resultado
+
+
+def main():
+    'Carga los pacientes, ejecuta las búsquedas e imprime la comparación'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pacientes', type=int, default=1000000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--limite', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        app = comun.crear_app(os.path.join(carpeta, 'bench.db'))
+        filas_por_segundo = sembrar_pacientes(app, args.pacientes)
+        print(f'{args.pacientes} pacientes cargados ({filas_por_segundo:.0f} filas/s '
+              f'con los triggers del índice FTS5)')
+
+        cliente = app.test_client()
+        headers = {'Authorization': f'Bearer {comun.token()}'}
+        print(f'{"búsqueda":>18} | {"fts_ms":>8} | {"fts_n":>5} | {"like_ms":>8} | {"like_n":>6}')
+        with app.app_context():
+            for texto in BUSQUEDAS:
+                ms_fts, respuesta = medir(
+                    lambda: cliente.get('/admin/pacientes/buscar', headers=headers,
+                                        query_string={'q': texto, 'limite': args.limite}),
+                    args.repeticiones)
+                ms_like, encontrados = medir(lambda: buscar_like(texto, args.limite),
+                                             args.repeticiones)
+                print(f'{texto:>18} | {ms_fts:8.2f} | {respuesta.json["total"]:>5} | '
+                      f'{ms_like:8.2f} | {len(encontrados):>6}')
+
+            # Peor caso de LIKE: un texto sin resultados recorre toda la tabla
+            ms_fts, _ = medir(lambda: busqueda_pacientes.buscar_pacientes('zzzz', args.limite),
+                              args.repeticiones)
+            ms_like, _ = medir(lambda: buscar_like('zzzz', args.limite), args.repeticiones)
+            print(f'{"zzzz (sin datos)":>18} | {ms_fts:8.2f} | {0:>5} | {ms_like:8.2f} | {0:>6}')
+
+
+if __name__ == '__main__':
+    main()
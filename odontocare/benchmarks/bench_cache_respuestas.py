@@ -0,0 +1,81 @@
+'''
+Benchmark de la caché de respuestas de /admin/doctores y /admin/centros_medicos.
+
+Se mide la latencia de la petición completa (cliente de pruebas de Flask)
+sin caché, con el nivel local y con el nivel compartido (fichero SQLite,
+vaciando el nivel local antes de cada petición para simular otro worker).
+Las peticiones recorren --paginas páginas distintas y cada --altas
+peticiones se da de alta un centro médico, que invalida su listado.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_cache_respuestas --doctores 20000 --peticiones 2000
+'''
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks import comun
+from servicio_gestion import cache_respuestas
+from servicio_gestion.extensions import db
+from servicio_gestion.models.centros_medicos import CentroMedico
+
+
+def main():
+    'Prepara los datos, lanza las peticiones con cada modo e imprime las latencias'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doctores', type=int, default=20000)
+    parser.add_argument('--centros', type=int, default=200)
+    parser.add_argument('--peticiones', type=int, default=2000)
+    parser.add_argument('--paginas', type=int, default=20)
+    parser.add_argument('--per-page', type=int, default=50)
+    parser.add_argument('--altas', type=int, default=200,
+                        help='peticiones entre cada alta de centro médico')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        app = comun.crear_app(os.path.join(carpeta, 'bench.db'))
+        comun.sembrar(app, n_doctores=args.doctores, n_centros=args.centros)
+        cliente = app.test_client()
+        headers = {'Authorization': f'Bearer {comun.token()}'}
+        modos = {
+            'sin caché': {'RESPUESTAS_CACHE': False},
+            'local': {'RESPUESTAS_CACHE': True, 'RESPUESTAS_CACHE_RUTA': ''},
+            'compartida': {'RESPUESTAS_CACHE': True,
+                           'RESPUESTAS_CACHE_RUTA': os.path.join(carpeta, 'cache.db')},
+        }
+
+        print(f'{"modo":>12} | {"p50_ms":>7} | {"p95_ms":>7} | {"req/s":>7} | aciertos')
+        for nombre, config in modos.items():
+            app.config.update(config)
+            cache_respuestas.vaciar()
+            aciertos = 0
+            aleatorio = random.Random(1)
+            latencias = []
+            for i in range(args.peticiones):
+                if i and i % args.altas == 0:
+                    with app.app_context():
+                        db.session.add(CentroMedico(nombre=f'Centro {nombre} {i}',
+                                                    direccion=f'Calle {nombre} {i}'))
+                        db.session.commit()
+                if nombre == 'compartida':
+                    cache_respuestas.vaciar()
+                url = aleatorio.choice(['/admin/doctores', '/admin/centros_medicos'])
+                query = {'page': aleatorio.randrange(1, args.paginas + 1),
+                         'per_page': args.per_page}
+                t0 = time.perf_counter()
+                respuesta = cliente.get(url, query_string=query, headers=headers)
+                latencias.append(time.perf_counter() - t0)
+                assert respuesta.status_code == 200, respuesta.status_code
+                aciertos += respuesta.headers.get('X-Cache', '').startswith('HIT')
+            print(f'{nombre:>12} | {comun.percentil(latencias, 50) * 1000:7.2f} | '
+                  f'{comun.percentil(latencias, 95) * 1000:7.2f} | '
+                  f'{len(latencias) / sum(latencias):7.0f} | '
+                  f'{aciertos / args.peticiones:.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+'''
+Benchmark de los listados con páginas grandes: objetos ORM + to_dict()
+(implementación anterior) frente a consultas de solo columnas con filas
+(tuplas), con todos los campos y con ?fields= reducido.
+
+Para cada variante se mide la latencia (consulta, serialización y JSON) y
+el pico de memoria reservada durante la petición (tracemalloc) al pedir
+una página de --per-page filas de pacientes y de citas.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_campos --per-page 10000
+'''
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from flask import jsonify, request
+
+from benchmarks import comun
+from servicio_citas.models.citas import CitaMedica
+from servicio_gestion.models.pacientes import Paciente
+
+
+def medir(funcion, repeticiones):
+    '''
+    Mediana de la latencia (ms) de una función y pico de memoria (MB) de una
+    ejecución aparte (tracemalloc ralentiza mucho las reservas de memoria)
+    '''
+    latencias = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion()
+        latencias.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    funcion()
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return comun.percentil(latencias, 50) * 1000, pico / 2 ** 20
+
+
+def registrar_rutas_orm(app):
+    'Añade a la app la implementación anterior de los dos listados, para comparar'
+    @app.route('/orm/pacientes')
+    def pacientes_orm():
+        per_page = request.args.get('per_page', type=int)
+        pagination = Paciente.query.paginate(page=1, per_page=per_page, error_out=False)
+        pacientes_on_page = []
+        for paciente in pagination.items:
+            paciente.estado = paciente.estado.value
+            pacientes_on_page.append(paciente.to_dict())
+        return jsonify({'pacientes': pacientes_on_page})
+
+    @app.route('/orm/citas')
+    def citas_orm():
+        citas = CitaMedica.query.filter_by(id_centro=1).all()
+        return jsonify({'Citas': [cita.to_dict() for cita in citas]})
+
+
+def main():
+    'Prepara los datos, mide cada variante e imprime la tabla'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--per-page', type=int, default=10000)
+    parser.add_argument('--repeticiones', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        app = comun.crear_app(os.path.join(carpeta, 'bench.db'))
+        registrar_rutas_orm(app)
+        # Un solo centro para que listar_citas?id_centro=1 devuelva --per-page filas
+        comun.sembrar(app, n_pacientes=args.per_page, n_centros=1)
+        comun.sembrar_citas(app, args.per_page, n_centros=1)
+        cliente = app.test_client()
+        headers = {'Authorization': f'Bearer {comun.token()}'}
+
+        def peticion(url):
+            'Petición completa al endpoint'
+            def funcion():
+                respuesta = cliente.get(url, headers=headers)
+                assert respuesta.status_code == 200, respuesta.status_code
+            return funcion
+
+        variantes = [
+            ('pacientes', 'ORM + to_dict', peticion(f'/orm/pacientes?per_page={args.per_page}')),
+            ('pacientes', 'filas, todos', peticion(f'/admin/pacientes?per_page={args.per_page}')),
+            ('pacientes', 'fields=2', peticion(f'/admin/pacientes?per_page={args.per_page}'
+                                               f'&fields=id_paciente,nombre')),
+            ('citas', 'ORM + to_dict', peticion('/orm/citas')),
+            ('citas', 'filas, todos', peticion('/citas/listar_citas?id_centro=1')),
+            ('citas', 'fields=2', peticion('/citas/listar_citas?id_centro=1'
+                                           '&fields=id_cita,fecha')),
+        ]
+        print(f'{"listado":>10} | {"variante":>14} | {"p50_ms":>8} | {"pico_MB":>8}')
+        for listado, nombre, funcion in variantes:
+            ms, mb = medir(funcion, args.repeticiones)
+            print(f'{listado:>10} | {nombre:>14} | {ms:8.1f} | {mb:8.2f}')
+
+
+if __name__ == '__main__':
+    main()
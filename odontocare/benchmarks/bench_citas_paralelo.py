@@ -0,0 +1,140 @@
+'''
+Benchmark de /citas/agendar: referencias consultadas una detrás de otra
+(modo secuencial) frente a consultadas en paralelo con el pool de hilos
+compartido del proceso (modo paralelo, CITAS_REFERENCIAS_PARALELO).
+
+Cada modo se ejecuta en un proceso independiente, porque el modo se elige
+con la variable de entorno CITAS_REFERENCIAS_PARALELO al registrar las
+rutas. Para cada modo se levantan dos servidores sobre el mismo fichero SQLite:
+    - servicio_gestion, en otro proceso, con una latencia artificial en /admin
+    - servicio_citas, en el proceso del modo, que consulta al anterior
+
+Con 1 CPU, el modo paralelo reduce a la mitad la latencia con 10 peticiones
+concurrentes, pero con 100-200 rinde lo mismo que el secuencial (el límite
+es la CPU): no permite atender cientos de citas en curso.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_citas_paralelo --peticiones 300 --concurrencia 100
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+
+def ejecutar_modo(args):
+    'Ejecuta el benchmark en el proceso actual y devuelve las métricas'
+    from benchmarks import comun
+    from servicio_citas.config import Config
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta_db = os.path.join(carpeta, 'bench.db')
+        app_citas = comun.crear_app(ruta_db)
+        comun.sembrar(app_citas, n_doctores=args.doctores)
+
+        # servicio_gestion en su propio proceso, como en el despliegue real
+        gestion = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_citas_paralelo',
+                                    '--servir-gestion', ruta_db,
+                                    '--latencia', str(args.latencia)],
+                                   stdout=subprocess.PIPE, text=True)
+        Config.GESTION_URL = gestion.stdout.readline().strip()
+
+        servidor_citas, url_citas = comun.arrancar_servidor(app_citas)
+
+        headers = {'Authorization': f'Bearer {comun.token()}'}
+        inicio = datetime(2030, 1, 7, 9, 0)
+
+        def agendar(i):
+            datos = {'fecha': (inicio + timedelta(minutes=30 * (i // args.doctores)))
+                              .strftime('%d-%m-%Y %H:%M'),
+                     'motivo': 'Revision', 'estado': 'activa', 'id_usuario': 1,
+                     'id_paciente': i % 20 + 1, 'id_doctor': i % args.doctores + 1,
+                     'id_centro': 1}
+            t0 = time.perf_counter()
+            respuesta = requests.post(f'{url_citas}/citas/agendar', json=datos,
+                                      headers=headers, timeout=60)
+            return respuesta.status_code, time.perf_counter() - t0
+
+        t_inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+            resultados = list(pool.map(agendar, range(args.peticiones)))
+        total = time.perf_counter() - t_inicio
+
+        servidor_citas.shutdown()
+        gestion.terminate()
+        gestion.wait()
+
+    latencias = [t for _, t in resultados]
+    return {
+        'modo': 'paralelo' if Config.CITAS_REFERENCIAS_PARALELO else 'secuencial',
+        'correctas': sum(1 for codigo, _ in resultados if codigo == 201),
+        'peticiones': args.peticiones,
+        'segundos': round(total, 3),
+        'peticiones_por_segundo': round(args.peticiones / total, 1),
+        'p50_ms': round(comun.percentil(latencias, 50) * 1000, 1),
+        'p95_ms': round(comun.percentil(latencias, 95) * 1000, 1),
+    }
+
+
+def servir_gestion(ruta_db, latencia):
+    'Sirve servicio_gestion con latencia artificial hasta que se termine el proceso'
+    from benchmarks import comun
+
+    _, url = comun.arrancar_servidor(comun.crear_app(ruta_db, latencia_admin=latencia))
+    print(url, flush=True)
+    threading.Event().wait()
+
+
+def main():
+    'Lanza un subproceso por modo e imprime la comparación'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peticiones', type=int, default=300)
+    parser.add_argument('--concurrencia', type=int, default=100)
+    parser.add_argument('--latencia', type=float, default=0.05,
+                        help='latencia simulada de servicio_gestion (segundos)')
+    parser.add_argument('--doctores', type=int, default=10)
+    parser.add_argument('--modo', choices=['secuencial', 'paralelo'],
+                        help='uso interno: ejecuta un solo modo en este proceso')
+    parser.add_argument('--servir-gestion', metavar='RUTA_DB',
+                        help='uso interno: sirve servicio_gestion sobre RUTA_DB')
+    args = parser.parse_args()
+
+    if args.servir_gestion:
+        servir_gestion(args.servir_gestion, args.latencia)
+        return
+    if args.modo:
+        print(json.dumps(ejecutar_modo(args)))
+        return
+
+    resultados = []
+    for modo in ('secuencial', 'paralelo'):
+        entorno = dict(os.environ,
+                       CITAS_REFERENCIAS_PARALELO='true' if modo == 'paralelo' else 'false')
+        salida = subprocess.run([sys.executable, '-m', 'benchmarks.bench_citas_paralelo',
+                                 '--modo', modo,
+                                 '--peticiones', str(args.peticiones),
+                                 '--concurrencia', str(args.concurrencia),
+                                 '--latencia', str(args.latencia),
+                                 '--doctores', str(args.doctores)],
+                                env=entorno, capture_output=True, text=True, check=True)
+        resultados.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+
+    columnas = ['modo', 'correctas', 'peticiones', 'segundos',
+                'peticiones_por_segundo', 'p50_ms', 'p95_ms']
+    print(' | '.join(f'{c:>22}' for c in columnas))
+    for fila in resultados:
+        print(' | '.join(f'{fila[c]!s:>22}' for c in columnas))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+'''
+Benchmark de la compresión de respuestas: tamaño enviado, tiempo de CPU de
+compresión y latencia de los listados más grandes con cada algoritmo y nivel.
+
+Para cada endpoint y cada Accept-Encoding se miden los bytes de la
+respuesta, la proporción respecto a la respuesta sin comprimir, el tiempo
+de CPU medio dedicado a comprimir (métrica compresion_cpu_ms) y la
+latencia p50 de la petición completa desde el cliente de pruebas de Flask.
+br y zstd solo aparecen si están instalados 'brotli' y 'zstandard'.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_compresion --citas 200000 --doctores 50
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks import comun
+from servicio_gestion import compresion, metrics
+
+
+# (Accept-Encoding, clave del nivel en la configuración, nivel)
+VARIANTES = [('identity', None, None),
+             ('gzip', 'COMPRESION_NIVEL', 1),
+             ('gzip', 'COMPRESION_NIVEL', 6),
+             ('gzip', 'COMPRESION_NIVEL', 9),
+             ('br', 'COMPRESION_NIVEL_BR', 4),
+             ('br', 'COMPRESION_NIVEL_BR', 9),
+             ('zstd', 'COMPRESION_NIVEL_ZSTD', 3),
+             ('zstd', 'COMPRESION_NIVEL_ZSTD', 9)]
+
+
+def main():
+    'Prepara los datos, pide cada listado con cada variante e imprime la tabla'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--citas', type=int, default=200000)
+    parser.add_argument('--doctores', type=int, default=50)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+
+    endpoints = {
+        'listar_citas doctor': '/citas/listar_citas?id_doctor=3',
+        'agenda semana centro': '/citas/agenda?id_centro=1&fecha=07-01-2020&vista=semana',
+        'admin/doctores': f'/admin/doctores?per_page={args.doctores}',
+    }
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        app = comun.crear_app(os.path.join(carpeta, 'bench.db'))
+        comun.sembrar(app, n_doctores=args.doctores)
+        comun.sembrar_citas(app, args.citas, n_doctores=args.doctores)
+        cliente = app.test_client()
+        token = comun.token()
+
+        print(f'{"endpoint":>22} | {"codificación":>12} | {"bytes":>9} | {"ratio":>6} | '
+              f'{"cpu_ms":>7} | {"p50_ms":>7}')
+        for nombre, url in endpoints.items():
+            originales = None
+            for codificacion, clave_nivel, nivel in VARIANTES:
+                if codificacion != 'identity' and codificacion not in compresion.COMPRESORES:
+                    continue
+                if clave_nivel:
+                    app.config[clave_nivel] = nivel
+                headers = {'Authorization': f'Bearer {token}',
+                           'Accept-Encoding': codificacion}
+                cpu_antes = metrics.snapshot()['contadores'].get('compresion_cpu_ms', 0)
+                latencias = []
+                for _ in range(args.repeticiones):
+                    t0 = time.perf_counter()
+                    respuesta = cliente.get(url, headers=headers)
+                    latencias.append(time.perf_counter() - t0)
+                    assert respuesta.status_code == 200, respuesta.status_code
+                cpu_ms = (metrics.snapshot()['contadores'].get('compresion_cpu_ms', 0)
+                          - cpu_antes) / args.repeticiones
+                enviados = len(respuesta.data)
+                originales = originales or enviados
+                etiqueta = codificacion + (f' {nivel}' if nivel else '')
+                print(f'{nombre:>22} | {etiqueta:>12} | {enviados:>9} | '
+                      f'{enviados / originales:6.3f} | {cpu_ms:7.2f} | '
+                      f'{comun.percentil(latencias, 50) * 1000:7.2f}')
+
+
+if __name__ == '__main__':
+    main()
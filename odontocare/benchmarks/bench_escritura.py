@@ -0,0 +1,119 @@
+'''
+Benchmark de escritura de citas: un commit por petición frente a la cola
+de escritura con commit agrupado (ESCRITURA_AGRUPADA).
+
+Cada proceso simula un contenedor (servicio_citas o servicio_gestion) con
+--hilos hilos que agendan citas a la vez sobre el mismo fichero SQLite
+(validación de referencias 'sql', sin llamadas HTTP). Se mide el número de
+citas guardadas por segundo, la latencia de las peticiones y las que fallan
+por el bloqueo de escritura de SQLite, con uno y con dos procesos.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_escritura --hilos 16 --peticiones 100
+'''
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import comun
+from servicio_citas import referencias
+from servicio_citas.routes import cita
+from servicio_gestion import metrics
+
+
+def trabajar(ruta, agrupada, inicio, args, cola):
+    'Proceso que agenda citas con --hilos hilos y envía sus resultados a la cola'
+    app = comun.crear_app(ruta, configuracion={'ESCRITURA_AGRUPADA': agrupada})
+    cita.backend_referencias = referencias.crear_backend('sql')
+    headers = {'Authorization': f'Bearer {comun.token()}'}
+    resultados = []
+    lock = threading.Lock()
+
+    def hilo(n):
+        cliente = app.test_client()
+        for i in range(args.peticiones):
+            indice = n * args.peticiones + i
+            datos = {'fecha': (inicio + timedelta(minutes=30 * (indice // args.doctores)))
+                              .strftime('%d-%m-%Y %H:%M'),
+                     'motivo': 'Revision', 'estado': 'activa', 'id_usuario': 1,
+                     'id_paciente': indice % 20 + 1, 'id_doctor': indice % args.doctores + 1,
+                     'id_centro': 1}
+            t0 = time.perf_counter()
+            respuesta = cliente.post('/citas/agendar', json=datos, headers=headers)
+            with lock:
+                resultados.append((respuesta.status_code, time.perf_counter() - t0))
+
+    hilos = [threading.Thread(target=hilo, args=(n,)) for n in range(args.hilos)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    estado = metrics.snapshot()['valores'].get('cola_escritura', {})
+    cola.put((resultados, estado.get('operaciones_por_grupo')))
+
+
+def medir(ruta, agrupada, procesos, inicio, args):
+    'Lanza los procesos a la vez y agrega sus resultados'
+    contexto = multiprocessing.get_context('fork')
+    cola = contexto.Queue()
+    t0 = time.perf_counter()
+    # Cada proceso agenda en su propio año para no chocar con los demás
+    hijos = [contexto.Process(target=trabajar,
+                              args=(ruta, agrupada, inicio.replace(year=inicio.year + p),
+                                    args, cola))
+             for p in range(procesos)]
+    for hijo in hijos:
+        hijo.start()
+    resultados = []
+    grupos = []
+    for _ in hijos:
+        parcial, por_grupo = cola.get()
+        resultados += parcial
+        grupos.append(por_grupo)
+    for hijo in hijos:
+        hijo.join()
+    segundos = time.perf_counter() - t0
+    latencias = [t for codigo, t in resultados if codigo == 201]
+    return {'guardadas': len(latencias),
+            'errores': sum(1 for codigo, _ in resultados if codigo != 201),
+            'citas_s': len(latencias) / segundos,
+            'p50_ms': comun.percentil(latencias, 50) * 1000,
+            'p99_ms': comun.percentil(latencias, 99) * 1000,
+            'por_grupo': grupos}
+
+
+def main():
+    'Compara los dos modos de escritura con uno y dos procesos'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hilos', type=int, default=16)
+    parser.add_argument('--peticiones', type=int, default=100)
+    parser.add_argument('--doctores', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta = os.path.join(carpeta, 'bench.db')
+        comun.sembrar(comun.crear_app(ruta), n_doctores=args.doctores)
+
+        print(f'{args.hilos} hilos x {args.peticiones} citas por proceso')
+        print(f'{"modo":>10} | {"procesos":>8} | {"guardadas":>9} | {"errores":>7} | '
+              f'{"citas/s":>8} | {"p50_ms":>7} | {"p99_ms":>8} | ops/grupo')
+        anio = 2040
+        for procesos in (1, 2):
+            for agrupada in (False, True):
+                r = medir(ruta, agrupada, procesos, datetime(anio, 1, 7, 9, 0), args)
+                anio += procesos
+                modo = 'agrupada' if agrupada else 'individual'
+                por_grupo = ', '.join(str(g) for g in r['por_grupo']) if agrupada else '-'
+                print(f'{modo:>10} | {procesos:>8} | {r["guardadas"]:>9} | '
+                      f'{r["errores"]:>7} | {r["citas_s"]:8.0f} | {r["p50_ms"]:7.1f} | '
+                      f'{r["p99_ms"]:8.1f} | {por_grupo}')
+
+
+if __name__ == '__main__':
+    main()
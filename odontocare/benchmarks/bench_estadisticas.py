@@ -0,0 +1,65 @@
+'''
+Benchmark de /citas/estadisticas sobre una tabla de citas grande.
+Mide la latencia de varias agregaciones típicas, con y sin la caché de
+periodos cerrados.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_estadisticas --citas 5000000
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+# Agregaciones medidas: nombre -> query string
+CONSULTAS = {
+    'mes por doctor': 'agrupar=doctor&periodo=mes&desde=01-03-2020&hasta=31-03-2020',
+    'semana por centro y estado': 'agrupar=centro,estado&periodo=semana'
+                                  '&desde=01-03-2020&hasta=31-03-2020',
+    'dia de un doctor': 'agrupar=estado&periodo=dia&id_doctor=3'
+                        '&desde=01-03-2020&hasta=31-03-2020',
+    'trimestre por doctor': 'agrupar=doctor&desde=01-01-2020&hasta=31-03-2020',
+    'todo por centro': 'agrupar=centro',
+}
+
+
+def main():
+    'Carga las citas y mide cada consulta'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--citas', type=int, default=1000000)
+    parser.add_argument('--doctores', type=int, default=200)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    args = parser.parse_args()
+
+    from benchmarks import comun
+    from servicio_citas.config import Config
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        app = comun.crear_app(os.path.join(carpeta, 'bench.db'))
+        comun.sembrar(app, n_doctores=args.doctores)
+        t0 = time.perf_counter()
+        comun.sembrar_citas(app, args.citas, n_doctores=args.doctores)
+        print(f'{args.citas} citas cargadas en {time.perf_counter() - t0:.1f} s\n')
+
+        cliente = app.test_client()
+        headers = {'Authorization': f'Bearer {comun.token()}'}
+
+        print(f'{"consulta":<28} | {"grupos":>6} | {"sin caché (ms)":>14} | {"con caché (ms)":>14}')
+        for nombre, query in CONSULTAS.items():
+            tiempos = {}
+            for cache in (False, True):
+                Config.ESTADISTICAS_CACHE = cache
+                mejores = []
+                for _ in range(args.repeticiones):
+                    t0 = time.perf_counter()
+                    respuesta = cliente.get(f'/citas/estadisticas?{query}', headers=headers)
+                    mejores.append(time.perf_counter() - t0)
+                tiempos[cache] = min(mejores) * 1000
+            grupos = len(respuesta.get_json()['estadisticas'])
+            print(f'{nombre:<28} | {grupos:>6} | {tiempos[False]:>14.1f} | {tiempos[True]:>14.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+Benchmark de /citas/huecos: búsqueda de los próximos huecos libres entre
+cientos de doctores de la misma especialidad.
+
+Los doctores tienen las próximas semanas ocupadas al --ocupacion (en tanto
+por uno) dentro de la jornada, y la tabla tiene además un histórico de
+citas pasadas. Se mide la latencia de la petición completa desde el
+cliente de pruebas de Flask, buscando desde distintos momentos.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_huecos --doctores 300 --ocupacion 0.9
+'''
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import comun
+from servicio_citas.config import Config
+from servicio_citas.models.citas import CitaMedica
+from servicio_gestion.extensions import db
+from servicio_gestion.models.doctores import Doctor
+
+
+def sembrar_agendas(app, n_doctores, n_centros, dias, ocupacion, inicio):
+    '''
+    Ocupa la jornada de cada doctor durante 'dias' días laborables desde
+    'inicio' con la probabilidad 'ocupacion' por franja de CITA_DURACION.
+    '''
+    aleatorio = random.Random(1)
+    franja = timedelta(minutes=Config.CITA_DURACION)
+    apertura = datetime.strptime(Config.JORNADA_INICIO, '%H:%M')
+    cierre = datetime.strptime(Config.JORNADA_FIN, '%H:%M')
+    franjas_dia = int((cierre - apertura) / franja)
+    filas = []
+    for dia in range(dias):
+        fecha_dia = inicio + timedelta(days=dia)
+        if fecha_dia.weekday() >= 5:
+            continue
+        fecha_dia = fecha_dia.replace(hour=apertura.hour, minute=apertura.minute)
+        for id_doctor in range(1, n_doctores + 1):
+            for i in range(franjas_dia):
+                if aleatorio.random() < ocupacion:
+                    filas.append({'fecha': fecha_dia + i * franja, 'motivo': 'Revision',
+                                  'estado': 'activa', 'id_paciente': id_doctor % 20 + 1,
+                                  'id_doctor': id_doctor,
+                                  'id_centro': id_doctor % n_centros + 1, 'id_usuario': 1})
+    with app.app_context():
+        db.session.execute(CitaMedica.__table__.insert(), filas)
+        db.session.commit()
+    return len(filas)
+
+
+def main():
+    'Prepara los datos, lanza las búsquedas e imprime las latencias'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doctores', type=int, default=300)
+    parser.add_argument('--centros', type=int, default=4)
+    parser.add_argument('--ocupacion', type=float, default=0.9)
+    parser.add_argument('--dias', type=int, default=28)
+    parser.add_argument('--historico', type=int, default=500000,
+                        help='citas pasadas adicionales en la tabla')
+    parser.add_argument('--repeticiones', type=int, default=50)
+    parser.add_argument('--n', type=int, default=10)
+    args = parser.parse_args()
+
+    manana = (datetime.now() + timedelta(days=1)).replace(hour=0, minute=0, second=0,
+                                                          microsecond=0)
+    with tempfile.TemporaryDirectory() as carpeta:
+        app = comun.crear_app(os.path.join(carpeta, 'bench.db'))
+        comun.sembrar(app, n_doctores=args.doctores, n_centros=args.centros)
+        # La mitad de los doctores cambia de especialidad
+        with app.app_context():
+            Doctor.query.filter(Doctor.id_doctor % 2 == 0).update({'especialidad': 'Ortodoncia'})
+            db.session.commit()
+        comun.sembrar_citas(app, args.historico, n_doctores=args.doctores,
+                            n_centros=args.centros)
+        citas = sembrar_agendas(app, args.doctores, args.centros, args.dias,
+                                args.ocupacion, manana)
+        print(f'{args.doctores} doctores, {citas} citas próximas, {args.historico} históricas')
+
+        cliente = app.test_client()
+        headers = {'Authorization': f'Bearer {comun.token()}'}
+        aleatorio = random.Random(2)
+        consultas = {
+            'especialidad': lambda desde: {'especialidad': 'Endodoncia'},
+            'especialidad+centro': lambda desde: {'especialidad': 'Endodoncia', 'id_centro': 2},
+            'hueco 90 min': lambda desde: {'especialidad': 'Ortodoncia', 'duracion': 90},
+        }
+        print(f'{"consulta":>22} | {"p50_ms":>8} | {"p95_ms":>8} | primer hueco')
+        for nombre, parametros in consultas.items():
+            latencias = []
+            for _ in range(args.repeticiones):
+                desde = manana + timedelta(days=aleatorio.randrange(args.dias // 2),
+                                           minutes=aleatorio.randrange(0, 24 * 60, 15))
+                query = dict(parametros(desde), n=args.n,
+                             desde=desde.strftime('%d-%m-%Y %H:%M'))
+                t0 = time.perf_counter()
+                respuesta = cliente.get('/citas/huecos', query_string=query, headers=headers)
+                latencias.append(time.perf_counter() - t0)
+                assert respuesta.status_code == 200, respuesta.json
+                assert len(respuesta.json['huecos']) == args.n, respuesta.json
+            print(f'{nombre:>22} | {comun.percentil(latencias, 50) * 1000:8.1f} | '
+                  f'{comun.percentil(latencias, 95) * 1000:8.1f} | '
+                  f'{respuesta.json["huecos"][0]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+'''
+Benchmark de saturación del pool de conexiones sobre un fichero SQLite.
+
+Varios hilos simulan peticiones concurrentes: cada una saca una conexión
+del pool, ejecuta una consulta y la retiene --retencion segundos (el resto
+del trabajo de la petición). Para cada combinación de tamaño del pool y
+overflow se mide la espera por una conexión libre (p50, p99 y máxima), las
+peticiones por segundo y las que agotan DB_POOL_TIMEOUT. El pool no es
+equitativo: el hilo que devuelve una conexión suele volver a obtenerla
+antes que los que esperan, así que la saturación se ve en la cola de la
+distribución y en los timeouts más que en la mediana.
+Después se comprueba el plazo por sentencia (DB_STATEMENT_TIMEOUT) con
+una consulta larga y que un proceso hijo creado con fork abre sus propias
+conexiones.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_pool --hilos 32 --peticiones 40
+'''
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as TimeoutPool
+
+from benchmarks import comun
+from servicio_gestion import base_datos
+from servicio_gestion.extensions import db
+
+
+# (pool_size, max_overflow)
+POOLS = [(1, 0), (5, 0), (5, 10), (20, 0), (32, 0)]
+
+
+def lanzar(app, hilos, peticiones, retencion):
+    'Lanza las peticiones concurrentes; devuelve esperas, errores y segundos totales'
+    esperas = []
+    errores = []
+    lock = threading.Lock()
+
+    def trabajador():
+        for _ in range(peticiones):
+            with app.app_context():
+                t0 = time.perf_counter()
+                try:
+                    db.session.connection()
+                except TimeoutPool:
+                    with lock:
+                        errores.append('timeout')
+                    continue
+                espera = time.perf_counter() - t0
+                db.session.execute(text('SELECT count(*) FROM doctores')).scalar()
+                time.sleep(retencion)
+                db.session.remove()
+            with lock:
+                esperas.append(espera)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=trabajador) for _ in range(hilos)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return esperas, errores, time.perf_counter() - t0
+
+
+def consulta_hijo(app, cola):
+    'Consulta desde un proceso hijo (fork) e informa de si ha ido bien'
+    try:
+        with app.app_context():
+            cola.put(db.session.execute(text('SELECT count(*) FROM doctores')).scalar())
+    except Exception as e:
+        cola.put(repr(e))
+
+
+def main():
+    'Ejecuta las combinaciones de pool, el plazo por sentencia y la prueba de fork'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hilos', type=int, default=32)
+    parser.add_argument('--peticiones', type=int, default=40)
+    parser.add_argument('--retencion', type=float, default=0.005)
+    parser.add_argument('--pool-timeout', type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta = os.path.join(carpeta, 'bench.db')
+        url = 'sqlite:///' + ruta
+        comun.sembrar(comun.crear_app(ruta), n_doctores=100)
+
+        print(f'{args.hilos} hilos x {args.peticiones} peticiones, conexión retenida '
+              f'{args.retencion * 1000:.0f} ms, DB_POOL_TIMEOUT={args.pool_timeout} s')
+        print(f'{"pool":>6} | {"overflow":>8} | {"espera_p50_ms":>13} | {"espera_p99_ms":>13} | '
+              f'{"espera_max_ms":>13} | {"req/s":>7} | timeouts')
+        for tamano, overflow in POOLS:
+            opciones = dict(base_datos.opciones_motor(url), pool_size=tamano,
+                            max_overflow=overflow, pool_timeout=args.pool_timeout)
+            app = comun.crear_app(ruta, configuracion={'SQLALCHEMY_ENGINE_OPTIONS': opciones})
+            esperas, errores, segundos = lanzar(app, args.hilos, args.peticiones,
+                                                args.retencion)
+            print(f'{tamano:>6} | {overflow:>8} | '
+                  f'{comun.percentil(esperas, 50) * 1000:13.2f} | '
+                  f'{comun.percentil(esperas, 99) * 1000:13.2f} | '
+                  f'{max(esperas) * 1000:13.2f} | '
+                  f'{len(esperas) / segundos:7.0f} | {len(errores)}')
+            with app.app_context():
+                db.engine.dispose()
+
+        # Plazo por sentencia: una consulta recursiva larga se interrumpe
+        app = comun.crear_app(ruta, configuracion={'DB_STATEMENT_TIMEOUT': 50})
+        larga = text('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n '
+                     'WHERE i < 100000000) SELECT count(*) FROM n')
+        with app.app_context():
+            t0 = time.perf_counter()
+            try:
+                db.session.execute(larga).scalar()
+                resultado = 'terminada'
+            except OperationalError as e:
+                resultado = f'interrumpida ({e.orig})'
+            print(f'DB_STATEMENT_TIMEOUT=50 ms: consulta larga {resultado} '
+                  f'a los {(time.perf_counter() - t0) * 1000:.0f} ms')
+            # La conexión sigue siendo válida después de la interrupción
+            db.session.rollback()
+            db.session.execute(text('SELECT 1')).scalar()
+
+        # Fork con conexiones abiertas en el padre
+        if 'fork' in multiprocessing.get_all_start_methods():
+            with app.app_context():
+                db.session.execute(text('SELECT 1')).scalar()
+            contexto = multiprocessing.get_context('fork')
+            cola = contexto.Queue()
+            hijo = contexto.Process(target=consulta_hijo, args=(app, cola))
+            hijo.start()
+            hijo.join()
+            print(f'proceso hijo tras fork: {cola.get()} doctores')
+
+
+if __name__ == '__main__':
+    main()
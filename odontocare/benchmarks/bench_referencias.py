@@ -0,0 +1,117 @@
+'''
+Benchmark de /citas/agendar con cada backend de validación de referencias:
+    - http: tres consultas a servicio_gestion por cita
+    - sql: una consulta con joins sobre la base de datos compartida
+    - replica: réplica local sincronizada desde el outbox de servicio_gestion
+
+servicio_gestion se sirve en otro proceso (sin latencia artificial por
+defecto, como cuando los dos servicios están en la misma máquina) y
+servicio_citas en el proceso del benchmark, sobre el mismo fichero SQLite.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_referencias --peticiones 500 --concurrencia 8
+'''
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from benchmarks import comun
+from servicio_citas import referencias, replica
+from servicio_citas.config import Config
+from servicio_citas.routes import cita
+from servicio_gestion import metrics
+from servicio_gestion.migraciones import inicializar_outbox
+
+
+BACKENDS = ['http', 'sql', 'replica']
+
+
+def medir_backend(nombre, indice, url_citas, args):
+    'Agenda citas con el backend indicado y devuelve las métricas'
+    cita.backend_referencias = referencias.crear_backend(nombre)
+    if nombre == 'replica':
+        replica.sincronizar()
+
+    headers = {'Authorization': f'Bearer {comun.token()}'}
+    # Cada backend agenda en su propio año para no chocar con los anteriores
+    inicio = datetime(2030 + indice, 1, 7, 9, 0)
+
+    def agendar(i):
+        datos = {'fecha': (inicio + timedelta(minutes=30 * (i // args.doctores)))
+                          .strftime('%d-%m-%Y %H:%M'),
+                 'motivo': 'Revision', 'estado': 'activa', 'id_usuario': 1,
+                 'id_paciente': i % 20 + 1, 'id_doctor': i % args.doctores + 1,
+                 'id_centro': 1}
+        t0 = time.perf_counter()
+        respuesta = requests.post(f'{url_citas}/citas/agendar', json=datos,
+                                  headers=headers, timeout=60)
+        return respuesta.status_code, time.perf_counter() - t0
+
+    llamadas_antes = metrics.snapshot()['contadores'].get('gestion_peticiones', 0)
+    t_inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+        resultados = list(pool.map(agendar, range(args.peticiones)))
+    total = time.perf_counter() - t_inicio
+    llamadas = metrics.snapshot()['contadores'].get('gestion_peticiones', 0) - llamadas_antes
+
+    latencias = [t for _, t in resultados]
+    return {
+        'backend': nombre,
+        'correctas': sum(1 for codigo, _ in resultados if codigo == 201),
+        'peticiones': args.peticiones,
+        'llamadas_gestion': llamadas,
+        'peticiones_por_segundo': round(args.peticiones / total, 1),
+        'p50_ms': round(comun.percentil(latencias, 50) * 1000, 2),
+        'p95_ms': round(comun.percentil(latencias, 95) * 1000, 2),
+    }
+
+
+def main():
+    'Mide cada backend sobre la misma base de datos e imprime la comparación'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peticiones', type=int, default=500)
+    parser.add_argument('--concurrencia', type=int, default=8)
+    parser.add_argument('--latencia', type=float, default=0.0,
+                        help='latencia simulada de servicio_gestion (segundos)')
+    parser.add_argument('--doctores', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta_db = os.path.join(carpeta, 'bench.db')
+        app_citas = comun.crear_app(ruta_db)
+        comun.sembrar(app_citas, n_doctores=args.doctores)
+        inicializar_outbox(app_citas)
+
+        # servicio_gestion en su propio proceso, como en el despliegue real
+        gestion = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_citas_paralelo',
+                                    '--servir-gestion', ruta_db,
+                                    '--latencia', str(args.latencia)],
+                                   stdout=subprocess.PIPE, text=True)
+        Config.GESTION_URL = gestion.stdout.readline().strip()
+        servidor_citas, url_citas = comun.arrancar_servidor(app_citas)
+
+        resultados = [medir_backend(nombre, indice, url_citas, args)
+                      for indice, nombre in enumerate(BACKENDS)]
+
+        servidor_citas.shutdown()
+        gestion.terminate()
+        gestion.wait()
+
+    columnas = ['backend', 'correctas', 'peticiones', 'llamadas_gestion',
+                'peticiones_por_segundo', 'p50_ms', 'p95_ms']
+    print(' | '.join(f'{c:>22}' for c in columnas))
+    for fila in resultados:
+        print(' | '.join(f'{fila[c]!s:>22}' for c in columnas))
+
+
+if __name__ == '__main__':
+    main()
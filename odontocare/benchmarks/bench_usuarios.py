@@ -0,0 +1,145 @@
+'''
+Benchmark de login y de altas de pacientes y doctores con muchos usuarios,
+con y sin los índices de búsqueda:
+    - sin_indices: esquema anterior, sin índice en usuarios.username ni en
+      los nombres, y con un índice único sobre los hash de las contraseñas
+    - con_indices: índice único en username, índices en doctores.nombre y
+      pacientes.nombre, y sin índice sobre las contraseñas
+
+Para cada variante se mide la carga de usuarios (filas por segundo), la
+búsqueda por username, el login completo (incluye verificar el hash) y
+las altas de paciente y doctor (incluyen generar el hash).
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.bench_usuarios --usuarios 1000000
+'''
+
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+from benchmarks import comun
+from servicio_gestion.extensions import db
+from servicio_gestion.models.doctores import Doctor
+from servicio_gestion.models.pacientes import Paciente
+from servicio_gestion.models.usuarios import Usuario
+
+
+def quitar_indices(app):
+    'Deja la base de datos con los índices del esquema anterior'
+    with app.app_context():
+        db.session.execute(text('DROP INDEX ix_usuarios_username'))
+        db.session.execute(text('DROP INDEX ix_doctores_nombre'))
+        db.session.execute(text('DROP INDEX ix_pacientes_nombre'))
+        db.session.execute(text('CREATE UNIQUE INDEX ux_usuarios_password ON usuarios (password)'))
+        db.session.commit()
+
+
+def sembrar_usuarios(app, n_usuarios, lote=50000):
+    '''
+    Carga 'n_usuarios' usuarios: uno de cada diez es médico y el resto
+    pacientes. Los hash son cadenas únicas de la longitud de un hash real.
+    Devuelve las filas por segundo.
+    '''
+    t0 = time.perf_counter()
+    with app.app_context():
+        for base in range(0, n_usuarios, lote):
+            fin = min(base + lote, n_usuarios)
+            db.session.execute(Usuario.__table__.insert(), [
+                {'id_usuario': i + 1, 'username': f'usuario_{i}',
+                 'password': f'scrypt:32768:8:1${i:016d}${"0" * 90}',
+                 'rol': 'medico' if i % 10 == 0 else 'paciente'}
+                for i in range(base, fin)])
+            db.session.execute(Doctor.__table__.insert(), [
+                {'id_usuario': i + 1, 'nombre': f'Doctor {i}', 'especialidad': 'Endodoncia'}
+                for i in range(base, fin) if i % 10 == 0])
+            db.session.execute(Paciente.__table__.insert(), [
+                {'id_usuario': i + 1, 'nombre': f'Paciente {i}',
+                 'telefono': '+34 600 000 000', 'estado': 'ACTIVO'}
+                for i in range(base, fin) if i % 10 != 0])
+            db.session.commit()
+    return n_usuarios / (time.perf_counter() - t0)
+
+
+def medir_variante(nombre, args):
+    'Crea una base de datos para la variante y devuelve las métricas'
+    with tempfile.TemporaryDirectory() as carpeta:
+        app = comun.crear_app(os.path.join(carpeta, 'bench.db'))
+        if nombre == 'sin_indices':
+            quitar_indices(app)
+        filas_por_segundo = sembrar_usuarios(app, args.usuarios)
+
+        # Usuario con contraseña real para el login, el último de la tabla
+        with app.app_context():
+            db.session.add(Usuario(username='usuario_login', rol='admin',
+                                   password=generate_password_hash('clave',
+                                                                   method='scrypt:32768:8:1')))
+            db.session.commit()
+
+            # Búsqueda por username de usuarios repartidos por toda la tabla
+            paso = max(1, args.usuarios // args.repeticiones)
+            busquedas = []
+            for i in range(0, args.usuarios, paso):
+                t0 = time.perf_counter()
+                Usuario.query.filter_by(username=f'usuario_{i}').first()
+                busquedas.append(time.perf_counter() - t0)
+
+        cliente = app.test_client()
+        headers = {'Authorization': f'Bearer {comun.token()}'}
+        logins, altas_paciente, altas_doctor = [], [], []
+        for i in range(args.repeticiones):
+            t0 = time.perf_counter()
+            respuesta = cliente.post('/auth/login', json={'username': 'usuario_login',
+                                                          'password': 'clave', 'rol': 'admin'})
+            logins.append(time.perf_counter() - t0)
+            assert respuesta.status_code == 200, respuesta.json
+
+            t0 = time.perf_counter()
+            respuesta = cliente.post('/admin/paciente', headers=headers,
+                                     json={'username': f'nuevo_paciente_{i}', 'password': 'clave',
+                                           'rol': 'paciente', 'nombre': f'Nuevo Paciente {i}',
+                                           'telefono': '+34 611 111 111', 'estado': 'activo'})
+            altas_paciente.append(time.perf_counter() - t0)
+            assert respuesta.status_code == 201, respuesta.json
+
+            t0 = time.perf_counter()
+            respuesta = cliente.post('/admin/doctor', headers=headers,
+                                     json={'username': f'nuevo_doctor_{i}', 'password': 'clave',
+                                           'rol': 'medico', 'nombre': f'Nuevo Doctor {i}',
+                                           'especialidad': 'Ortodoncia'})
+            altas_doctor.append(time.perf_counter() - t0)
+            assert respuesta.status_code == 201, respuesta.json
+
+    return {
+        'variante': nombre,
+        'carga_filas_s': round(filas_por_segundo),
+        'busqueda_p50_ms': round(comun.percentil(busquedas, 50) * 1000, 3),
+        'login_p50_ms': round(comun.percentil(logins, 50) * 1000, 1),
+        'alta_paciente_p50_ms': round(comun.percentil(altas_paciente, 50) * 1000, 1),
+        'alta_doctor_p50_ms': round(comun.percentil(altas_doctor, 50) * 1000, 1),
+    }
+
+
+def main():
+    'Mide las dos variantes e imprime la comparación'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--usuarios', type=int, default=1000000)
+    parser.add_argument('--repeticiones', type=int, default=20)
+    args = parser.parse_args()
+
+    resultados = [medir_variante(nombre, args) for nombre in ('sin_indices', 'con_indices')]
+
+    columnas = ['variante', 'carga_filas_s', 'busqueda_p50_ms', 'login_p50_ms',
+                'alta_paciente_p50_ms', 'alta_doctor_p50_ms']
+    print(' | '.join(f'{c:>20}' for c in columnas))
+    for fila in resultados:
+        print(' | '.join(f'{fila[c]!s:>20}' for c in columnas))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+'''
+Utilidades comunes para los benchmarks de OdontoCare:
+    - creación de una app Flask con todos los blueprints sobre un fichero SQLite
+    - carga de datos de prueba directamente en la base de datos
+    - generación de tokens JWT
+    - arranque de servidores WSGI en hilos secundarios
+Los benchmarks se ejecutan desde la carpeta 'odontocare':
+    python -m benchmarks.<nombre_benchmark>
+'''
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+# La configuración se lee al importar los servicios, así que el secreto JWT
+# debe existir antes de importar nada de servicio_gestion o servicio_citas
+os.environ.setdefault('JWT_SECRET_KEY', 'clave-benchmark-odontocare-32-bytes')
+
+from flask import Flask, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from servicio_citas import cola_escritura
+from servicio_citas.config import Config
+from servicio_citas.models.citas import CitaMedica
+from servicio_citas.routes import cita
+from servicio_gestion import base_datos, compresion, perfilado, trazas
+from servicio_gestion.config import EstadoUsuario
+from servicio_gestion.extensions import db
+from servicio_gestion.models.centros_medicos import CentroMedico
+from servicio_gestion.models.doctores import Doctor
+from servicio_gestion.models.pacientes import Paciente
+from servicio_gestion.models.usuarios import Usuario
+from servicio_gestion.routes import main, auth, admin
+
+
+def crear_app(ruta_db, latencia_admin=0.0, configuracion=None):
+    '''
+    Crea una app con todos los blueprints apuntando al fichero SQLite 'ruta_db'.
+    Si 'latencia_admin' es mayor que 0, cada petición a /admin espera ese
+    tiempo (en segundos) para simular un servicio_gestion lento.
+    'configuracion' son valores adicionales de app.config (por ejemplo,
+    SQLALCHEMY_ENGINE_OPTIONS) que se aplican antes de crear el motor.
+    '''
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + ruta_db
+    app.config['DEBUG'] = False
+    app.config.update(configuracion or {})
+    db.init_app(app)
+    base_datos.init_app(app)
+    compresion.init_app(app)
+    trazas.init_app(app)
+    perfilado.init_app(app)
+    cola_escritura.init_app(app)
+
+    app.register_blueprint(main.main, url_prefix='/')
+    app.register_blueprint(auth.auth_bp, url_prefix='/auth')
+    app.register_blueprint(admin.admin_bp, url_prefix='/admin')
+    app.register_blueprint(cita.citas_bp, url_prefix='/citas')
+
+    if latencia_admin > 0:
+        @app.before_request
+        def simular_latencia():
+            if request.path.startswith('/admin'):
+                time.sleep(latencia_admin)
+
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def sembrar(app, n_doctores=10, n_pacientes=20, n_centros=2):
+    'Carga usuarios, doctores, pacientes y centros médicos de prueba'
+    with app.app_context():
+        usuarios = [Usuario(username=f'user_medico_{i}', password=f'hash_medico_{i}',
+                            rol='medico') for i in range(1, n_doctores + 1)]
+        usuarios += [Usuario(username=f'user_paciente_{i}', password=f'hash_paciente_{i}',
+                             rol='paciente') for i in range(1, n_pacientes + 1)]
+        db.session.add_all(usuarios)
+        db.session.flush()
+        db.session.add_all([Doctor(id_usuario=u.id_usuario, nombre=f'Doctor {i}',
+                                   especialidad='Endodoncia')
+                            for i, u in enumerate(usuarios[:n_doctores], start=1)])
+        db.session.add_all([Paciente(id_usuario=u.id_usuario, nombre=f'Paciente {i}',
+                                     telefono='+34 600 000 000',
+                                     estado=EstadoUsuario.ACTIVO)
+                            for i, u in enumerate(usuarios[n_doctores:], start=1)])
+        db.session.add_all([CentroMedico(nombre=f'Centro {i}', direccion=f'Calle {i}')
+                            for i in range(1, n_centros + 1)])
+        db.session.commit()
+
+
+def sembrar_citas(app, n_citas, n_doctores=10, n_pacientes=20, n_centros=2,
+                  inicio=datetime(2020, 1, 6, 9, 0), lote=50000):
+    '''
+    Carga citas de 30 minutos repartidas entre doctores, pacientes y centros.
+    Cada doctor trabaja siempre en el mismo centro; una de cada diez está cancelada.
+    '''
+    with app.app_context():
+        for base in range(0, n_citas, lote):
+            filas = []
+            for i in range(base, min(base + lote, n_citas)):
+                id_doctor = i % n_doctores + 1
+                franja = i // n_doctores
+                filas.append({'fecha': inicio + timedelta(minutes=30 * franja),
+                              'motivo': 'Revision',
+                              'estado': 'cancelada' if i % 10 == 0 else 'activa',
+                              'id_paciente': i % n_pacientes + 1,
+                              'id_doctor': id_doctor,
+                              'id_centro': id_doctor % n_centros + 1,
+                              'id_usuario': 1})
+            db.session.execute(CitaMedica.__table__.insert(), filas)
+            db.session.commit()
+
+
+def token(rol='admin', username='user_admin'):
+    'Genera un token JWT válido para el rol indicado'
+    return auth.generate_jwt_token(username, rol)
+
+
+class _HandlerSilencioso(WSGIRequestHandler):
+    'Handler WSGI que no escribe una línea de log por petición'
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def arrancar_servidor(app, puerto=0):
+    '''
+    Arranca un servidor WSGI multihilo en segundo plano.
+    Devuelve (servidor, url_base); se detiene con servidor.shutdown().
+    '''
+    servidor = make_server('127.0.0.1', puerto, app, threaded=True,
+                           request_handler=_HandlerSilencioso)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    return servidor, f'http://127.0.0.1:{servidor.server_port}'
+
+
+def percentil(valores, p):
+    'Percentil p (0-100) de una lista de valores'
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
@@ -0,0 +1,416 @@
+'''
+Generador de conjuntos de datos sintéticos de OdontoCare de cualquier tamaño,
+derivados de los CSV de la carpeta 'data':
+    - nombres y apellidos, especialidades (con su proporción), prefijos de
+      teléfono y proporción de pacientes inactivos de los CSV de médicos y pacientes
+    - nombres y direcciones de centros médicos con el patrón de datos_clinicas.csv
+    - historial de citas de lunes a viernes dentro de la jornada (JORNADA_INICIO
+      a JORNADA_FIN, citas de CITA_DURACION minutos): cada doctor pasa consulta
+      en su centro habitual (algunos días en un segundo centro), ocupa una parte
+      de sus huecos de cada día y algunos pacientes van mucho más que otros
+Los identificadores son consecutivos desde 1 en el orden de carga de
+script_cliente (usuarios admin y secretaria, doctores, pacientes y centros),
+así que las referencias de las citas son consistentes. Con la misma semilla
+y los mismos parámetros el resultado es siempre el mismo.
+
+Formatos de salida:
+    - csv: los ficheros de 'data' (mismo formato, sin cabecera) y datos_citas.csv
+      (fecha con el formato de la API, motivo, estado, id_usuario, id_paciente,
+      id_doctor, id_centro)
+    - ndjson: un fichero por tabla con todas sus columnas (fechas ISO 8601)
+    - sqlite: un fichero SQLite nuevo con el esquema de los servicios. Las
+      contraseñas se guardan con un hash PBKDF2 de una sola iteración: sirven
+      para hacer login en pruebas, no para producción
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.datos_sinteticos --escala 100 --formato sqlite --salida datos.db
+    python -m benchmarks.datos_sinteticos --doctores 50 --pacientes 5000 --dias 60 \\
+        --formato csv --salida datos_50
+'''
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import re
+import string
+from collections import Counter
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+
+CARPETA_DATOS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'data')
+FORMATO_FECHA = '%d-%m-%Y %H:%M'
+LOTE = 50000
+
+# Motivos de consulta por especialidad (los que no aparecen usan los generales)
+MOTIVOS = {
+    'Odontopediatría': ['Revision infantil', 'Selladores', 'Fluorizacion', 'Caries de leche'],
+    'Endodoncia': ['Endodoncia', 'Dolor de muela', 'Revision endodoncia', 'Reendodoncia'],
+    'Ortodoncia': ['Ajuste de brackets', 'Revision ortodoncia', 'Estudio ortodoncia',
+                   'Retenedor'],
+    'Periodoncia': ['Limpieza', 'Curetaje', 'Revision encias', 'Mantenimiento periodontal'],
+    'Cirugía': ['Extraccion', 'Cordal', 'Implante', 'Revision postoperatoria'],
+}
+MOTIVOS_GENERALES = ['Revision periodica', 'Primera visita', 'Urgencia', 'Limpieza']
+
+
+def _leer_csv(nombre):
+    'Filas del CSV de la carpeta data'
+    with open(os.path.join(CARPETA_DATOS, nombre), newline='', encoding='utf-8') as fichero:
+        return [fila for fila in csv.reader(fichero) if fila]
+
+
+def fuentes():
+    '''
+    Vocabulario y proporciones de los CSV de 'data': nombres de pila, apellidos,
+    especialidades, prefijos de teléfono, pacientes inactivos y patrón de centros
+    '''
+    staff = _leer_csv('datos_usuarios.csv')
+    medicos = _leer_csv('datos_medicos.csv')
+    pacientes = _leer_csv('datos_pacientes.csv')
+    clinicas = _leer_csv('datos_clinicas.csv')
+
+    nombres, apellidos = set(), set()
+    for fila in medicos + pacientes:
+        palabras = fila[3].split()
+        # Los dos últimos son apellidos; con solo dos palabras, el último
+        corte = len(palabras) - 2 if len(palabras) >= 3 else len(palabras) - 1
+        nombres.update(palabras[:corte])
+        apellidos.update(palabras[corte:])
+
+    prefijos = sorted({m.group(1) for fila in pacientes
+                       if (m := re.fullmatch(r'\+34 (\d{3}) \d{2} \d{2} \d{2}', fila[4]))})
+
+    vias, extras, ciudades, codigos = set(), set(), set(), set()
+    for _, direccion in clinicas:
+        m = re.fullmatch(r'(?P<via>.+?),? \d+ (?P<extra>\w+) \d+ (?P<ciudad>[^,]+), '
+                         r'(?P<cp>\d{5})', direccion)
+        if m:
+            vias.add(m.group('via').split()[0])
+            extras.add(m.group('extra'))
+            ciudades.add(m.group('ciudad'))
+            codigos.add(m.group('cp')[:3])
+
+    return {'staff': staff,
+            'nombres': sorted(nombres),
+            'apellidos': sorted(apellidos),
+            'especialidades': Counter(fila[4] for fila in medicos),
+            'prefijos': prefijos or ['600'],
+            'inactivos': sum(fila[5] == 'inactivo' for fila in pacientes) / len(pacientes),
+            'palabras_centro': [sorted({n.split()[i] for n, _ in clinicas}) for i in (0, -1)],
+            'vias': sorted(vias) or ['Calle'],
+            'extras': sorted(extras) or ['Piso'],
+            'ciudades': sorted(ciudades) or ['Madrid'],
+            'codigos': sorted(codigos) or ['280']}
+
+
+def _unico(generar, usados, intentos=50, respaldo=None):
+    '''
+    Valor de generar() que no esté en 'usados'. Si se agotan los intentos (hay
+    más registros que combinaciones) se usa respaldo(valor) o se acepta un repetido
+    '''
+    for _ in range(intentos):
+        valor = generar()
+        if valor not in usados:
+            break
+    else:
+        if respaldo is not None:
+            valor = respaldo(valor)
+    usados.add(valor)
+    return valor
+
+
+def _nombre(rng, f):
+    'Nombre completo: uno o dos nombres de pila y dos apellidos'
+    pila = rng.sample(f['nombres'], 2 if rng.random() < 0.25 else 1)
+    return ' '.join(pila + rng.sample(f['apellidos'], 2))[:80]
+
+
+def _telefono(rng, f):
+    'Teléfono con uno de los prefijos de los CSV'
+    return (f'+34 {rng.choice(f["prefijos"])} {rng.randrange(100):02d} '
+            f'{rng.randrange(100):02d} {rng.randrange(100):02d}')
+
+
+def _nombre_centro(rng, f):
+    'Nombre de centro médico con el patrón de datos_clinicas.csv'
+    primeras, ultimas = f['palabras_centro']
+    return f'{rng.choice(primeras)} {rng.choice(ultimas)} {rng.choice(f["apellidos"])}'[:40]
+
+
+def _direccion(rng, f):
+    'Dirección con el patrón de datos_clinicas.csv'
+    return (f'{rng.choice(f["vias"])} {rng.choice(f["nombres"])} '
+            f'{rng.choice(f["apellidos"])} {rng.randint(1, 150)} '
+            f'{rng.choice(f["extras"])} {rng.randint(1, 9)} {rng.choice(f["ciudades"])}, '
+            f'{rng.choice(f["codigos"])}{rng.randrange(100):02d}')[:80]
+
+
+def _hash_password(rng, password):
+    'Hash de Werkzeug (check_password_hash) con PBKDF2 de una iteración y sal de rng'
+    sal = ''.join(rng.choices(string.ascii_letters + string.digits, k=16))
+    valor = hashlib.pbkdf2_hmac('sha256', password.encode(), sal.encode(), 1).hex()
+    return f'pbkdf2:sha256:1${sal}${valor}'
+
+
+class Dataset:
+    'Usuarios, doctores, pacientes y centros generados; las citas se generan al recorrerlas'
+
+    def __init__(self, semilla=1, n_doctores=10, n_pacientes=20, n_centros=2,
+                 inicio=datetime(2025, 1, 6), dias=90, ocupacion=0.6, cancelacion=0.1,
+                 jornada=('09:00', '17:00'), duracion=30):
+        self.semilla = semilla
+        self.inicio = inicio
+        self.dias = dias
+        self.ocupacion = ocupacion
+        self.cancelacion = cancelacion
+        self.jornada = jornada
+        self.duracion = duracion
+        rng = random.Random(f'{semilla}-entidades')
+        f = fuentes()
+
+        self.usuarios = [{'id_usuario': i, 'username': fila[0], 'password': fila[1],
+                          'rol': fila[2]} for i, fila in enumerate(f['staff'], start=1)]
+        self.id_secretaria = next((u['id_usuario'] for u in self.usuarios
+                                   if u['rol'] == 'secretaria'), 1)
+
+        # Centros de distinto tamaño: el peso decide cuántos doctores tiene cada uno
+        # (nombre y dirección son columnas únicas: si se agotan, se numeran)
+        nombres, direcciones = set(), set()
+        self.centros = []
+        for i in range(1, n_centros + 1):
+            self.centros.append({
+                'id_centro': i,
+                'nombre': _unico(lambda: _nombre_centro(rng, f), nombres,
+                                 respaldo=lambda valor: f'{valor[:33]} {i}'),
+                'direccion': _unico(lambda: _direccion(rng, f), direcciones,
+                                    respaldo=lambda valor: f'{valor[:70]} ({i})')})
+        pesos_centros = [rng.uniform(0.5, 1.5) for _ in self.centros]
+
+        usados = set()
+        especialidades = list(f['especialidades'])
+        pesos = list(f['especialidades'].values())
+        self.doctores = []
+        for i in range(1, n_doctores + 1):
+            usuario = self._usuario('medico', i)
+            centro = rng.choices(self.centros, weights=pesos_centros)[0]['id_centro']
+            segundo = rng.randint(1, n_centros) if n_centros > 1 and rng.random() < 0.2 else None
+            self.doctores.append({
+                'id_doctor': i, 'id_usuario': usuario['id_usuario'],
+                'nombre': _unico(lambda: _nombre(rng, f), usados),
+                'especialidad': rng.choices(especialidades, weights=pesos)[0],
+                # No son columnas: centros donde pasa consulta y parte de la jornada ocupada
+                'centro': centro, 'segundo_centro': segundo if segundo != centro else None,
+                'ocupacion': min(1.0, ocupacion * rng.uniform(0.6, 1.4))})
+
+        usados = set()
+        self.pacientes = []
+        self.frecuencias = []
+        for i in range(1, n_pacientes + 1):
+            usuario = self._usuario('paciente', i)
+            activo = rng.random() >= f['inactivos']
+            self.pacientes.append({
+                'id_paciente': i, 'id_usuario': usuario['id_usuario'],
+                'nombre': _unico(lambda: _nombre(rng, f), usados),
+                'telefono': _telefono(rng, f),
+                'estado': 'activo' if activo else 'inactivo'})
+            # Pocos pacientes acumulan muchas citas (Pareto); los inactivos van poco
+            self.frecuencias.append(rng.paretovariate(1.5) * (1.0 if activo else 0.2))
+
+    def _usuario(self, rol, i):
+        'Añade el usuario de un doctor o paciente con el formato de los CSV'
+        username = f'user_{rol}_{i}'
+        usuario = {'id_usuario': len(self.usuarios) + 1, 'username': username,
+                   'password': f'pass_{username}', 'rol': rol}
+        self.usuarios.append(usuario)
+        return usuario
+
+    def citas(self):
+        '''
+        Genera las citas día a día (lunes a viernes) y doctor a doctor, en orden
+        de fecha dentro de cada doctor. Cada doctor falta alguna vez y ocupa
+        cada día una parte de sus huecos cercana a su ocupación
+        '''
+        rng = random.Random(f'{self.semilla}-citas')
+        horas = [datetime.strptime(h, '%H:%M') for h in self.jornada]
+        inicio_jornada = timedelta(hours=horas[0].hour, minutes=horas[0].minute)
+        huecos = int((horas[1] - horas[0]).total_seconds() // 60 // self.duracion)
+        acumulados = list(accumulate(self.frecuencias))
+        id_cita = 0
+        for dia in range(self.dias):
+            fecha = self.inicio + timedelta(days=dia)
+            if fecha.weekday() >= 5 or not self.pacientes:
+                continue
+            for doctor in self.doctores:
+                if rng.random() < 0.05:
+                    continue
+                ocupados = sum(rng.random() < doctor['ocupacion'] for _ in range(huecos))
+                centro = doctor['segundo_centro'] if (doctor['segundo_centro'] and
+                                                      rng.random() < 0.3) else doctor['centro']
+                motivos = MOTIVOS.get(doctor['especialidad'], MOTIVOS_GENERALES)
+                elegidos = rng.choices(self.pacientes, cum_weights=acumulados, k=ocupados)
+                for hueco, paciente in zip(sorted(rng.sample(range(huecos), ocupados)),
+                                           elegidos):
+                    id_cita += 1
+                    yield {'id_cita': id_cita,
+                           'fecha': fecha + inicio_jornada + timedelta(
+                               minutes=hueco * self.duracion),
+                           'motivo': rng.choice(motivos),
+                           'estado': 'cancelada' if rng.random() < self.cancelacion
+                                     else 'activa',
+                           'id_paciente': paciente['id_paciente'],
+                           'id_doctor': doctor['id_doctor'],
+                           'id_centro': centro,
+                           # La mayoría las agenda la secretaría; el resto, el propio paciente
+                           'id_usuario': paciente['id_usuario'] if rng.random() < 0.3
+                                         else self.id_secretaria}
+
+
+def _columnas(filas, columnas):
+    'Filas solo con las columnas de la tabla'
+    return [{c: fila[c] for c in columnas} for fila in filas]
+
+
+COLUMNAS = {
+    'usuarios': ('id_usuario', 'username', 'password', 'rol'),
+    'doctores': ('id_doctor', 'id_usuario', 'nombre', 'especialidad'),
+    'pacientes': ('id_paciente', 'id_usuario', 'nombre', 'telefono', 'estado'),
+    'centros_medicos': ('id_centro', 'nombre', 'direccion'),
+}
+
+
+def escribir_csv(dataset, carpeta):
+    'Escribe los CSV con el formato de la carpeta data y devuelve el número de citas'
+    os.makedirs(carpeta, exist_ok=True)
+
+    def escribir(nombre, filas):
+        with open(os.path.join(carpeta, nombre), 'w', newline='', encoding='utf-8') as fichero:
+            csv.writer(fichero, lineterminator='\n').writerows(filas)
+
+    usuarios = {u['id_usuario']: u for u in dataset.usuarios}
+    escribir('datos_usuarios.csv', [(u['username'], u['password'], u['rol'])
+                                    for u in dataset.usuarios if u['rol'] not in
+                                    ('medico', 'paciente')])
+    escribir('datos_medicos.csv', [(usuarios[d['id_usuario']]['username'],
+                                    usuarios[d['id_usuario']]['password'], 'medico',
+                                    d['nombre'], d['especialidad']) for d in dataset.doctores])
+    escribir('datos_pacientes.csv', [(usuarios[p['id_usuario']]['username'],
+                                      usuarios[p['id_usuario']]['password'], 'paciente',
+                                      p['nombre'], p['telefono'], p['estado'])
+                                     for p in dataset.pacientes])
+    escribir('datos_clinicas.csv', [(c['nombre'], c['direccion']) for c in dataset.centros])
+    n = 0
+    with open(os.path.join(carpeta, 'datos_citas.csv'), 'w', newline='',
+              encoding='utf-8') as fichero:
+        escritor = csv.writer(fichero, lineterminator='\n')
+        for cita in dataset.citas():
+            escritor.writerow((cita['fecha'].strftime(FORMATO_FECHA), cita['motivo'],
+                               cita['estado'], cita['id_usuario'], cita['id_paciente'],
+                               cita['id_doctor'], cita['id_centro']))
+            n += 1
+    return n
+
+
+def escribir_ndjson(dataset, carpeta):
+    'Escribe un fichero NDJSON por tabla y devuelve el número de citas'
+    os.makedirs(carpeta, exist_ok=True)
+
+    def escribir(nombre, filas):
+        n = 0
+        with open(os.path.join(carpeta, f'{nombre}.ndjson'), 'w', encoding='utf-8') as fichero:
+            for fila in filas:
+                fichero.write(json.dumps(fila, ensure_ascii=False, default=datetime.isoformat)
+                              + '\n')
+                n += 1
+        return n
+
+    for tabla, filas in (('usuarios', dataset.usuarios), ('doctores', dataset.doctores),
+                         ('pacientes', dataset.pacientes),
+                         ('centros_medicos', dataset.centros)):
+        escribir(tabla, _columnas(filas, COLUMNAS[tabla]))
+    return escribir('cita_medica', dataset.citas())
+
+
+def escribir_sqlite(dataset, ruta):
+    'Crea el fichero SQLite con el esquema de los servicios y devuelve el número de citas'
+    # Solo se importan los servicios si se escribe una base de datos
+    from benchmarks import comun
+    from servicio_gestion.config import EstadoUsuario
+
+    app = comun.crear_app(ruta)
+    rng = random.Random(f'{dataset.semilla}-hashes')
+    usuarios = [dict(u, password=_hash_password(rng, u['password'])) for u in dataset.usuarios]
+    pacientes = [dict(p, estado=EstadoUsuario(p['estado']))
+                 for p in _columnas(dataset.pacientes, COLUMNAS['pacientes'])]
+    n = 0
+    with app.app_context():
+        for modelo, filas in ((comun.Usuario, usuarios),
+                              (comun.Doctor, _columnas(dataset.doctores, COLUMNAS['doctores'])),
+                              (comun.Paciente, pacientes),
+                              (comun.CentroMedico, dataset.centros)):
+            for base in range(0, len(filas), LOTE):
+                comun.db.session.execute(modelo.__table__.insert(), filas[base:base + LOTE])
+        lote = []
+        for cita in dataset.citas():
+            lote.append(cita)
+            if len(lote) == LOTE:
+                comun.db.session.execute(comun.CitaMedica.__table__.insert(), lote)
+                n += len(lote)
+                lote = []
+        if lote:
+            comun.db.session.execute(comun.CitaMedica.__table__.insert(), lote)
+            n += len(lote)
+        comun.db.session.commit()
+    return n
+
+
+ESCRITORES = {'csv': escribir_csv, 'ndjson': escribir_ndjson, 'sqlite': escribir_sqlite}
+
+
+def main():
+    'Genera el conjunto de datos con los parámetros de la línea de comandos'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--formato', choices=ESCRITORES, default='csv')
+    parser.add_argument('--salida', required=True,
+                        help='carpeta (csv, ndjson) o fichero SQLite nuevo (sqlite)')
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--escala', type=float, default=1.0,
+                        help='multiplica los 10 doctores, 20 pacientes y 2 centros de data/')
+    parser.add_argument('--doctores', type=int)
+    parser.add_argument('--pacientes', type=int)
+    parser.add_argument('--centros', type=int)
+    parser.add_argument('--inicio', default='06-01-2025', help='primer día (DD-MM-AAAA)')
+    parser.add_argument('--dias', type=int, default=90)
+    parser.add_argument('--ocupacion', type=float, default=0.6,
+                        help='parte media de los huecos de la jornada con cita')
+    parser.add_argument('--cancelacion', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.formato == 'sqlite' and os.path.exists(args.salida):
+        parser.error(f'{args.salida} ya existe')
+    if os.path.abspath(args.salida) == CARPETA_DATOS:
+        parser.error('la salida no puede ser la carpeta data')
+
+    # La jornada y la duración de las citas son las de servicio_citas
+    jornada = (os.getenv('JORNADA_INICIO', '09:00'), os.getenv('JORNADA_FIN', '17:00'))
+    dataset = Dataset(semilla=args.semilla,
+                      n_doctores=args.doctores or max(1, round(10 * args.escala)),
+                      n_pacientes=args.pacientes or max(1, round(20 * args.escala)),
+                      n_centros=args.centros or max(1, round(2 * args.escala)),
+                      inicio=datetime.strptime(args.inicio, '%d-%m-%Y'),
+                      dias=args.dias, ocupacion=args.ocupacion,
+                      cancelacion=args.cancelacion, jornada=jornada,
+                      duracion=int(os.getenv('CITA_DURACION', '30')))
+    n_citas = ESCRITORES[args.formato](dataset, args.salida)
+    print(f'{len(dataset.usuarios)} usuarios, {len(dataset.doctores)} doctores, '
+          f'{len(dataset.pacientes)} pacientes, {len(dataset.centros)} centros médicos '
+          f'y {n_citas} citas en {args.salida}')
+
+
+if __name__ == '__main__':
+    main()
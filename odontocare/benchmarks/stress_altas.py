@@ -0,0 +1,135 @@
+'''
+Prueba de carga de las altas de doctores y pacientes concurrentes.
+Lanza miles de POST /admin/doctor y /admin/paciente en paralelo contra un
+servidor multihilo y comprueba después en la base de datos que:
+    - cada doctor y cada paciente apunta al usuario que se creó con él
+      (mismo número en username y nombre, y rol correcto)
+    - no quedan usuarios huérfanos sin doctor ni paciente
+    - el 'id_usuario' devuelto en cada respuesta es el guardado
+y que todas las respuestas son 201 (o 409 si el alta ya existía): cualquier
+otra (p. ej. 500, o 503 por 'database is locked' tras agotar los
+reintentos) cuenta como fallo y el proceso termina con error.
+
+Uso (desde la carpeta 'odontocare'):
+    python -m benchmarks.stress_altas --doctores 1000 --pacientes 1000 --concurrencia 32
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks import comun
+from servicio_gestion.models.doctores import Doctor
+from servicio_gestion.models.pacientes import Paciente
+from servicio_gestion.models.usuarios import Usuario
+
+
+# Respuestas válidas de un alta: creada o ya existente
+CODIGOS_ESPERADOS = (201, 409)
+# Reintentos de cada alta que recibe un 503 (reintentable, con Retry-After)
+REINTENTOS_503 = 3
+
+
+def comprobar(app, respuestas):
+    'Devuelve la lista de incoherencias encontradas en la base de datos'
+    errores = []
+    with app.app_context():
+        usuarios = {u.id_usuario: u for u in Usuario.query.all()}
+        enlazados = set()
+        for tipo, filas in (('doctor', Doctor.query.all()), ('paciente', Paciente.query.all())):
+            for fila in filas:
+                usuario = usuarios.get(fila.id_usuario)
+                numero = fila.nombre.rsplit(' ', 1)[-1]
+                rol = 'medico' if tipo == 'doctor' else 'paciente'
+                if usuario is None or usuario.username != f'stress_{tipo}_{numero}' \
+                        or usuario.rol != rol:
+                    errores.append(f'{tipo} {fila.nombre} enlazado al usuario {fila.id_usuario}')
+                enlazados.add(fila.id_usuario)
+        huerfanos = set(usuarios) - enlazados
+        if huerfanos:
+            errores.append(f'{len(huerfanos)} usuarios sin doctor ni paciente')
+
+        doctores = {d.id_doctor: d.id_usuario for d in Doctor.query.all()}
+        pacientes = {p.id_paciente: p.id_usuario for p in Paciente.query.all()}
+    for datos in respuestas:
+        guardado = (doctores.get(datos['id_doctor']) if 'id_doctor' in datos
+                    else pacientes.get(datos['id_paciente']))
+        if guardado != datos['id_usuario']:
+            errores.append(f'respuesta {datos} no coincide con la base de datos')
+    return errores
+
+
+def main():
+    'Lanza las altas concurrentes, comprueba la base de datos y termina con error si falla'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doctores', type=int, default=1000)
+    parser.add_argument('--pacientes', type=int, default=1000)
+    parser.add_argument('--concurrencia', type=int, default=32)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        app = comun.crear_app(os.path.join(carpeta, 'stress.db'))
+        servidor, url = comun.arrancar_servidor(app)
+        headers = {'Authorization': f'Bearer {comun.token()}'}
+        reintentos = []
+
+        def alta(tarea):
+            tipo, i = tarea
+            if tipo == 'doctor':
+                datos = {'username': f'stress_doctor_{i}', 'password': 'clave', 'rol': 'medico',
+                         'nombre': f'Doctor Stress {i}', 'especialidad': 'Ortodoncia'}
+            else:
+                datos = {'username': f'stress_paciente_{i}', 'password': 'clave',
+                         'rol': 'paciente', 'nombre': f'Paciente Stress {i}',
+                         'telefono': '+34 600 000 000', 'estado': 'activo'}
+            # Los 503 (base de datos ocupada) se reintentan como haría un cliente
+            for intento in range(REINTENTOS_503 + 1):
+                respuesta = requests.post(f'{url}/admin/{tipo}', json=datos, headers=headers,
+                                          timeout=120)
+                if respuesta.status_code != 503 or intento == REINTENTOS_503:
+                    break
+                reintentos.append(tipo)
+                time.sleep(float(respuesta.headers.get('Retry-After', 1)))
+            try:
+                return respuesta.status_code, respuesta.json()
+            except ValueError:
+                # Errores no controlados: Flask responde con una página HTML
+                return respuesta.status_code, {'error': respuesta.text[:80]}
+
+        # Doctores y pacientes intercalados para que compitan por los mismos ids
+        tareas = [('doctor', i) for i in range(args.doctores)]
+        tareas += [('paciente', i) for i in range(args.pacientes)]
+        tareas.sort(key=lambda tarea: tarea[1])
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrencia) as pool:
+            resultados = list(pool.map(alta, tareas))
+        segundos = time.perf_counter() - t0
+        servidor.shutdown()
+
+        correctas = [datos for codigo, datos in resultados if codigo == 201]
+        fallidas = [(codigo, datos) for codigo, datos in resultados
+                    if codigo not in CODIGOS_ESPERADOS]
+        errores = comprobar(app, correctas)
+
+    print(f'altas: {len(tareas)} en {segundos:.1f} s, correctas: {len(correctas)}, '
+          f'ya existentes: {len(resultados) - len(correctas) - len(fallidas)}, '
+          f'fallidas: {len(fallidas)}, reintentos por 503: {len(reintentos)}')
+    for codigo, datos in fallidas[:10]:
+        print(f'  HTTP {codigo}: {datos}')
+    for error in errores[:20]:
+        print(f'  incoherencia: {error}')
+    if errores or fallidas:
+        print(f'ERROR: {len(fallidas)} altas fallidas, {len(errores)} incoherencias')
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+'''
+Script que agrega el fichero de trazas (TRAZAS_RUTA, JSON lines) de los dos
+servicios en un desglose de latencia por endpoint: para cada span (auth,
+validacion, gestion, bd, escritura, serializacion) el número medio de spans
+por petición, los milisegundos medios por petición y su parte del total.
+'sin span' es el tiempo de la petición que no cubre ningún span.
+Con --peticion muestra todas las peticiones de los dos servicios con ese
+identificador (X-Request-ID) y sus spans en orden.
+
+Uso (desde la carpeta 'odontocare'):
+    python resumen_trazas.py trazas.jsonl
+    python resumen_trazas.py trazas.jsonl --endpoint citas_bp.add_cita
+    python resumen_trazas.py trazas.jsonl --peticion <X-Request-ID>
+'''
+
+import argparse
+import json
+from collections import defaultdict
+
+
+def leer(ruta):
+    'Registros del fichero de trazas (se ignoran las líneas incompletas)'
+    registros = []
+    with open(ruta, encoding='utf-8') as fichero:
+        for linea in fichero:
+            try:
+                registros.append(json.loads(linea))
+            except json.JSONDecodeError:
+                continue
+    return registros
+
+
+def percentil(valores, p):
+    'Percentil p (0-100) de una lista de valores'
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def cubierto(spans):
+    'Milisegundos cubiertos por al menos un span (los solapados cuentan una vez)'
+    total = 0.0
+    fin_actual = None
+    for inicio, fin in sorted((s['inicio_ms'], s['inicio_ms'] + s['duracion_ms'])
+                              for s in spans):
+        if fin_actual is None or inicio > fin_actual:
+            total += fin - inicio
+            fin_actual = fin
+        elif fin > fin_actual:
+            total += fin - fin_actual
+            fin_actual = fin
+    return total
+
+
+def resumir(registros, endpoint=None):
+    'Imprime el desglose de latencia de cada endpoint'
+    grupos = defaultdict(list)
+    for registro in registros:
+        if endpoint is None or registro['endpoint'] == endpoint:
+            grupos[(registro['servicio'], registro['endpoint'])].append(registro)
+
+    for (servicio, nombre), peticiones in sorted(grupos.items(), key=lambda g: -len(g[1])):
+        n = len(peticiones)
+        duraciones = [p['duracion_ms'] for p in peticiones]
+        total_medio = sum(duraciones) / n
+        print(f'\n{servicio} {nombre}: {n} peticiones, media {total_medio:.2f} ms, '
+              f'p50 {percentil(duraciones, 50):.2f} ms, p95 {percentil(duraciones, 95):.2f} ms')
+        por_span = defaultdict(lambda: [0, 0.0])
+        sin_span = 0.0
+        for peticion in peticiones:
+            for span in peticion['spans']:
+                por_span[span['nombre']][0] += 1
+                por_span[span['nombre']][1] += span['duracion_ms']
+            sin_span += max(0.0, peticion['duracion_ms'] - cubierto(peticion['spans']))
+        print(f'    {"span":<14} | {"spans/pet":>9} | {"ms/pet":>8} | {"% total":>7}')
+        filas = sorted(por_span.items(), key=lambda fila: -fila[1][1])
+        filas.append(('sin span', [0, sin_span]))
+        for nombre_span, (cuenta, ms) in filas:
+            print(f'    {nombre_span:<14} | {cuenta / n:9.2f} | {ms / n:8.2f} | '
+                  f'{100 * ms / n / total_medio if total_medio else 0:6.1f}%')
+
+
+def mostrar_peticion(registros, id_peticion):
+    'Imprime las peticiones de los dos servicios con el identificador indicado'
+    peticiones = sorted((r for r in registros if r['id'] == id_peticion),
+                        key=lambda r: r['inicio'])
+    if not peticiones:
+        print(f'No hay trazas de la petición {id_peticion}')
+        return
+    origen = peticiones[0]['inicio']
+    for peticion in peticiones:
+        desfase = (peticion['inicio'] - origen) * 1000
+        print(f'\n+{desfase:.1f} ms {peticion["servicio"]} {peticion["metodo"]} '
+              f'{peticion["ruta"]} -> {peticion["status"]} en {peticion["duracion_ms"]:.2f} ms')
+        for span in peticion['spans']:
+            print(f'    +{span["inicio_ms"]:8.2f} ms  {span["duracion_ms"]:8.2f} ms  '
+                  f'{span["nombre"]:<14} {span.get("detalle", "")}')
+
+
+def main():
+    'Lee el fichero de trazas e imprime el resumen pedido'
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('ruta', nargs='?', default='trazas.jsonl')
+    parser.add_argument('--endpoint', help='solo este endpoint (p. ej. citas_bp.add_cita)')
+    parser.add_argument('--peticion', help='muestra las trazas de un X-Request-ID')
+    args = parser.parse_args()
+
+    registros = leer(args.ruta)
+    if args.peticion:
+        mostrar_peticion(registros, args.peticion)
+    else:
+        resumir(registros, args.endpoint)
+
+
+if __name__ == '__main__':
+    main()
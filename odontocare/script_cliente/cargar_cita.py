@@ -7,9 +7,9 @@ Script para crear_cita:
 import os
 import datetime
 import json
-import requests
 
 from servicio_citas.models.citas import CitaMedica
+from script_cliente.cliente import ClienteOdontoCare, ErrorAPI
 
 # Configuración del cliente
 BASE_URL = 'http://localhost:5001'
@@ -34,49 +34,31 @@ def crear_cita(app, token):
     Imprime en consola el JSON con la cita creada
     '''
 
-    # Si la API proporciona un token válido para el admin
-    if token:
-        # Crea las cabeceras con el Bearer Token
-        headers = {
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-                }
-
-    # Crea una cita médica
+    if not token:
+        print('Error: No hay token de admin. No se crea la cita.')
+        return
 
     # Consulta la base de datos para ver si existe la primera cita
     with app.app_context():
-        if CitaMedica.query.filter_by(id_cita=1).first() is None:
-            cita_registrada = False
-            while not cita_registrada:
-                # Lee del fichero datos.csv los datos necesarios para crear la cita
-                try:
-                    # Crea los datos de la cita médica
-                    datos_cita = {
-                                  'fecha': FECHA,
-                                  'motivo': MOTIVO,
-                                  'estado': ESTADO,
-                                  'id_usuario': ID_USUARIO,
-                                  'id_paciente': ID_PACIENTE,
-                                  'id_doctor': ID_DOCTOR,
-                                  'id_centro': ID_CENTRO
-                                 }
-                    # Envia los datos como JSON a la API
-                    respuesta = requests.post(f'{BASE_URL}/citas/agendar',
-                                                json=datos_cita,
-                                                headers=headers,
-                                                timeout=5
-                                                )
-                    if respuesta.status_code == 201:
-                        cita_registrada = True
-                    else:
-                        print(f'Error al registrar la cita {respuesta.json()}')
-                    datos_json = respuesta.json()
-                    json_output = json.dumps(datos_json, indent=4)
-                    print("--- JSON de primera cita médica en consola ---")
-                    print(json_output)
-                    print("----------------------------------------------")
-                except ConnectionError as e:
-                    print(f"Error de conexión: {e}")
-        else:
+        if CitaMedica.query.filter_by(id_cita=1).first() is not None:
             print('La cita ya existe. Omitiendo crear cita.')
+            return
+
+    # Cliente de la API con el token del admin
+    cliente = ClienteOdontoCare(BASE_URL)
+    cliente.token = token
+
+    # Crea la cita médica (los errores de conexión los trata carga_inicial)
+    try:
+        datos_json = cliente.agendar(fecha=FECHA, motivo=MOTIVO, estado=ESTADO,
+                                     id_usuario=ID_USUARIO, id_paciente=ID_PACIENTE,
+                                     id_doctor=ID_DOCTOR, id_centro=ID_CENTRO)
+    except ErrorAPI as e:
+        print(f'Error al registrar la cita {e.cuerpo}')
+        datos_json = e.cuerpo
+    finally:
+        cliente.close()
+    json_output = json.dumps(datos_json, indent=4)
+    print("--- JSON de primera cita médica en consola ---")
+    print(json_output)
+    print("----------------------------------------------")
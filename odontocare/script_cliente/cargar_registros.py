@@ -4,7 +4,8 @@ String que recoge las funciones 'login' y 'carga_registros'
 import os
 import csv
 import sys
-import requests
+
+from script_cliente.cliente import ClienteOdontoCare, ErrorAPI
 
 
 # Ruta del fichero de datos
@@ -16,6 +17,19 @@ FILE_CSV_CLINICAS = os.path.join(basedir_data, 'datos_clinicas.csv')
 
 BASE_URL = 'http://localhost:5001'
 
+# Cliente de la API compartido por la carga (guarda el token del login)
+cliente = ClienteOdontoCare(BASE_URL)
+
+
+def leer_csv(ruta):
+    'Lee las filas de un fichero de datos; si no existe, termina el script'
+    try:
+        with open(ruta, mode='r', newline='', encoding='utf-8') as file:
+            return [line for line in csv.reader(file) if line]
+    except FileNotFoundError:
+        print(f'Error: No se ha encontrado el archivo "{os.path.basename(ruta)}".')
+        sys.exit(1)
+
 
 def login():
     '''
@@ -23,51 +37,29 @@ def login():
     Envia petición POST de autenticación con el usuario 'admin'
     '''
 
-    # Lee las credenciales del 'admin' del fichero datos_usuarios.csv para hacer login
-    try:
-        with open(FILE_CSV, mode='r', newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            try:
-                # Lee la primera línea (fila) del archivo
-                first_line = next(reader)
-                if len(first_line) >= 3:
-                    payload = {
-                                'username': first_line[0],
-                                'password': first_line[1],
-                                'rol': first_line[2]
-                              }
-                else:
-                    print('Error: El archivo CSV no tiene suficientes campos en la primera línea.')
-                    return None
-            except StopIteration:
-                print('Error: El archivo CSV está vacío.')
-                return None
-    except FileNotFoundError:
-        print('Error: No se ha encontrado el archivo "datos_usuarios.csv".')
-        sys.exit(1)
-
-    # Cabeceras
-    headers = {"Content-Type": "application/json"}
+    # Lee las credenciales del 'admin' (primera línea) del fichero datos_usuarios.csv
+    lines = leer_csv(FILE_CSV)
+    if not lines:
+        print('Error: El archivo CSV está vacío.')
+        return None
+    if len(lines[0]) < 3:
+        print('Error: El archivo CSV no tiene suficientes campos en la primera línea.')
+        return None
 
-    # Hace login en la API y recibe el token
+    # Hace login en la API y recibe el token (los errores de conexión los trata carga_inicial)
     try:
-        # Enviar petición POST con credenciales JSON
-        response_login = requests.post(
-                                        f'{BASE_URL}/auth/login',
-                                        json=payload,
-                                        headers=headers,
-                                        timeout=3
-                                      )
-        if response_login.status_code != 200:
-            print(f"Error en login: {response_login.status_code} - {response_login.text}")
-
-        data = response_login.json()
-        token = data['token']
+        return cliente.login(username=lines[0][0], password=lines[0][1],
+                             rol=lines[0][2])['token']
+    except ErrorAPI as e:
+        print(f'Error en login: {e.status} - {e.cuerpo}')
+        return None
 
-    except ConnectionError as e:
-        print(f"Error de conexión: {e}")
 
-    return token
+def _mostrar_errores(resultados, registro):
+    'Imprime los registros que la API no ha creado'
+    for resultado in resultados:
+        if isinstance(resultado, Exception):
+            print(f'Error al registrar {registro}: {getattr(resultado, "cuerpo", resultado)}')
 
 
 def carga_reg(token):
@@ -76,92 +68,24 @@ def carga_reg(token):
     Carga los registros en la Base de Datos
     '''
 
-    # Si la API proporciona un token válido para el admin
-    if token:
-        # Crea las cabeceras con el Bearer Token
-        headers = {
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-                }
-
-    # Lee los registros del fichero datos_medicos.csv para cargarlos en la base de datos
-    try:
-        with open(FILE_CSV_DOCTORES, mode='r', newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            # Lee el archivo (registros 'doctores')
-            for i in range(0, 10):
-                line = next(reader)
-                # Recupera los datos del doctor
-                datos_doctor = {
-                                'username': line[0],
-                                'password': line[1],
-                                'rol': line[2],
-                                'nombre': line[3],
-                                'especialidad': line[4]
-                                }
-
-                # Envia los datos como JSON a la API
-                respuesta = requests.post(f'{BASE_URL}/admin/doctor',
-                                        json=datos_doctor,
-                                        headers=headers,
-                                        timeout=5
-                                        )
-                if respuesta.status_code != 201:
-                    print(f'Error al registrar a un usuario: doctor {respuesta.json()}')
-    except FileNotFoundError:
-        print('Error: No se ha encontrado el archivo "datos_medicos.csv".')
-        sys.exit(1)
-
-    # Lee los registros del fichero datos_pacientes.csv para cargarlos en la base de datos
-    try:
-        with open(FILE_CSV_PACIENTES, mode='r', newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            # Lee el archivo (registros 'pacientes')
-            for i in range(0, 20):
-                line = next(reader)
-                # Recupera los datos de paciente
-                datos_paciente = {
-                                'username': line[0],
-                                'password': line[1],
-                                'rol': line[2],
-                                'nombre': line[3],
-                                'telefono': line[4],
-                                'estado': line[5]
-                                }
-
-                # Envia los datos como JSON a la API
-                respuesta = requests.post(f'{BASE_URL}/admin/paciente',
-                                        json=datos_paciente,
-                                        headers=headers,
-                                        timeout=5
-                                        )
-                if respuesta.status_code != 201:
-                    print(f'Error al registrar a los usuarios: pacientes {respuesta.json()}')
-    except FileNotFoundError:
-        print('Error: No se ha encontrado el archivo "datos_pacientes.csv".')
-        sys.exit(1)
-    # Lee los registros del fichero datos_clinicas.csv para cargarlos en la base de datos
-    try:
-        with open(FILE_CSV_CLINICAS, mode='r', newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            # Lee el archivo (registros 'clínicas')
-            for i in range(0, 2):
-                line = next(reader)
-                # Recupera los datos de centro_medico
-                datos_centro_medico = {
-                                'nombre': line[0],
-                                'direccion': line[1]
-                                }
-                # Enviar los datos de centro_medico como JSON a la API
-                respuesta = requests.post(f'{BASE_URL}/admin/centro_medico',
-                                        json=datos_centro_medico,
-                                        headers=headers,
-                                        timeout=3
-                                        )
-                if respuesta.status_code != 201:
-                    print(f'Error al registrar los Centros Médicos {respuesta.json()}')
-    except FileNotFoundError:
-        print('Error: No se ha encontrado el archivo "datos_clinicas.csv".')
-        sys.exit(1)
+    if not token:
+        print('Error: No hay token de admin. No se cargan los registros.')
+        return
+    if cliente.token != token:
+        cliente.token = token
+
+    # Se cargan de uno en uno (trabajadores=1) para que los ids sigan el orden de los ficheros
+    doctores = [{'username': line[0], 'password': line[1], 'rol': line[2],
+                 'nombre': line[3], 'especialidad': line[4]}
+                for line in leer_csv(FILE_CSV_DOCTORES)]
+    _mostrar_errores(cliente.crear_doctores(doctores, trabajadores=1), 'un doctor')
+
+    pacientes = [{'username': line[0], 'password': line[1], 'rol': line[2],
+                  'nombre': line[3], 'telefono': line[4], 'estado': line[5]}
+                 for line in leer_csv(FILE_CSV_PACIENTES)]
+    _mostrar_errores(cliente.crear_pacientes(pacientes, trabajadores=1), 'un paciente')
+
+    centros = [{'nombre': line[0], 'direccion': line[1]} for line in leer_csv(FILE_CSV_CLINICAS)]
+    _mostrar_errores(cliente.crear_centros(centros, trabajadores=1), 'un centro médico')
 
     return
@@ -0,0 +1,504 @@
+'''
+Cliente de la API de OdontoCare para scripts e integraciones. Ofrece dos variantes:
+    - ClienteOdontoCare: 'requests' con una sesión (pool de conexiones)
+    - ClienteOdontoCareAsync: 'httpx' con asyncio
+Las dos:
+    - hacen login con las credenciales indicadas y renuevan el token antes de
+      que caduque (expires_at de /auth/login) o si la API responde 401
+    - tienen un método por cada endpoint (mismos parámetros que la API; las
+      fechas admiten datetime o texto con el formato de la API)
+    - convierten las respuestas de error en ErrorAPI (status y cuerpo)
+    - amplían el timeout de las peticiones long-poll (eventos_citas) con su espera
+    - tienen métodos en lote que lanzan las peticiones en paralelo con un
+      máximo de 'trabajadores' peticiones en curso
+Los endpoints de /citas se envían a 'url_citas' (por defecto, la misma URL
+que el resto: servicio_gestion también los sirve).
+
+Ejemplo:
+    with ClienteOdontoCare('http://localhost:5001', 'user_admin', 'pass_user_admin',
+                           'admin') as cliente:
+        doctor = cliente.get_doctor(3)
+        resultados = cliente.agendar_citas(citas, trabajadores=16)
+'''
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+
+FORMATO_FECHA = '%d-%m-%Y'
+FORMATO_FECHA_HORA = '%d-%m-%Y %H:%M'
+# Segundos antes de expires_at en los que se renueva el token
+MARGEN_RENOVACION = 300
+
+
+class ErrorAPI(Exception):
+    'La API ha respondido con un error (status >= 400)'
+
+    def __init__(self, status, cuerpo, metodo, ruta):
+        mensaje = ((cuerpo.get('error') or cuerpo.get('mensaje') or cuerpo.get('message'))
+                   if isinstance(cuerpo, dict) else cuerpo)
+        super().__init__(f'{metodo} {ruta}: HTTP {status} {mensaje}')
+        self.status = status
+        self.cuerpo = cuerpo
+
+
+def _fecha(valor, formato=FORMATO_FECHA):
+    'Fecha con el formato de la API (los textos se envían tal cual)'
+    return valor.strftime(formato) if isinstance(valor, datetime) else valor
+
+
+def _params(**params):
+    'Query params sin los valores None (los booleanos como true/false)'
+    return {clave: str(valor).lower() if isinstance(valor, bool) else valor
+            for clave, valor in params.items() if valor is not None}
+
+
+def _caducidad(datos):
+    'Instante (epoch) de caducidad del token según expires_at de /auth/login'
+    try:
+        expira = datetime.fromisoformat(datos['expires_at'].removesuffix('Z'))
+    except (KeyError, ValueError):
+        # Sin una fecha válida, se renueva cada hora
+        return time.time() + 3600 + MARGEN_RENOVACION
+    if expira.tzinfo is None:
+        expira = expira.replace(tzinfo=timezone.utc)
+    return expira.timestamp()
+
+
+def _cuerpo(respuesta):
+    'Cuerpo JSON de la respuesta (o el texto si no es JSON)'
+    try:
+        return respuesta.json()
+    except ValueError:
+        return respuesta.text
+
+
+class _Endpoints:
+    '''
+    Un método por endpoint. Cada uno llama a self._peticion, que en el cliente
+    síncrono devuelve el cuerpo de la respuesta y en el asíncrono una corrutina
+    '''
+
+    # ----- main -----
+
+    def inicio(self):
+        'GET / (estado de la API)'
+        return self._peticion('GET', '/', autenticar=False)
+
+    def metricas(self):
+        'GET /metrics'
+        return self._peticion('GET', '/metrics', autenticar=False)
+
+    def listo(self):
+        'GET /ready: estado del calentamiento (también si aún no ha terminado)'
+        return self._peticion('GET', '/ready', autenticar=False, aceptar=(503,))
+
+    # ----- /admin: usuarios -----
+
+    def crear_usuario(self, username, password, rol):
+        'POST /admin/usuario'
+        return self._peticion('POST', '/admin/usuario',
+                              json={'username': username, 'password': password, 'rol': rol})
+
+    def get_usuario(self, id_usuario):
+        'GET /admin/usuario/<id_usuario>'
+        return self._peticion('GET', f'/admin/usuario/{id_usuario}')
+
+    def listar_usuarios(self, page=1, per_page=5, fields=None):
+        'GET /admin/usuarios (paginado)'
+        return self._peticion('GET', '/admin/usuarios',
+                              params=_params(page=page, per_page=per_page, fields=fields))
+
+    # ----- /admin: doctores -----
+
+    def crear_doctor(self, username, password, nombre, especialidad, rol='medico'):
+        'POST /admin/doctor (crea también su usuario)'
+        return self._peticion('POST', '/admin/doctor',
+                              json={'username': username, 'password': password, 'rol': rol,
+                                    'nombre': nombre, 'especialidad': especialidad})
+
+    def get_doctor(self, id_doctor):
+        'GET /admin/doctor/<id_doctor>'
+        return self._peticion('GET', f'/admin/doctor/{id_doctor}')
+
+    def get_doctor_username(self, username):
+        'GET /admin/doctor/username'
+        return self._peticion('GET', '/admin/doctor/username', params={'username': username})
+
+    def listar_doctores(self, page=1, per_page=5, fields=None):
+        'GET /admin/doctores (paginado)'
+        return self._peticion('GET', '/admin/doctores',
+                              params=_params(page=page, per_page=per_page, fields=fields))
+
+    # ----- /admin: pacientes -----
+
+    def crear_paciente(self, username, password, nombre, telefono, estado='activo',
+                       rol='paciente'):
+        'POST /admin/paciente (crea también su usuario)'
+        return self._peticion('POST', '/admin/paciente',
+                              json={'username': username, 'password': password, 'rol': rol,
+                                    'nombre': nombre, 'telefono': telefono, 'estado': estado})
+
+    def get_paciente(self, id_paciente):
+        'GET /admin/paciente/<id_paciente>'
+        return self._peticion('GET', f'/admin/paciente/{id_paciente}')
+
+    def listar_pacientes(self, page=1, per_page=5, fields=None):
+        'GET /admin/pacientes (paginado)'
+        return self._peticion('GET', '/admin/pacientes',
+                              params=_params(page=page, per_page=per_page, fields=fields))
+
+    def buscar_pacientes(self, q, limite=20):
+        'GET /admin/pacientes/buscar (por nombre o teléfono)'
+        return self._peticion('GET', '/admin/pacientes/buscar',
+                              params={'q': q, 'limite': limite})
+
+    # ----- /admin: centros médicos -----
+
+    def crear_centro(self, nombre, direccion):
+        'POST /admin/centro_medico'
+        return self._peticion('POST', '/admin/centro_medico',
+                              json={'nombre': nombre, 'direccion': direccion})
+
+    def get_centro(self, id_centro):
+        'GET /admin/centro_medico/<id_centro>'
+        return self._peticion('GET', f'/admin/centro_medico/{id_centro}')
+
+    def listar_centros(self, page=1, per_page=5, fields=None):
+        'GET /admin/centros_medicos (paginado)'
+        return self._peticion('GET', '/admin/centros_medicos',
+                              params=_params(page=page, per_page=per_page, fields=fields))
+
+    # ----- /admin: outbox y perfiles -----
+
+    def get_outbox(self, desde=0, limite=500):
+        'GET /admin/outbox (eventos posteriores a "desde")'
+        return self._peticion('GET', '/admin/outbox', params={'desde': desde, 'limite': limite})
+
+    def perfiles(self):
+        'GET /admin/perfiles (rutas perfiladas)'
+        return self._peticion('GET', '/admin/perfiles')
+
+    def perfil_funciones(self, ruta, metodo='GET', orden='acumulado', limite=30):
+        'GET /admin/perfiles/funciones'
+        return self._peticion('GET', '/admin/perfiles/funciones',
+                              params={'ruta': ruta, 'metodo': metodo, 'orden': orden,
+                                      'limite': limite})
+
+    def descargar_perfil(self, ruta, metodo='GET'):
+        'GET /admin/perfiles/descargar: bytes del fichero pstats'
+        return self._peticion('GET', '/admin/perfiles/descargar',
+                              params={'ruta': ruta, 'metodo': metodo}, binario=True)
+
+    def borrar_perfiles(self):
+        'DELETE /admin/perfiles'
+        return self._peticion('DELETE', '/admin/perfiles')
+
+    # ----- /citas -----
+
+    def agendar(self, fecha, motivo, id_paciente, id_doctor, id_centro, id_usuario,
+                estado='activa', clave_idempotencia=None):
+        'POST /citas/agendar (fecha DD-MM-YYYY HH:MM o datetime)'
+        return self._peticion('POST', '/citas/agendar', citas=True,
+                              clave_idempotencia=clave_idempotencia,
+                              json={'fecha': _fecha(fecha, FORMATO_FECHA_HORA),
+                                    'motivo': motivo, 'estado': estado,
+                                    'id_paciente': id_paciente, 'id_doctor': id_doctor,
+                                    'id_centro': id_centro, 'id_usuario': id_usuario})
+
+    def listar_citas(self, id_doctor=None, fecha=None, id_centro=None, estado=None,
+                     id_paciente=None, fields=None, historico=None):
+        'GET /citas/listar_citas'
+        return self._peticion('GET', '/citas/listar_citas', citas=True,
+                              params=_params(id_doctor=id_doctor, fecha=_fecha(fecha),
+                                             id_centro=id_centro, estado=estado,
+                                             id_paciente=id_paciente, fields=fields,
+                                             historico=historico))
+
+    def estadisticas(self, agrupar=None, periodo=None, desde=None, hasta=None,
+                     id_doctor=None, id_centro=None):
+        'GET /citas/estadisticas (agrupar: lista o texto separado por comas)'
+        if isinstance(agrupar, (list, tuple)):
+            agrupar = ','.join(agrupar)
+        return self._peticion('GET', '/citas/estadisticas', citas=True,
+                              params=_params(agrupar=agrupar, periodo=periodo,
+                                             desde=_fecha(desde), hasta=_fecha(hasta),
+                                             id_doctor=id_doctor, id_centro=id_centro))
+
+    def agenda(self, id_doctor=None, id_centro=None, fecha=None, vista='dia',
+               compacto=False, canceladas=None):
+        'GET /citas/agenda (id_doctor o id_centro)'
+        return self._peticion('GET', '/citas/agenda', citas=True,
+                              params=_params(id_doctor=id_doctor, id_centro=id_centro,
+                                             fecha=_fecha(fecha), vista=vista,
+                                             formato='compacto' if compacto else None,
+                                             canceladas=canceladas))
+
+    def huecos(self, especialidad, id_centro=None, duracion=None, n=None, desde=None):
+        'GET /citas/huecos (próximos huecos libres de una especialidad)'
+        return self._peticion('GET', '/citas/huecos', citas=True,
+                              params=_params(especialidad=especialidad, id_centro=id_centro,
+                                             duracion=duracion, n=n,
+                                             desde=_fecha(desde, FORMATO_FECHA_HORA)))
+
+    def eventos_citas(self, id_doctor=None, id_centro=None, desde=None, espera=25):
+        '''
+        GET /citas/eventos en long-poll (id_doctor o id_centro): espera hasta
+        'espera' segundos a que haya cambios posteriores al evento 'desde'.
+        La siguiente llamada usa 'ultimo' de la respuesta como 'desde'
+        '''
+        return self._peticion('GET', '/citas/eventos', citas=True, espera=espera,
+                              params=_params(id_doctor=id_doctor, id_centro=id_centro,
+                                             desde=desde, espera=espera))
+
+    def modificar(self, id_cita, clave_idempotencia=None, **cambios):
+        'PUT /citas/modificar/<id_cita> (cambios: fecha, id_paciente, id_doctor, id_centro)'
+        if 'fecha' in cambios:
+            cambios['fecha'] = _fecha(cambios['fecha'], FORMATO_FECHA_HORA + ':%S')
+        return self._peticion('PUT', f'/citas/modificar/{id_cita}', citas=True, json=cambios,
+                              clave_idempotencia=clave_idempotencia)
+
+    def cancelar(self, id_cita, clave_idempotencia=None):
+        'PUT /citas/cancelar/<id_cita>'
+        return self._peticion('PUT', f'/citas/cancelar/{id_cita}', citas=True,
+                              clave_idempotencia=clave_idempotencia)
+
+    def cancelar_masivo(self, id_doctor, desde, hasta, simular=False):
+        'PUT /citas/cancelar_masivo (citas del doctor entre dos fechas, ambas incluidas)'
+        return self._peticion('PUT', '/citas/cancelar_masivo', citas=True,
+                              json={'id_doctor': id_doctor, 'desde': _fecha(desde),
+                                    'hasta': _fecha(hasta), 'simular': simular})
+
+    def reasignar(self, id_doctor, id_doctor_destino, desde, hasta, simular=False):
+        'PUT /citas/reasignar (citas del doctor entre dos fechas a otro doctor)'
+        return self._peticion('PUT', '/citas/reasignar', citas=True,
+                              json={'id_doctor': id_doctor,
+                                    'id_doctor_destino': id_doctor_destino,
+                                    'desde': _fecha(desde), 'hasta': _fecha(hasta),
+                                    'simular': simular})
+
+    def archivar(self, lotes=None):
+        'POST /citas/archivar'
+        return self._peticion('POST', '/citas/archivar', citas=True,
+                              params=_params(lotes=lotes))
+
+
+class ClienteOdontoCare(_Endpoints):
+    'Cliente síncrono con una sesión de requests compartida entre hilos'
+
+    def __init__(self, url='http://localhost:5001', username=None, password=None, rol=None,
+                 url_citas=None, timeout=5, conexiones=16):
+        self.url = url.rstrip('/')
+        self.url_citas = (url_citas or url).rstrip('/')
+        self.credenciales = (username, password, rol)
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Un pool por host con tantas conexiones como peticiones en paralelo
+        adaptador = HTTPAdapter(pool_connections=2, pool_maxsize=conexiones)
+        self.session.mount('http://', adaptador)
+        self.session.mount('https://', adaptador)
+        self.token = None
+        self.expira = 0.0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        'Cierra las conexiones de la sesión'
+        self.session.close()
+
+    def login(self, username=None, password=None, rol=None):
+        'POST /auth/login: guarda el token y su caducidad y devuelve la respuesta'
+        if username is not None:
+            self.credenciales = (username, password, rol)
+        username, password, rol = self.credenciales
+        datos = self._peticion('POST', '/auth/login', autenticar=False,
+                               json={'username': username, 'password': password, 'rol': rol})
+        self.token = datos['token']
+        self.expira = _caducidad(datos)
+        return datos
+
+    def _token(self, renovar=False):
+        'Token vigente: se renueva MARGEN_RENOVACION segundos antes de caducar'
+        with self._lock:
+            if renovar or self.token is None or time.time() >= self.expira - MARGEN_RENOVACION:
+                self.login()
+            return self.token
+
+    def _peticion(self, metodo, ruta, params=None, json=None, autenticar=True, citas=False,
+                  clave_idempotencia=None, aceptar=(), binario=False, espera=0):
+        'Envía la petición y devuelve el cuerpo; lanza ErrorAPI si es un error'
+        url = (self.url_citas if citas else self.url) + ruta
+        headers = {}
+        if clave_idempotencia:
+            headers['Idempotency-Key'] = clave_idempotencia
+        for intento in range(2):
+            if autenticar and self.credenciales[0] is not None:
+                headers['Authorization'] = f'Bearer {self._token(renovar=intento > 0)}'
+            elif autenticar and self.token:
+                headers['Authorization'] = f'Bearer {self.token}'
+            respuesta = self.session.request(metodo, url, params=params, json=json,
+                                             headers=headers, timeout=self.timeout + espera)
+            # Un 401 con credenciales: token caducado o revocado, se renueva una vez
+            if respuesta.status_code != 401 or not autenticar or self.credenciales[0] is None:
+                break
+        if respuesta.status_code >= 400 and respuesta.status_code not in aceptar:
+            raise ErrorAPI(respuesta.status_code, _cuerpo(respuesta), metodo, ruta)
+        return respuesta.content if binario else _cuerpo(respuesta)
+
+    # ----- Peticiones en lote -----
+
+    def en_lote(self, funcion, argumentos, trabajadores=8):
+        '''
+        Llama a funcion(**kwargs) para cada diccionario de 'argumentos' con
+        'trabajadores' peticiones en paralelo. Devuelve los resultados en el
+        mismo orden; los errores se devuelven como excepciones, no se lanzan
+        '''
+        def llamar(kwargs):
+            try:
+                return funcion(**kwargs)
+            except (ErrorAPI, requests.exceptions.RequestException) as e:
+                return e
+
+        if not self.token and self.credenciales[0] is not None:
+            self._token()
+        with ThreadPoolExecutor(max_workers=trabajadores) as ejecutor:
+            return list(ejecutor.map(llamar, argumentos))
+
+    def crear_doctores(self, doctores, trabajadores=8):
+        'crear_doctor en lote (lista de diccionarios con sus parámetros)'
+        return self.en_lote(self.crear_doctor, doctores, trabajadores)
+
+    def crear_pacientes(self, pacientes, trabajadores=8):
+        'crear_paciente en lote'
+        return self.en_lote(self.crear_paciente, pacientes, trabajadores)
+
+    def crear_centros(self, centros, trabajadores=8):
+        'crear_centro en lote'
+        return self.en_lote(self.crear_centro, centros, trabajadores)
+
+    def agendar_citas(self, citas, trabajadores=8):
+        'agendar en lote'
+        return self.en_lote(self.agendar, citas, trabajadores)
+
+
+class ClienteOdontoCareAsync(_Endpoints):
+    'Cliente asíncrono (httpx); los métodos de los endpoints son corrutinas'
+
+    def __init__(self, url='http://localhost:5001', username=None, password=None, rol=None,
+                 url_citas=None, timeout=5, conexiones=16):
+        self.url = url.rstrip('/')
+        self.url_citas = (url_citas or url).rstrip('/')
+        self.credenciales = (username, password, rol)
+        self.timeout = timeout
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=conexiones,
+                                max_keepalive_connections=conexiones))
+        self.token = None
+        self.expira = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        'Cierra las conexiones del cliente'
+        await self.client.aclose()
+
+    async def login(self, username=None, password=None, rol=None):
+        'POST /auth/login: guarda el token y su caducidad y devuelve la respuesta'
+        if username is not None:
+            self.credenciales = (username, password, rol)
+        username, password, rol = self.credenciales
+        datos = await self._peticion('POST', '/auth/login', autenticar=False,
+                                     json={'username': username, 'password': password,
+                                           'rol': rol})
+        self.token = datos['token']
+        self.expira = _caducidad(datos)
+        return datos
+
+    async def _token(self, renovar=False):
+        'Token vigente: se renueva MARGEN_RENOVACION segundos antes de caducar'
+        async with self._lock:
+            if renovar or self.token is None or time.time() >= self.expira - MARGEN_RENOVACION:
+                await self.login()
+            return self.token
+
+    async def _peticion(self, metodo, ruta, params=None, json=None, autenticar=True,
+                        citas=False, clave_idempotencia=None, aceptar=(), binario=False,
+                        espera=0):
+        'Envía la petición y devuelve el cuerpo; lanza ErrorAPI si es un error'
+        url = (self.url_citas if citas else self.url) + ruta
+        headers = {}
+        if clave_idempotencia:
+            headers['Idempotency-Key'] = clave_idempotencia
+        for intento in range(2):
+            if autenticar and self.credenciales[0] is not None:
+                headers['Authorization'] = f'Bearer {await self._token(renovar=intento > 0)}'
+            elif autenticar and self.token:
+                headers['Authorization'] = f'Bearer {self.token}'
+            respuesta = await self.client.request(metodo, url, params=params, json=json,
+                                                  headers=headers,
+                                                  timeout=self.timeout + espera)
+            # Un 401 con credenciales: token caducado o revocado, se renueva una vez
+            if respuesta.status_code != 401 or not autenticar or self.credenciales[0] is None:
+                break
+        if respuesta.status_code >= 400 and respuesta.status_code not in aceptar:
+            raise ErrorAPI(respuesta.status_code, _cuerpo(respuesta), metodo, ruta)
+        return respuesta.content if binario else _cuerpo(respuesta)
+
+    # ----- Peticiones en lote -----
+
+    async def en_lote(self, funcion, argumentos, trabajadores=8):
+        '''
+        Espera funcion(**kwargs) para cada diccionario de 'argumentos' con
+        'trabajadores' corrutinas que envían una petición cada vez. Devuelve los resultados
+        en el mismo orden; los errores se devuelven como excepciones
+        '''
+        argumentos = list(argumentos)
+        resultados = [None] * len(argumentos)
+        pendientes = iter(enumerate(argumentos))
+
+        async def trabajador():
+            # Cada trabajador toma el siguiente argumento pendiente
+            for i, kwargs in pendientes:
+                try:
+                    resultados[i] = await funcion(**kwargs)
+                except (ErrorAPI, httpx.HTTPError) as e:
+                    resultados[i] = e
+
+        if not self.token and self.credenciales[0] is not None:
+            await self._token()
+        await asyncio.gather(*(trabajador() for _ in range(min(trabajadores, len(argumentos)))))
+        return resultados
+
+    async def crear_doctores(self, doctores, trabajadores=8):
+        'crear_doctor en lote (lista de diccionarios con sus parámetros)'
+        return await self.en_lote(self.crear_doctor, doctores, trabajadores)
+
+    async def crear_pacientes(self, pacientes, trabajadores=8):
+        'crear_paciente en lote'
+        return await self.en_lote(self.crear_paciente, pacientes, trabajadores)
+
+    async def crear_centros(self, centros, trabajadores=8):
+        'crear_centro en lote'
+        return await self.en_lote(self.crear_centro, centros, trabajadores)
+
+    async def agendar_citas(self, citas, trabajadores=8):
+        'agendar en lote'
+        return await self.en_lote(self.agendar, citas, trabajadores)
@@ -0,0 +1,150 @@
+'''
+Archivo de citas pasadas (particionado en caliente / en frío).
+Las citas con fecha anterior al corte (hoy menos ARCHIVO_DIAS días),
+activas o canceladas, se mueven de 'cita_medica' a 'cita_medica_archivo'
+por lotes de ARCHIVO_LOTE citas. Cada lote se copia y se borra en una
+única transacción, así que el proceso puede interrumpirse en cualquier
+momento y la siguiente ejecución continúa donde se quedó. Solo se borran
+de 'cita_medica' las citas cuya copia está en el archivo; si otro proceso
+archiva el mismo lote a la vez, una de las dos transacciones falla y no
+borra nada.
+Las consultas por rangos de fechas que llegan a las citas archivadas leen
+la unión de las dos tablas (entidad_citas), con las mismas columnas que
+CitaMedica.
+'''
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+from servicio_gestion import metrics
+from servicio_gestion.extensions import db
+from servicio_citas.config import Config
+from servicio_citas.models.citas import CitaArchivada, CitaMedica
+
+
+COLUMNAS = [columna.name for columna in CitaMedica.__table__.columns]
+
+# Citas activas y archivadas como una sola entidad con las columnas de CitaMedica
+_union = union_all(
+    select(*(CitaMedica.__table__.c[nombre] for nombre in COLUMNAS)),
+    select(*(CitaArchivada.__table__.c[nombre] for nombre in COLUMNAS)),
+).subquery('citas_con_archivo')
+CitasConArchivo = aliased(CitaMedica, _union, adapt_on_names=True)
+
+
+class ConflictoArchivo(Exception):
+    'Otro proceso ha archivado o cambiado las citas del lote a la vez'
+
+
+def corte(ahora=None):
+    'Fecha a partir de la cual las citas se quedan en la tabla de citas activas'
+    ahora = ahora or datetime.now()
+    dia = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
+    return dia - timedelta(days=Config.ARCHIVO_DIAS)
+
+
+def frontera():
+    'Fecha de la cita archivada más reciente (None si el archivo está vacío)'
+    return db.session.query(func.max(CitaArchivada.fecha)).scalar()
+
+
+def incluye_archivo(desde):
+    'Indica si un rango de fechas que empieza en desde (None: sin límite) llega al archivo'
+    ultima = frontera()
+    return ultima is not None and (desde is None or desde <= ultima)
+
+
+def entidad_citas(con_archivo):
+    '''
+    Entidad a consultar: CitaMedica o, con 'con_archivo', un alias de la unión
+    de las citas activas y archivadas que admite las mismas columnas y filtros
+    '''
+    return CitasConArchivo if con_archivo else CitaMedica
+
+
+def archivar_lote(hasta, lote):
+    '''
+    Mueve al archivo las 'lote' citas más antiguas con fecha anterior a
+    'hasta' en una sola transacción. Devuelve el número de citas movidas.
+    Las citas cuyo id_cita ya está en el archivo (id reutilizado en bases de
+    datos anteriores al AUTOINCREMENT) no se mueven.
+    '''
+    archivada = CitaArchivada.__table__.c
+    activa = CitaMedica.__table__.c
+    ids = list(db.session.execute(
+        select(CitaMedica.id_cita)
+        .where(CitaMedica.fecha < hasta,
+               ~select(archivada.id_cita).where(archivada.id_cita == activa.id_cita).exists())
+        .order_by(CitaMedica.fecha).limit(lote)).scalars())
+    if not ids:
+        return 0
+    columnas = [activa[nombre] for nombre in COLUMNAS]
+    try:
+        db.session.execute(
+            insert(CitaArchivada)
+            .from_select(COLUMNAS + ['archivada'],
+                         select(*columnas, literal(datetime.now()))
+                         .where(CitaMedica.id_cita.in_(ids))))
+    except IntegrityError as e:
+        db.session.rollback()
+        raise ConflictoArchivo('Las citas ya se están archivando en otro proceso') from e
+    # Solo se borran las citas cuya copia idéntica está en el archivo
+    copiada = select(archivada.id_cita).where(
+        *(archivada[nombre].is_not_distinct_from(activa[nombre]) for nombre in COLUMNAS)
+    ).exists()
+    movidas = db.session.execute(
+        delete(CitaMedica).where(CitaMedica.id_cita.in_(ids), copiada)
+        .execution_options(synchronize_session=False)).rowcount
+    if movidas != len(ids):
+        db.session.rollback()
+        raise ConflictoArchivo(f'Solo se han copiado {movidas} de {len(ids)} citas al archivo')
+    db.session.commit()
+    metrics.incrementar('archivo_citas_movidas', movidas)
+    return movidas
+
+
+def archivar(hasta=None, lote=None, max_lotes=None):
+    '''
+    Archiva por lotes las citas anteriores a 'hasta' (por defecto, el corte).
+    Con 'max_lotes' se detiene tras ese número de lotes.
+    Devuelve (citas movidas, si quedan citas por archivar).
+    '''
+    hasta = hasta or corte()
+    lote = lote or Config.ARCHIVO_LOTE
+    movidas = 0
+    lotes = 0
+    while max_lotes is None or lotes < max_lotes:
+        n = archivar_lote(hasta, lote)
+        movidas += n
+        lotes += 1
+        if n < lote:
+            return movidas, False
+    return movidas, True
+
+
+def _bucle(app):
+    'Archiva periódicamente las citas anteriores al corte'
+    while True:
+        with app.app_context():
+            try:
+                archivar()
+                metrics.fijar('archivo_ultima_ejecucion', datetime.now().isoformat())
+            except Exception as e:
+                db.session.rollback()
+                metrics.incrementar('archivo_errores')
+                app.logger.warning('Error al archivar citas: %s', e)
+            finally:
+                db.session.remove()
+        time.sleep(Config.ARCHIVO_INTERVALO)
+
+
+def iniciar(app):
+    'Arranca el archivado periódico en un hilo en segundo plano'
+    hilo = threading.Thread(target=_bucle, args=(app,), name='archivo_citas', daemon=True)
+    hilo.start()
+    return hilo
@@ -0,0 +1,86 @@
+'''
+Circuit breaker para las llamadas de servicio_citas a servicio_gestion.
+Estados:
+    - cerrado: las llamadas pasan; se cuentan los fallos consecutivos
+    - abierto: las llamadas se rechazan sin salir del proceso
+    - semiabierto: pasado el tiempo de apertura se deja pasar un número
+      limitado de sondeos; si aciertan se cierra, si fallan se vuelve a abrir
+'''
+
+import threading
+import time
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+
+class CircuitBreaker:
+    'Circuit breaker con sondeo semiabierto, seguro entre hilos'
+
+    def __init__(self, nombre, umbral_fallos=5, tiempo_apertura=30.0, max_sondeos=1):
+        self.nombre = nombre
+        self.umbral_fallos = umbral_fallos
+        self.tiempo_apertura = tiempo_apertura
+        self.max_sondeos = max_sondeos
+        self._lock = threading.Lock()
+        self._estado = CERRADO
+        self._fallos = 0
+        self._abierto_desde = 0.0
+        self._sondeos = 0
+        self._sondeo_desde = 0.0
+        self._aperturas = 0
+
+    def permitir(self):
+        'Indica si se puede hacer una llamada ahora'
+        with self._lock:
+            if self._estado == ABIERTO:
+                if time.monotonic() - self._abierto_desde < self.tiempo_apertura:
+                    return False
+                # Pasado el tiempo de apertura se prueban unas pocas llamadas
+                self._estado = SEMIABIERTO
+                self._sondeos = 0
+                self._sondeo_desde = time.monotonic()
+            if self._estado == SEMIABIERTO:
+                # Si un sondeo se ha perdido (sin éxito ni fallo registrado),
+                # pasado otro tiempo de apertura se permite uno nuevo
+                ahora = time.monotonic()
+                if ahora - self._sondeo_desde >= self.tiempo_apertura:
+                    self._sondeos = 0
+                if self._sondeos >= self.max_sondeos:
+                    return False
+                self._sondeos += 1
+                self._sondeo_desde = ahora
+            return True
+
+    def registrar_exito(self):
+        'Registra una llamada correcta: cierra el circuito'
+        with self._lock:
+            self._estado = CERRADO
+            self._fallos = 0
+            self._sondeos = 0
+
+    def registrar_fallo(self):
+        'Registra una llamada fallida: abre el circuito al superar el umbral'
+        with self._lock:
+            self._fallos += 1
+            if self._estado == SEMIABIERTO or self._fallos >= self.umbral_fallos:
+                if self._estado != ABIERTO:
+                    self._aperturas += 1
+                self._estado = ABIERTO
+                self._abierto_desde = time.monotonic()
+                self._sondeos = 0
+
+    def segundos_para_sondeo(self):
+        'Segundos que faltan para el siguiente sondeo (0 si no está abierto)'
+        with self._lock:
+            if self._estado != ABIERTO:
+                return 0.0
+            return max(0.0, self.tiempo_apertura - (time.monotonic() - self._abierto_desde))
+
+    def estado(self):
+        'Estado actual del circuito en un diccionario serializable'
+        with self._lock:
+            return {'estado': self._estado,
+                    'fallos_consecutivos': self._fallos,
+                    'aperturas': self._aperturas}
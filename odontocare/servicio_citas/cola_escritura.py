@@ -0,0 +1,192 @@
+'''
+Cola de escritura con commit agrupado (group commit) para las citas.
+Con ESCRITURA_AGRUPADA activa, las escrituras de agendar, modificar y
+cancelar no hacen cada una su propio commit: se encolan y un único hilo
+escritor por proceso las ejecuta por grupos (las que llegan en
+ESCRITURA_VENTANA_MS milisegundos, hasta ESCRITURA_LOTE_MAX) dentro de
+una sola transacción. En SQLite esto supone un bloqueo de escritura y un
+fsync por grupo en lugar de uno por cita.
+Cada petición espera el resultado de su propia operación, que solo se
+entrega cuando el commit del grupo ha terminado. Si el grupo falla, se
+deshace y sus operaciones se repiten una a una, cada una con su commit,
+para que el error de una no afecte a las demás.
+Una operación es una función que usa db.session y devuelve (cuerpo,
+status). Si rechaza la escritura (por ejemplo, el doctor ya tiene una cita
+a esa hora) debe hacerlo antes de modificar la sesión, porque comparte la
+transacción con las demás operaciones del grupo.
+'''
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app
+
+from servicio_gestion import metrics
+from servicio_gestion.extensions import db
+
+
+class EscrituraDescartada(Exception):
+    'La operación no llegó a ejecutarse en el plazo de ESCRITURA_PLAZO segundos'
+
+
+class _Tarea:
+    'Operación pendiente de la cola y el futuro con su resultado'
+
+    def __init__(self, operacion, args):
+        self.operacion = operacion
+        self.args = args
+        self.futuro = Future()
+
+
+class ColaEscritura:
+    'Cola de escrituras con un hilo escritor que hace un commit por grupo'
+
+    def __init__(self, app, ventana=0.002, lote_max=64, plazo=10.0):
+        self.app = app
+        self.ventana = ventana
+        self.lote_max = lote_max
+        self.plazo = plazo
+        self._lock = threading.Lock()
+        self._pid = None
+        self._cola = None
+        self._grupos = 0
+        self._operaciones = 0
+
+    def _arrancar(self):
+        'Arranca el hilo escritor la primera vez (y de nuevo en un proceso hijo tras fork)'
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._cola = queue.Queue()
+                hilo = threading.Thread(target=self._bucle, name='cola_escritura',
+                                        daemon=True)
+                hilo.start()
+
+    def enviar(self, operacion, *args):
+        'Encola una operación y devuelve el futuro con su resultado'
+        if self._pid != os.getpid():
+            self._arrancar()
+        tarea = _Tarea(operacion, args)
+        self._cola.put(tarea)
+        return tarea.futuro
+
+    def ejecutar(self, operacion, *args):
+        '''
+        Encola la operación y espera su resultado. Si no ha empezado a
+        ejecutarse en el plazo, se descarta y se lanza EscrituraDescartada;
+        si ya se está ejecutando, se espera a que termine.
+        '''
+        # La sesión de la petición devuelve su conexión al pool antes de esperar:
+        # si todas las peticiones en espera retuvieran la suya, el hilo escritor
+        # podría quedarse sin conexión
+        db.session.close()
+        futuro = self.enviar(operacion, *args)
+        try:
+            return futuro.result(timeout=self.plazo)
+        except TimeoutError:
+            if futuro.cancel():
+                metrics.incrementar('escritura_descartadas')
+                raise EscrituraDescartada('La cola de escritura está saturada; '
+                                          'inténtelo de nuevo') from None
+            return futuro.result()
+
+    def _recoger(self):
+        'Espera la primera operación y reúne las que llegan dentro de la ventana'
+        grupo = [self._cola.get()]
+        limite = time.monotonic() + self.ventana
+        while len(grupo) < self.lote_max:
+            try:
+                restante = limite - time.monotonic()
+                if restante > 0:
+                    grupo.append(self._cola.get(timeout=restante))
+                else:
+                    # Pasada la ventana se añaden solo las que ya están en la cola
+                    grupo.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+        # Las operaciones cuyo plazo ha vencido ya no se ejecutan
+        return [tarea for tarea in grupo if tarea.futuro.set_running_or_notify_cancel()]
+
+    def _bucle(self):
+        'Ejecuta los grupos de operaciones de la cola'
+        while True:
+            grupo = self._recoger()
+            if not grupo:
+                continue
+            with self.app.app_context():
+                try:
+                    self._ejecutar_grupo(grupo)
+                finally:
+                    db.session.remove()
+
+    def _ejecutar_grupo(self, grupo):
+        'Ejecuta el grupo en una transacción; si falla, repite cada operación por separado'
+        try:
+            resultados = [tarea.operacion(*tarea.args) for tarea in grupo]
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.warning('Error en un grupo de %d escrituras, se repiten una a '
+                                    'una: %s', len(grupo), e)
+            metrics.incrementar('escritura_grupos_repetidos')
+            for tarea in grupo:
+                self._ejecutar_sola(tarea)
+            return
+        self._grupos += 1
+        self._operaciones += len(grupo)
+        metrics.incrementar('escritura_grupos')
+        metrics.incrementar('escritura_operaciones', len(grupo))
+        for tarea, resultado in zip(grupo, resultados):
+            tarea.futuro.set_result(resultado)
+
+    def _ejecutar_sola(self, tarea):
+        'Ejecuta una operación con su propio commit'
+        try:
+            resultado = tarea.operacion(*tarea.args)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            tarea.futuro.set_exception(e)
+            return
+        self._grupos += 1
+        self._operaciones += 1
+        tarea.futuro.set_result(resultado)
+
+    def estado(self):
+        'Operaciones pendientes y tamaño medio de los grupos'
+        return {'pendientes': self._cola.qsize() if self._cola is not None else 0,
+                'grupos': self._grupos,
+                'operaciones': self._operaciones,
+                'operaciones_por_grupo': round(self._operaciones / self._grupos, 2)
+                                         if self._grupos else 0}
+
+
+def ejecutar(operacion, *args):
+    '''
+    Ejecuta una operación de escritura y devuelve su resultado: en la cola de
+    escritura de la app si está activa o, si no, directamente con su commit
+    '''
+    cola = current_app.extensions.get('cola_escritura')
+    if cola is not None:
+        return cola.ejecutar(operacion, *args)
+    try:
+        resultado = operacion(*args)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return resultado
+
+
+def init_app(app):
+    'Activa la cola de escritura de la app si ESCRITURA_AGRUPADA está activa'
+    if not app.config.get('ESCRITURA_AGRUPADA', False):
+        return
+    cola = ColaEscritura(app, ventana=app.config.get('ESCRITURA_VENTANA_MS', 2) / 1000,
+                         lote_max=app.config.get('ESCRITURA_LOTE_MAX', 64),
+                         plazo=app.config.get('ESCRITURA_PLAZO', 10.0))
+    app.extensions['cola_escritura'] = cola
+    metrics.registrar_proveedor('cola_escritura', cola.estado)
@@ -7,6 +7,8 @@ import enum
 import datetime
 from dotenv import load_dotenv
 
+from servicio_gestion import base_datos
+
 # Define el directorio de trabajo
 dir_actual = getcwd()
 basedir_data = dir_actual + '\\data'
@@ -26,14 +28,14 @@ class Config:
     # Intenta leer la ruta de la base de datos desde una variable de entorno (para Docker)
     # Si no existe, usa la ruta de la carpeta local
 
-    db_external_path = getenv('DB_PATH')
-    if db_external_path:
-        # Dentro de Docker, usa la ruta absoluta montada
-        print(db_external_path)
-        SQLALCHEMY_DATABASE_URI = 'sqlite:////app/data/odontocare.db'    #{db_external_path}'
-    else:
-        # Fuera de Docker, se mantiene la ruta original
-        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path.join(basedir_db, 'odontocare.db')
+    # DATABASE_URL tiene prioridad; dentro de Docker se usa el fichero de DB_PATH
+    # y fuera de Docker se mantiene la ruta original
+    SQLALCHEMY_DATABASE_URI = base_datos.url_base_datos(path.join(basedir_db, 'odontocare.db'))
+    # Plazo por sentencia (milisegundos, 0 sin límite) y opciones del pool de
+    # conexiones (DB_POOL_SIZE, DB_MAX_OVERFLOW, ... en servicio_gestion/base_datos.py)
+    DB_STATEMENT_TIMEOUT = int(getenv('DB_STATEMENT_TIMEOUT', '0'))
+    SQLALCHEMY_ENGINE_OPTIONS = base_datos.opciones_motor(SQLALCHEMY_DATABASE_URI,
+                                                          DB_STATEMENT_TIMEOUT)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DEBUG = True
     SECRET_KEY = getenv('SECRET_KEY')
@@ -41,8 +43,104 @@ class Config:
     JWT_SECRET_KEY = getenv('JWT_SECRET_KEY')
     JWT_EXPIRATION_DELTA = datetime.timedelta(hours=12)  # Tiempo de expiración del token
     FLASK_ENV = getenv('FALSK_ENV')
+    # URL base del servicio de gestión (consultas de pacientes, doctores y centros)
+    GESTION_URL = getenv('GESTION_URL', 'http://localhost:5001')
+    # /citas/agendar consulta paciente, doctor y centro a gestión en paralelo,
+    # con un pool de GESTION_HILOS hilos por proceso (no es un modo asyncio).
+    # Reduce la latencia con poca carga; con cientos de citas en curso no da
+    # más capacidad que el modo secuencial (el servidor WSGI sigue usando un
+    # hilo por petición), así que ese objetivo no se cumple con este modo
+    CITAS_REFERENCIAS_PARALELO = getenv('CITAS_REFERENCIAS_PARALELO', 'false').lower() == 'true'
+    GESTION_HILOS = int(getenv('GESTION_HILOS', '8'))
+    # Plazo total (segundos) de las llamadas a servicio_gestion en una petición
+    GESTION_PLAZO = float(getenv('GESTION_PLAZO', '4'))
+    # Reintentos de las consultas GET y espera base del backoff exponencial (segundos)
+    GESTION_REINTENTOS = int(getenv('GESTION_REINTENTOS', '2'))
+    GESTION_BACKOFF = float(getenv('GESTION_BACKOFF', '0.05'))
+    # Circuit breaker: fallos consecutivos para abrirlo y segundos hasta el sondeo
+    CB_UMBRAL_FALLOS = int(getenv('CB_UMBRAL_FALLOS', '5'))
+    CB_TIEMPO_APERTURA = float(getenv('CB_TIEMPO_APERTURA', '30'))
+    # Caché de estadísticas de periodos cerrados (y número máximo de entradas)
+    ESTADISTICAS_CACHE = getenv('ESTADISTICAS_CACHE', 'true').lower() == 'true'
+    ESTADISTICAS_CACHE_MAX = int(getenv('ESTADISTICAS_CACHE_MAX', '256'))
+    # Segundos que vale cada entrada: los cambios hechos por otros procesos
+    # (otro worker o app_gestion) solo se ven al caducar
+    ESTADISTICAS_CACHE_TTL = float(getenv('ESTADISTICAS_CACHE_TTL', '60'))
+    # Validación de las referencias de las citas: 'http' (servicio_gestion),
+    # 'sql' (consulta directa a la base de datos compartida) o 'replica'
+    REFERENCIAS_BACKEND = getenv('REFERENCIAS_BACKEND', 'http').lower()
+    # Réplica local de pacientes, doctores y centros (eventos del outbox de gestión):
+    # segundos entre sincronizaciones y eventos leídos por petición
+    REPLICA_INTERVALO = float(getenv('REPLICA_INTERVALO', '1'))
+    REPLICA_LOTE = int(getenv('REPLICA_LOTE', '500'))
+    # Búsqueda de huecos libres: jornada (lunes a viernes), duración de una
+    # cita en minutos y días máximos hacia delante
+    JORNADA_INICIO = getenv('JORNADA_INICIO', '09:00')
+    JORNADA_FIN = getenv('JORNADA_FIN', '17:00')
+    CITA_DURACION = int(getenv('CITA_DURACION', '30'))
+    HUECOS_HORIZONTE_DIAS = int(getenv('HUECOS_HORIZONTE_DIAS', '60'))
+    # Archivo de citas pasadas: días que se quedan en la tabla de citas activas,
+    # citas movidas por transacción y segundos entre ejecuciones (0 lo desactiva)
+    ARCHIVO_DIAS = int(getenv('ARCHIVO_DIAS', '90'))
+    ARCHIVO_LOTE = int(getenv('ARCHIVO_LOTE', '1000'))
+    ARCHIVO_INTERVALO = float(getenv('ARCHIVO_INTERVALO', '3600'))
+    # Compresión de respuestas: umbral mínimo en bytes, niveles de cada
+    # algoritmo y orden de preferencia (br y zstd usan brotli y zstandard, de
+    # requirements.txt; si faltan se omiten y queda gzip)
+    COMPRESION_ACTIVA = getenv('COMPRESION_ACTIVA', 'true').lower() == 'true'
+    COMPRESION_UMBRAL = int(getenv('COMPRESION_UMBRAL', '1024'))
+    COMPRESION_NIVEL = int(getenv('COMPRESION_NIVEL', '6'))
+    COMPRESION_NIVEL_BR = int(getenv('COMPRESION_NIVEL_BR', '4'))
+    COMPRESION_NIVEL_ZSTD = int(getenv('COMPRESION_NIVEL_ZSTD', '3'))
+    COMPRESION_ALGORITMOS = getenv('COMPRESION_ALGORITMOS', 'br,zstd,gzip').split(',')
+    # Caché de los listados de doctores y centros médicos: número máximo de
+    # respuestas en memoria, segundos de validez y fichero SQLite opcional
+    # compartido entre procesos (vacío para usar solo la memoria del proceso)
+    RESPUESTAS_CACHE = getenv('RESPUESTAS_CACHE', 'true').lower() == 'true'
+    RESPUESTAS_CACHE_MAX = int(getenv('RESPUESTAS_CACHE_MAX', '512'))
+    RESPUESTAS_CACHE_TTL = float(getenv('RESPUESTAS_CACHE_TTL', '300'))
+    RESPUESTAS_CACHE_RUTA = getenv('RESPUESTAS_CACHE_RUTA', '')
+    # Cola de escritura de citas con commit agrupado: milisegundos que se esperan
+    # para reunir un grupo, operaciones máximas por grupo y segundos que una
+    # petición espera a que su operación empiece antes de descartarla
+    ESCRITURA_AGRUPADA = getenv('ESCRITURA_AGRUPADA', 'false').lower() == 'true'
+    ESCRITURA_VENTANA_MS = float(getenv('ESCRITURA_VENTANA_MS', '2'))
+    ESCRITURA_LOTE_MAX = int(getenv('ESCRITURA_LOTE_MAX', '64'))
+    ESCRITURA_PLAZO = float(getenv('ESCRITURA_PLAZO', '10'))
+    # Claves de idempotencia (cabecera Idempotency-Key) de agendar, modificar y
+    # cancelar: segundos que se guarda cada respuesta y entradas en memoria
+    IDEMPOTENCIA = getenv('IDEMPOTENCIA', 'true').lower() == 'true'
+    IDEMPOTENCIA_TTL = float(getenv('IDEMPOTENCIA_TTL', '86400'))
+    IDEMPOTENCIA_MAX = int(getenv('IDEMPOTENCIA_MAX', '10000'))
+    # Calentamiento al arrancar (GET /ready responde 200 cuando termina) y
+    # conexiones que se abren con servicio_gestion
+    CALENTAMIENTO = getenv('CALENTAMIENTO', 'true').lower() == 'true'
+    CALENTAMIENTO_HTTP = getenv('CALENTAMIENTO_HTTP', 'true').lower() == 'true'
+    CALENTAMIENTO_CONEXIONES_HTTP = int(getenv('CALENTAMIENTO_CONEXIONES_HTTP', '4'))
+    # Trazas por petición (spans de auth, validación, llamadas a gestión, SQL y
+    # serialización) en un fichero JSON lines que agrega 'resumen_trazas.py'
+    TRAZAS = getenv('TRAZAS', 'false').lower() == 'true'
+    TRAZAS_RUTA = getenv('TRAZAS_RUTA', path.join(dir_actual, 'trazas.jsonl'))
+    TRAZAS_SERVICIO = 'servicio_citas'
+    # Perfilado con cProfile de las peticiones con la cabecera X-Perfilar (de un
+    # administrador) y de una fracción de las demás; se consulta en /admin/perfiles
+    PERFILADO = getenv('PERFILADO', 'false').lower() == 'true'
+    PERFILADO_MUESTREO = float(getenv('PERFILADO_MUESTREO', '0'))
+    # Flujo de cambios de la agenda (/citas/eventos): segundos que se guardan
+    # los eventos, máximos entre consultas, entre latidos y de cada conexión,
+    # eventos por consulta y espera máxima del long-poll
+    EVENTOS_TTL = float(getenv('EVENTOS_TTL', '86400'))
+    EVENTOS_INTERVALO = float(getenv('EVENTOS_INTERVALO', '1'))
+    EVENTOS_LATIDO = float(getenv('EVENTOS_LATIDO', '15'))
+    EVENTOS_DURACION_MAX = float(getenv('EVENTOS_DURACION_MAX', '300'))
+    EVENTOS_LOTE = int(getenv('EVENTOS_LOTE', '500'))
+    EVENTOS_ESPERA_MAX = float(getenv('EVENTOS_ESPERA_MAX', '30'))
+    # Segundos que se guardan los eventos del outbox que ya tienen otro
+    # posterior de la misma entidad (el último de cada entidad no se borra)
+    OUTBOX_TTL = float(getenv('OUTBOX_TTL', '604800'))
 
 class TestingConfig(Config):
     'configuración de testing'
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:' # Base de datos en memoria
+    SQLALCHEMY_ENGINE_OPTIONS = base_datos.opciones_motor(SQLALCHEMY_DATABASE_URI)
@@ -0,0 +1,126 @@
+'''
+Búsqueda de los próximos huecos libres entre todos los doctores de una
+especialidad (y opcionalmente de un centro médico).
+Para cada doctor se recorren sus citas ordenadas generando los huecos
+libres dentro de la jornada, y los generadores de todos los doctores se
+mezclan con un heap (heapq.merge), de modo que solo se calculan los huecos
+necesarios para devolver los N primeros.
+Las citas se leen por ventanas de días crecientes: normalmente basta con
+el primer día para encontrar los huecos pedidos.
+'''
+
+import heapq
+from datetime import timedelta
+from itertools import islice
+
+from sqlalchemy import func, select
+
+from servicio_gestion.extensions import db
+from servicio_gestion.models.doctores import Doctor
+from servicio_citas.config import Config
+from servicio_citas.models.citas import CitaMedica, ocupa_agenda
+
+
+def _hora(texto):
+    'Convierte HH:MM en timedelta desde medianoche'
+    horas, minutos = texto.split(':')
+    return timedelta(hours=int(horas), minutes=int(minutos))
+
+
+def buscar_doctores(especialidad, id_centro=None):
+    '''
+    Identificadores de los doctores de la especialidad (sin distinguir
+    mayúsculas). Con 'id_centro', solo los que tienen citas en ese centro.
+    '''
+    consulta = db.session.query(Doctor.id_doctor).filter(
+        func.lower(Doctor.especialidad) == especialidad.lower())
+    if id_centro is not None:
+        # Una búsqueda en el índice (id_centro, id_doctor) por doctor
+        consulta = consulta.filter(
+            db.session.query(CitaMedica.id_cita)
+            .filter(CitaMedica.id_centro == id_centro,
+                    CitaMedica.id_doctor == Doctor.id_doctor).exists())
+    return [fila.id_doctor for fila in consulta.order_by(Doctor.id_doctor)]
+
+
+def _citas_por_doctor(ids_doctores, inicio, fin):
+    '''
+    Fechas de las citas no canceladas que ocupan tiempo en [inicio, fin),
+    agrupadas por doctor y ordenadas (recorre el índice (id_doctor, fecha)).
+    '''
+    duracion_cita = timedelta(minutes=Config.CITA_DURACION)
+    filas = db.session.execute(
+        select(CitaMedica.id_doctor, CitaMedica.fecha)
+        .where(CitaMedica.id_doctor.in_(ids_doctores),
+               CitaMedica.fecha > inicio - duracion_cita,
+               CitaMedica.fecha < fin,
+               ocupa_agenda())
+        .order_by(CitaMedica.id_doctor, CitaMedica.fecha))
+    citas = {id_doctor: [] for id_doctor in ids_doctores}
+    for id_doctor, fecha in filas:
+        citas[id_doctor].append(fecha)
+    return citas
+
+
+def _huecos_doctor(id_doctor, citas, inicio, fin, duracion):
+    '''
+    Genera en orden los huecos libres (fecha, id_doctor) de un doctor que
+    empiezan en [inicio, fin), dentro de la jornada de lunes a viernes.
+    'citas' son las fechas de inicio de sus citas, ordenadas.
+    '''
+    duracion_cita = timedelta(minutes=Config.CITA_DURACION)
+    apertura = _hora(Config.JORNADA_INICIO)
+    cierre = _hora(Config.JORNADA_FIN)
+    indice = 0
+    momento = inicio
+    siguiente_dia = momento
+    while momento < fin:
+        # Los límites de la jornada solo se recalculan al cambiar de día
+        if momento >= siguiente_dia:
+            dia = momento.replace(hour=0, minute=0, second=0, microsecond=0)
+            siguiente_dia = dia + timedelta(days=1)
+            laborable = dia.weekday() < 5
+            abre, cierra = dia + apertura, dia + cierre
+        # Fin de semana o fuera de la jornada: se pasa a la siguiente apertura
+        if not laborable or momento + duracion > cierra:
+            momento = siguiente_dia + apertura
+            continue
+        if momento < abre:
+            momento = abre
+            continue
+        # Se descartan las citas que ya han terminado
+        while indice < len(citas) and citas[indice] + duracion_cita <= momento:
+            indice += 1
+        # Si la siguiente cita se solapa con el hueco, se sigue al terminar la cita
+        if indice < len(citas) and citas[indice] < momento + duracion:
+            momento = citas[indice] + duracion_cita
+            continue
+        yield momento, id_doctor
+        momento += duracion
+
+
+def buscar_huecos(ids_doctores, desde, duracion, n):
+    '''
+    Devuelve los 'n' primeros huecos libres (fecha, id_doctor) de 'duracion'
+    a partir de 'desde' entre los doctores indicados, hasta un máximo de
+    HUECOS_HORIZONTE_DIAS días.
+    '''
+    huecos = []
+    if not ids_doctores:
+        return huecos
+    limite = desde + timedelta(days=Config.HUECOS_HORIZONTE_DIAS)
+    inicio = desde
+    dias = 1
+    while len(huecos) < n and inicio < limite:
+        # Las ventanas terminan a medianoche para no partir ninguna jornada
+        fin = inicio.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=dias)
+        fin = min(fin, limite)
+        citas = _citas_por_doctor(ids_doctores, inicio, fin + duracion)
+        generadores = [_huecos_doctor(id_doctor, citas[id_doctor], inicio, fin, duracion)
+                       for id_doctor in ids_doctores]
+        # Mezcla ordenada de los huecos de todos los doctores
+        huecos += islice(heapq.merge(*generadores), n - len(huecos))
+        # La ventana siguiente empieza donde termina esta y es el doble de larga
+        inicio = fin
+        dias *= 2
+    return huecos
@@ -0,0 +1,159 @@
+'''
+Estadísticas de citas calculadas en la base de datos con GROUP BY:
+número de citas, cancelaciones y tasa de cancelación agrupadas por
+doctor, centro, estado y/o periodo (día, semana o mes).
+Los resultados de periodos cerrados (que terminan antes de hoy) se
+guardan opcionalmente en una caché en memoria. Al confirmar cambios en
+citas (altas, modificaciones, cancelaciones u operaciones masivas) se
+borran las entradas cuyo rango de fechas incluye alguna cita cambiada.
+Esa invalidación solo ve los cambios del propio proceso: los de otros
+procesos (otro worker o app_gestion, que también monta las rutas de
+citas) se ven cuando caduca la entrada (ESTADISTICAS_CACHE_TTL).
+'''
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.orm import Session
+
+from servicio_gestion.extensions import db
+from servicio_gestion import metrics
+from servicio_citas import archivo
+from servicio_citas.config import Config
+from servicio_citas.models.citas import CitaMedica
+
+
+# Columnas por las que se puede agrupar
+AGRUPACIONES = {
+    'doctor': CitaMedica.id_doctor,
+    'centro': CitaMedica.id_centro,
+    'estado': CitaMedica.estado,
+}
+
+# Expresiones SQL (SQLite) que calculan la clave de cada periodo.
+# SQLite guarda las fechas como texto ISO, así que 'substr' evita
+# interpretar la fecha en cada fila (bastante más barato que strftime)
+PERIODOS = {
+    'dia': lambda fecha: func.substr(fecha, 1, 10),
+    # Lunes de la semana de la cita
+    'semana': lambda fecha: func.date(fecha, 'weekday 0', '-6 days'),
+    'mes': lambda fecha: func.substr(fecha, 1, 7),
+}
+
+# Nombre de cada agrupación en la respuesta
+NOMBRES = {'doctor': 'id_doctor', 'centro': 'id_centro', 'estado': 'estado'}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _periodo_cerrado(hasta):
+    'Un periodo está cerrado si termina antes del día de hoy'
+    hoy = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return hasta is not None and hasta <= hoy
+
+
+def calcular_estadisticas(agrupar, periodo=None, desde=None, hasta=None,
+                          id_doctor=None, id_centro=None):
+    '''
+    Calcula las estadísticas con una única consulta agregada.
+    'desde' es inclusivo y 'hasta' exclusivo (objetos datetime o None).
+    Devuelve (filas, desde_cache).
+    '''
+    clave = (tuple(agrupar), periodo, desde, hasta, id_doctor, id_centro)
+    usar_cache = Config.ESTADISTICAS_CACHE and _periodo_cerrado(hasta)
+    if usar_cache:
+        with _cache_lock:
+            entrada = _cache.get(clave)
+            if entrada is not None and entrada[1] > time.monotonic():
+                _cache.move_to_end(clave)
+                metrics.incrementar('estadisticas_cache_aciertos')
+                return entrada[0], True
+            if entrada is not None:
+                metrics.incrementar('estadisticas_cache_caducadas')
+        metrics.incrementar('estadisticas_cache_fallos')
+
+    # Los rangos que llegan a las citas archivadas leen también el archivo
+    fuente = archivo.entidad_citas(archivo.incluye_archivo(desde))
+
+    # Columnas del GROUP BY
+    columnas = [getattr(fuente, NOMBRES[nombre]).label(NOMBRES[nombre]) for nombre in agrupar]
+    if periodo:
+        columnas.append(PERIODOS[periodo](fuente.fecha).label('periodo'))
+
+    total = func.count().label('total')
+    canceladas = func.sum(case((fuente.estado == 'cancelada', 1), else_=0)).label('canceladas')
+    consulta = db.session.query(*columnas, total, canceladas)
+
+    # Filtros: el rango de fechas recorre el índice de cobertura por 'fecha'
+    if desde is not None:
+        consulta = consulta.filter(fuente.fecha >= desde)
+    if hasta is not None:
+        consulta = consulta.filter(fuente.fecha < hasta)
+    if id_doctor is not None:
+        consulta = consulta.filter(fuente.id_doctor == id_doctor)
+    if id_centro is not None:
+        consulta = consulta.filter(fuente.id_centro == id_centro)
+    if columnas:
+        consulta = consulta.group_by(*columnas).order_by(*columnas)
+
+    filas = []
+    for fila in consulta.all():
+        datos = fila._asdict()
+        datos['canceladas'] = datos['canceladas'] or 0
+        datos['tasa_cancelacion'] = (round(datos['canceladas'] / datos['total'], 4)
+                                     if datos['total'] else 0.0)
+        filas.append(datos)
+
+    if usar_cache:
+        with _cache_lock:
+            # Cada entrada guarda las filas y el instante en que caduca
+            _cache[clave] = (filas, time.monotonic() + Config.ESTADISTICAS_CACHE_TTL)
+            _cache.move_to_end(clave)
+            while len(_cache) > Config.ESTADISTICAS_CACHE_MAX:
+                _cache.popitem(last=False)
+    return filas, False
+
+
+def invalidar(fechas):
+    'Borra de la caché las entradas cuyo rango de fechas incluye alguna de las fechas'
+    with _cache_lock:
+        for clave in list(_cache):
+            desde, hasta = clave[2], clave[3]
+            if any((desde is None or fecha >= desde) and (hasta is None or fecha < hasta)
+                   for fecha in fechas):
+                del _cache[clave]
+
+
+def anotar_cambios(session, fechas):
+    'Anota en la sesión las fechas de citas cambiadas sin pasar por el ORM (sentencias UPDATE)'
+    session.info.setdefault('estadisticas_fechas', set()).update(fechas)
+
+
+@event.listens_for(Session, 'after_flush')
+def anotar_fechas(session, flush_context):
+    'Anota en la sesión las fechas (nuevas y anteriores) de las citas cambiadas en este flush'
+    fechas = set()
+    for objeto in (*session.new, *session.dirty, *session.deleted):
+        if type(objeto) is CitaMedica:
+            fechas.add(objeto.fecha)
+            fechas.update(inspect(objeto).attrs.fecha.history.deleted)
+    if fechas:
+        anotar_cambios(session, fechas)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidar_fechas(session):
+    'Tras confirmar la transacción, invalida las estadísticas de las fechas anotadas'
+    fechas = session.info.pop('estadisticas_fechas', None)
+    if fechas:
+        invalidar(fechas)
+
+
+@event.listens_for(Session, 'after_rollback')
+def descartar_fechas(session):
+    'Los cambios deshechos no invalidan nada'
+    session.info.pop('estadisticas_fechas', None)
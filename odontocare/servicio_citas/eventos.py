@@ -0,0 +1,172 @@
+'''
+Flujo de cambios de la agenda de un doctor o de un centro médico
+(/citas/eventos), para sustituir las consultas periódicas a /listar_citas.
+Los eventos salen de la tabla cita_eventos (ver models/eventos_citas), que
+se escribe en la misma transacción que las citas. Cada conexión:
+    - empieza tras el último evento que recibió el cliente (cabecera
+      Last-Event-ID, que EventSource envía al reconectar, o parámetro
+      'desde') o, si no lo indica, tras el último evento existente
+    - busca eventos nuevos en cuanto se confirma una escritura de citas en el
+      mismo proceso y, como mucho, cada EVENTOS_INTERVALO segundos (para las
+      escrituras de otros procesos o del otro servicio)
+    - envía un latido cada EVENTOS_LATIDO segundos sin eventos, que mantiene
+      la conexión abierta y adelanta el Last-Event-ID del cliente
+    - termina tras EVENTOS_DURACION_MAX segundos; el cliente se vuelve a
+      conectar con Last-Event-ID sin perder eventos
+Si los eventos siguientes al último recibido ya se han borrado (EVENTOS_TTL),
+se envía un evento 'reinicio': el cliente debe volver a leer la agenda.
+El JWT se decodifica una vez por conexión y el médico se identifica por el
+id_doctor del token (solo los tokens sin ese claim consultan a
+servicio_gestion, una vez por conexión).
+Cada conexión abierta ocupa un hilo del servidor mientras dura.
+'''
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import Session
+
+from servicio_gestion import metrics
+from servicio_gestion.extensions import db
+from servicio_citas.models.eventos_citas import EventoCita
+
+
+# Milisegundos que espera EventSource antes de reconectar
+REINTENTO_MS = 3000
+
+_condicion = threading.Condition()
+_estado = {'generacion': 0, 'conexiones': 0, 'enviados': 0}
+
+
+@event.listens_for(Session, 'after_commit')
+def avisar(session):
+    'Despierta a las conexiones abiertas cuando se confirman eventos de citas'
+    if session.info.pop('eventos_citas', False):
+        with _condicion:
+            _estado['generacion'] += 1
+            _condicion.notify_all()
+
+
+@event.listens_for(Session, 'after_rollback')
+def descartar(session):
+    'Los eventos deshechos no se avisan'
+    session.info.pop('eventos_citas', None)
+
+
+def _esperar(generacion, segundos):
+    'Espera hasta que se confirmen eventos nuevos en el proceso o pasen los segundos'
+    with _condicion:
+        _condicion.wait_for(lambda: _estado['generacion'] != generacion,
+                            timeout=max(segundos, 0))
+
+
+def posicion_inicial(desde):
+    '''
+    Devuelve (último evento ya recibido, reinicio). 'reinicio' es True si
+    faltan eventos posteriores a 'desde' (borrados por EVENTOS_TTL) o si
+    'desde' no existe: en ese caso se continúa desde el último evento
+    '''
+    primero, ultimo = db.session.query(func.min(EventoCita.id_evento),
+                                       func.max(EventoCita.id_evento)).one()
+    ultimo = ultimo or 0
+    if desde is None:
+        return ultimo, False
+    if desde > ultimo or (primero is not None and primero > desde + 1):
+        return ultimo, True
+    return desde, False
+
+
+def consultar(ultimo, id_doctor=None, id_centro=None):
+    '''
+    Eventos del doctor o del centro posteriores a 'ultimo' y nuevo valor de
+    'ultimo': el último evento leído, aunque sea de otra agenda, para que la
+    siguiente consulta no vuelva a recorrerlo
+    '''
+    lote = current_app.config['EVENTOS_LOTE']
+    tope = db.session.query(func.max(EventoCita.id_evento)).scalar() or 0
+    if id_doctor is not None:
+        filtro = or_(EventoCita.id_doctor == id_doctor,
+                     EventoCita.id_doctor_anterior == id_doctor)
+    else:
+        filtro = or_(EventoCita.id_centro == id_centro,
+                     EventoCita.id_centro_anterior == id_centro)
+    eventos = (EventoCita.query
+               .filter(EventoCita.id_evento > ultimo, EventoCita.id_evento <= tope, filtro)
+               .order_by(EventoCita.id_evento).limit(lote).all())
+    # Se sueltan la conexión y los objetos entre consultas
+    datos = [evento.to_dict() for evento in eventos]
+    db.session.close()
+    if len(datos) == lote:
+        return datos, datos[-1]['id_evento']
+    return datos, max(tope, ultimo)
+
+
+def _mensaje(tipo, datos, id_evento):
+    'Mensaje server-sent events'
+    return f'event: {tipo}\nid: {id_evento}\ndata: {current_app.json.dumps(datos)}\n\n'
+
+
+def flujo(desde, id_doctor=None, id_centro=None):
+    'Genera el flujo server-sent events de la agenda del doctor o del centro'
+    config = current_app.config
+    ultimo, reinicio = posicion_inicial(desde)
+    db.session.close()
+    with _condicion:
+        _estado['conexiones'] += 1
+    try:
+        yield f'retry: {REINTENTO_MS}\n\n'
+        if reinicio:
+            yield _mensaje('reinicio', {'ultimo': ultimo}, ultimo)
+        fin = time.monotonic() + config['EVENTOS_DURACION_MAX']
+        ultimo_envio = time.monotonic()
+        while time.monotonic() < fin:
+            generacion = _estado['generacion']
+            eventos, ultimo = consultar(ultimo, id_doctor, id_centro)
+            for evento in eventos:
+                yield _mensaje(evento['operacion'], evento, evento['id_evento'])
+            with _condicion:
+                _estado['enviados'] += len(eventos)
+            ahora = time.monotonic()
+            if eventos:
+                ultimo_envio = ahora
+            elif ahora - ultimo_envio >= config['EVENTOS_LATIDO']:
+                # Comentario con id: EventSource actualiza Last-Event-ID sin emitir un evento
+                yield f': latido\nid: {ultimo}\n\n'
+                ultimo_envio = ahora
+            if len(eventos) < config['EVENTOS_LOTE']:
+                _esperar(generacion, min(config['EVENTOS_INTERVALO'], fin - ahora))
+    finally:
+        with _condicion:
+            _estado['conexiones'] -= 1
+
+
+def esperar_eventos(desde, espera, id_doctor=None, id_centro=None):
+    '''
+    Long-poll: espera hasta 'espera' segundos a que haya eventos del doctor o
+    del centro posteriores a 'desde'. Devuelve (eventos, último, reinicio)
+    '''
+    ultimo, reinicio = posicion_inicial(desde)
+    if reinicio:
+        db.session.close()
+        return [], ultimo, True
+    fin = time.monotonic() + espera
+    while True:
+        generacion = _estado['generacion']
+        eventos, ultimo = consultar(ultimo, id_doctor, id_centro)
+        ahora = time.monotonic()
+        if eventos or ahora >= fin:
+            with _condicion:
+                _estado['enviados'] += len(eventos)
+            return eventos, ultimo, False
+        _esperar(generacion, min(current_app.config['EVENTOS_INTERVALO'], fin - ahora))
+
+
+def estado():
+    'Conexiones abiertas y eventos enviados'
+    with _condicion:
+        return {'conexiones': _estado['conexiones'], 'enviados': _estado['enviados']}
+
+
+metrics.registrar_proveedor('eventos_citas', estado)
@@ -0,0 +1,230 @@
+'''
+Cliente HTTP de servicio_citas para las consultas a servicio_gestion.
+Usa 'requests' con una sesión compartida (pool de conexiones). Las
+referencias de una cita se pueden consultar en paralelo con un pool de
+hilos compartido por el proceso (get_referencias_paralelo).
+Todas las llamadas comparten:
+    - un plazo total por petición en lugar de un timeout por llamada
+    - reintentos acotados con backoff exponencial y jitter (solo GET)
+    - un circuit breaker que rechaza las llamadas mientras gestión falla
+'''
+
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import g, has_request_context
+
+from servicio_citas.config import Config
+from servicio_citas.circuit_breaker import CircuitBreaker
+from servicio_gestion import metrics, trazas
+
+
+# Referencias que se validan al agendar una cita:
+# clave -> (ruta en servicio_gestion, campo de la cita)
+REFERENCIAS = {
+    'paciente': ('/admin/paciente/{}', 'id_paciente'),
+    'doctor': ('/admin/doctor/{}', 'id_doctor'),
+    'centro': ('/admin/centro_medico/{}', 'id_centro'),
+}
+
+# Sesión compartida entre peticiones para reutilizar las conexiones TCP
+session = requests.Session()
+
+# Hilos compartidos para las consultas en paralelo (se crean según se necesitan)
+# y semáforo con los que están libres: una consulta nunca espera turno en el pool
+_pool = ThreadPoolExecutor(max_workers=Config.GESTION_HILOS, thread_name_prefix='gestion')
+_hilos_libres = threading.BoundedSemaphore(Config.GESTION_HILOS)
+
+# Circuit breaker único para servicio_gestion
+breaker = CircuitBreaker('gestion',
+                         umbral_fallos=Config.CB_UMBRAL_FALLOS,
+                         tiempo_apertura=Config.CB_TIEMPO_APERTURA)
+metrics.registrar_proveedor('gestion_circuit_breaker', breaker.estado)
+
+
+# ----- Errores de comunicación con servicio_gestion -----
+
+class ErrorGestion(Exception):
+    'servicio_gestion no ha respondido correctamente'
+    status = 502
+    mensaje = 'Error al comunicarse con servicio_gestion'
+
+
+class CircuitoAbierto(ErrorGestion):
+    'El circuit breaker está abierto: no se llama a servicio_gestion'
+    status = 503
+    mensaje = 'servicio_gestion no está disponible temporalmente'
+
+    def __init__(self, reintentar_en):
+        super().__init__(f'Circuito abierto, reintentar en {reintentar_en:.0f} s')
+        self.reintentar_en = reintentar_en
+
+
+class PlazoAgotado(ErrorGestion):
+    'Se ha agotado el plazo de la petición esperando a servicio_gestion'
+    status = 504
+    mensaje = 'servicio_gestion no ha respondido a tiempo'
+
+
+# ----- Plazo por petición -----
+
+def iniciar_plazo():
+    'Fija el plazo para las llamadas a servicio_gestion de la petición en curso'
+    g.gestion_plazo = time.monotonic() + Config.GESTION_PLAZO
+
+
+def _tiempo_restante():
+    'Segundos que quedan del plazo de la petición en curso'
+    if not has_request_context():
+        return Config.GESTION_PLAZO
+    if 'gestion_plazo' not in g:
+        iniciar_plazo()
+    return g.gestion_plazo - time.monotonic()
+
+
+def _espera_reintento(intento):
+    '''
+    Calcula la espera antes de un reintento: backoff exponencial con jitter.
+    Si la espera no cabe en el plazo de la petición, no se reintenta.
+    '''
+    metrics.incrementar('gestion_reintentos')
+    espera = random.uniform(0, Config.GESTION_BACKOFF * 2 ** intento)
+    if espera >= _tiempo_restante():
+        metrics.incrementar('gestion_plazos_agotados')
+        raise PlazoAgotado('Plazo agotado antes del reintento')
+    return espera
+
+
+def _antes_de_llamada():
+    '''
+    Comprueba el circuito y el plazo antes de cada llamada.
+    Devuelve el timeout disponible para la llamada.
+    '''
+    restante = _tiempo_restante()
+    if restante <= 0:
+        metrics.incrementar('gestion_plazos_agotados')
+        raise PlazoAgotado('Plazo agotado')
+    if not breaker.permitir():
+        metrics.incrementar('gestion_rechazos_circuito')
+        raise CircuitoAbierto(breaker.segundos_para_sondeo())
+    metrics.incrementar('gestion_peticiones')
+    return restante
+
+
+def _registrar_resultado(status_code):
+    'Registra en el circuito la respuesta; devuelve True si se puede reintentar'
+    if status_code >= 500:
+        metrics.incrementar('gestion_fallos')
+        breaker.registrar_fallo()
+        return True
+    breaker.registrar_exito()
+    return False
+
+
+def _registrar_excepcion(error):
+    'Registra en el circuito un error de red o de timeout'
+    metrics.incrementar('gestion_fallos')
+    breaker.registrar_fallo()
+    return ErrorGestion(str(error))
+
+
+# ----- Cliente -----
+
+def crear_headers(token):
+    '''
+    Crea las cabeceras con el Bearer Token para llamar a servicio_gestion,
+    con el identificador de la petición en curso (si la hay)
+    '''
+    headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+            }
+    id_peticion = trazas.id_peticion()
+    if id_peticion:
+        headers[trazas.CABECERA] = id_peticion
+    return headers
+
+
+def _url_referencia(clave, datos):
+    'Construye la URL de consulta de una referencia de la cita'
+    ruta, campo = REFERENCIAS[clave]
+    return f'{Config.GESTION_URL}{ruta.format(datos[campo])}'
+
+
+def _get_url(url, headers, params=None):
+    'Petición GET síncrona con plazo, reintentos y circuit breaker'
+    ultimo_error = None
+    for intento in range(Config.GESTION_REINTENTOS + 1):
+        if intento > 0:
+            time.sleep(_espera_reintento(intento))
+        timeout = _antes_de_llamada()
+        try:
+            with trazas.span('gestion', url):
+                response = session.get(url, headers=headers, params=params, timeout=timeout)
+        except requests.RequestException as e:
+            ultimo_error = _registrar_excepcion(e)
+            continue
+        if not _registrar_resultado(response.status_code):
+            return response
+        ultimo_error = ErrorGestion(f'HTTP {response.status_code} en {url}')
+    raise ultimo_error
+
+
+def get(ruta, headers, params=None):
+    'Petición GET síncrona a servicio_gestion'
+    return _get_url(f'{Config.GESTION_URL}{ruta}', headers, params=params)
+
+
+def get_referencia(clave, datos, headers):
+    'Consulta síncrona de una referencia (paciente, doctor o centro) de la cita'
+    return _get_url(_url_referencia(clave, datos), headers)
+
+
+# ----- Consultas en paralelo -----
+
+def _lanzar_en_pool(clave, datos, headers):
+    'Lanza la consulta en el pool si tiene un hilo libre; si no, devuelve None'
+    if not _hilos_libres.acquire(blocking=False):
+        return None
+    futuro = _pool.submit(contextvars.copy_context().run,
+                          get_referencia, clave, datos, headers)
+    futuro.add_done_callback(lambda _: _hilos_libres.release())
+    return futuro
+
+
+def get_referencias_paralelo(datos, headers, claves=None):
+    '''
+    Consulta en paralelo las referencias de la cita (todas si 'claves' es None)
+    con el mismo cliente síncrono: la primera en el hilo de la petición y el
+    resto en el pool de hilos compartido, así que la latencia total es la de
+    la más lenta en lugar de la suma de todas. Cada tarea se ejecuta en una
+    copia del contexto del hilo (contextvars), así que ve 'g' de la petición:
+    plazo, traza e identificador.
+    Si el pool no tiene hilos libres (servicio con carga), las consultas se
+    hacen una detrás de otra en el hilo de la petición, como en el modo
+    síncrono: esperar turno en el pool consumiría el plazo de la petición.
+    Devuelve un diccionario clave -> respuesta.
+    '''
+    claves = list(REFERENCIAS if claves is None else claves)
+    futuros = {clave: _lanzar_en_pool(clave, datos, headers) for clave in claves[1:]}
+    respuestas, errores = {}, []
+    # Se espera a todas las llamadas aunque alguna falle, para no dejar el
+    # sondeo del circuito semiabierto sin registrar
+    for clave in claves:
+        futuro = futuros.get(clave)
+        try:
+            if futuro is None:
+                respuestas[clave] = get_referencia(clave, datos, headers)
+            else:
+                respuestas[clave] = futuro.result()
+        except Exception as e:
+            errores.append(e)
+    metrics.incrementar('gestion_consultas_paralelas' if any(futuros.values())
+                        else 'gestion_consultas_secuenciales')
+    if errores:
+        raise errores[0]
+    return respuestas
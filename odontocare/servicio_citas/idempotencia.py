@@ -0,0 +1,185 @@
+'''
+Claves de idempotencia para agendar, modificar y cancelar citas.
+Si la petición trae la cabecera Idempotency-Key, su respuesta se guarda
+IDEMPOTENCIA_TTL segundos asociada al usuario, el endpoint y la clave. Un
+reintento con la misma clave y el mismo cuerpo recibe la respuesta guardada
+(cabecera Idempotent-Replayed) sin validar referencias ni escribir nada:
+    - misma clave con otro cuerpo: 422
+    - misma clave mientras la primera petición sigue en curso: 409
+Las respuestas 5xx no se guardan para que el cliente pueda reintentar.
+Cuando la petición escribe en la base de datos, la respuesta se guarda en
+la tabla 'idempotencia' en la misma transacción que la cita: si el commit
+se ha hecho, la clave existe, así que un reintento tras un timeout nunca
+duplica la cita, aunque llegue a otro proceso o al otro servicio.
+Las últimas IDEMPOTENCIA_MAX respuestas se guardan además en memoria.
+'''
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+from sqlalchemy import delete
+from sqlalchemy.exc import SQLAlchemyError
+
+from servicio_gestion import metrics
+from servicio_gestion.extensions import db
+from servicio_citas.models.idempotencia import ClaveIdempotencia
+
+
+CABECERA = 'Idempotency-Key'
+LONGITUD_MAX = 255
+# Segundos entre borrados de las claves caducadas de la tabla
+INTERVALO_PURGA = 60
+
+_cache = OrderedDict()
+_en_curso = set()
+_contadores = {'repetidas': 0, 'nuevas': 0, 'en_curso': 0, 'distinto_cuerpo': 0}
+_lock = threading.Lock()
+_ultima_purga = 0.0
+
+
+def _guardar_local(clave, huella, status, cuerpo, expira):
+    'Guarda la respuesta en memoria, descartando las menos usadas'
+    with _lock:
+        _cache[clave] = (huella, status, cuerpo, expira)
+        _cache.move_to_end(clave)
+        while len(_cache) > current_app.config['IDEMPOTENCIA_MAX']:
+            _cache.popitem(last=False)
+
+
+def _buscar(clave):
+    'Devuelve (huella, status, cuerpo) de la respuesta guardada o None'
+    ahora = datetime.now()
+    with _lock:
+        entrada = _cache.get(clave)
+        if entrada is not None and entrada[3] > ahora:
+            _cache.move_to_end(clave)
+            return entrada[:3]
+    fila = db.session.get(ClaveIdempotencia, clave)
+    if fila is None or fila.expira <= ahora:
+        return None
+    _guardar_local(clave, fila.huella, fila.status, fila.cuerpo, fila.expira)
+    return fila.huella, fila.status, fila.cuerpo
+
+
+def _nueva_fila(clave, huella, status, cuerpo):
+    'Añade a la sesión la respuesta de la clave y, de vez en cuando, borra las caducadas'
+    global _ultima_purga
+    ahora = datetime.now()
+    if time.monotonic() - _ultima_purga > INTERVALO_PURGA:
+        _ultima_purga = time.monotonic()
+        db.session.execute(delete(ClaveIdempotencia).where(ClaveIdempotencia.expira <= ahora))
+    db.session.add(ClaveIdempotencia(
+        clave=clave, huella=huella, status=status, cuerpo=cuerpo,
+        expira=ahora + timedelta(seconds=current_app.config['IDEMPOTENCIA_TTL'])))
+    db.session.flush()
+
+
+def con_registro(operacion):
+    '''
+    Si la petición en curso tiene clave de idempotencia, devuelve la operación
+    de escritura (ver cola_escritura) ampliada para guardar su respuesta en la
+    misma transacción; si no, la devuelve sin cambios
+    '''
+    registro = g.get('idempotencia')
+    if registro is None:
+        return operacion
+    clave, huella = registro
+    g.idempotencia_en_escritura = True
+
+    def operacion_registrada(*args):
+        cuerpo, status = operacion(*args)
+        if status < 500:
+            _nueva_fila(clave, huella, status, current_app.json.dumps(cuerpo))
+        return cuerpo, status
+    return operacion_registrada
+
+
+def _repetir(status, cuerpo):
+    'Respuesta guardada de una petición anterior con la misma clave'
+    with _lock:
+        _contadores['repetidas'] += 1
+    respuesta = current_app.response_class(cuerpo, status=status, mimetype='application/json')
+    respuesta.headers['Idempotent-Replayed'] = 'true'
+    return respuesta
+
+
+def _comparar(guardada, huella):
+    'Respuesta para una clave ya usada: la guardada o 422 si el cuerpo es otro'
+    if guardada[0] != huella:
+        with _lock:
+            _contadores['distinto_cuerpo'] += 1
+        return jsonify({'error': 'La clave de idempotencia ya se ha usado con otra petición'}), 422
+    return _repetir(guardada[1], guardada[2])
+
+
+def idempotente(vista):
+    '''
+    Decorador para las vistas de escritura que admiten Idempotency-Key.
+    Se aplica debajo de 'requiere_rol': la clave es de cada usuario.
+    '''
+    @wraps(vista)
+    def envoltorio(*args, **kwargs):
+        clave_cliente = request.headers.get(CABECERA)
+        if not clave_cliente or not current_app.config['IDEMPOTENCIA']:
+            return vista(*args, **kwargs)
+        if len(clave_cliente) > LONGITUD_MAX:
+            return jsonify({'error': f'{CABECERA} admite como máximo '
+                                     f'{LONGITUD_MAX} caracteres'}), 400
+
+        clave = f'{g.jwt_payload.get("sub")}|{request.method} {request.path}|{clave_cliente}'
+        huella = hashlib.sha256(request.get_data()).hexdigest()
+        guardada = _buscar(clave)
+        if guardada is not None:
+            return _comparar(guardada, huella)
+        with _lock:
+            if clave in _en_curso:
+                _contadores['en_curso'] += 1
+                respuesta = jsonify({'error': 'Hay una petición con la misma clave de '
+                                              'idempotencia en curso'})
+                respuesta.headers['Retry-After'] = '1'
+                return respuesta, 409
+            _en_curso.add(clave)
+            _contadores['nuevas'] += 1
+
+        try:
+            g.idempotencia = (clave, huella)
+            respuesta = current_app.make_response(vista(*args, **kwargs))
+        finally:
+            with _lock:
+                _en_curso.discard(clave)
+
+        cuerpo = respuesta.get_data(as_text=True)
+        if respuesta.status_code >= 500:
+            # Otro proceso puede haber guardado la misma clave a la vez (la
+            # escritura duplicada se ha deshecho): se responde lo que guardó
+            db.session.rollback()
+            guardada = _buscar(clave)
+            return _comparar(guardada, huella) if guardada is not None else respuesta
+        if g.get('idempotencia_en_escritura'):
+            # La respuesta ya está en la tabla, con la cita
+            expira = datetime.now() + timedelta(seconds=current_app.config['IDEMPOTENCIA_TTL'])
+            _guardar_local(clave, huella, respuesta.status_code, cuerpo, expira)
+            return respuesta
+        # Respuestas sin escritura (errores de validación, referencias no válidas...)
+        try:
+            _nueva_fila(clave, huella, respuesta.status_code, cuerpo)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.warning('No se ha podido guardar la clave de idempotencia: %s', e)
+        return respuesta
+    return envoltorio
+
+
+def estado():
+    'Peticiones nuevas, repetidas y rechazadas, y entradas en memoria'
+    with _lock:
+        return dict(_contadores, entradas=len(_cache), en_curso_ahora=len(_en_curso))
+
+
+metrics.registrar_proveedor('idempotencia', estado)
@@ -7,6 +7,18 @@ from servicio_gestion.extensions import db
 class CitaMedica(db.Model):
     'Define el modelo de la tabla CitaMedica para la base de datos'
     __tablename__ = 'cita_medica'
+    __table_args__ = (
+        # Índice de cobertura para las estadísticas: rango por fecha sin leer la tabla
+        db.Index('ix_cita_medica_fecha_doctor_centro_estado',
+                 'fecha', 'id_doctor', 'id_centro', 'estado'),
+        # Agendas por doctor y por centro: un único recorrido por rango de fechas
+        db.Index('ix_cita_medica_doctor_fecha', 'id_doctor', 'fecha'),
+        db.Index('ix_cita_medica_centro_fecha', 'id_centro', 'fecha'),
+        # Doctores que pasan consulta en un centro (búsqueda de huecos libres)
+        db.Index('ix_cita_medica_centro_doctor', 'id_centro', 'id_doctor'),
+        # Los id_cita nunca se reutilizan: las citas archivadas conservan el suyo
+        {'sqlite_autoincrement': True},
+    )
     id_cita = db.Column(db.Integer, primary_key=True, nullable=False,
                         unique=True, autoincrement=True)
     fecha = db.Column(db.DateTime, nullable=False)
@@ -28,6 +40,10 @@ class CitaMedica(db.Model):
     #doctor = db.relationship("Doctor", back_populates="cita_medica")
 
 
+    # Campos públicos (los de to_dict), seleccionables con ?fields= en los listados
+    CAMPOS = ('id_cita', 'fecha', 'motivo', 'estado', 'id_paciente', 'id_doctor',
+              'id_centro', 'id_usuario')
+
     def to_dict(self):
         'Serializa la cita a diccionario/JSON para respuestas JSON'
         return {'id_cita': self.id_cita,
@@ -39,3 +55,46 @@ class CitaMedica(db.Model):
                 'id_centro': self.id_centro,
                 'id_usuario': self.id_usuario
                }
+
+
+class CitaArchivada(db.Model):
+    '''
+    Define el modelo de la tabla de archivo de citas: las citas pasadas que
+    se mueven desde CitaMedica (mismas columnas y mismo id_cita) para que la
+    tabla de citas activas no crezca indefinidamente
+    '''
+    __tablename__ = 'cita_medica_archivo'
+    __table_args__ = (
+        # Los mismos recorridos por rango de fechas que en la tabla de citas activas
+        db.Index('ix_cita_medica_archivo_fecha_doctor_centro_estado',
+                 'fecha', 'id_doctor', 'id_centro', 'estado'),
+        db.Index('ix_cita_medica_archivo_doctor_fecha', 'id_doctor', 'fecha'),
+        db.Index('ix_cita_medica_archivo_centro_fecha', 'id_centro', 'fecha'),
+    )
+    id_cita = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    fecha = db.Column(db.DateTime, nullable=False)
+    motivo = db.Column(db.String(30))
+    estado = db.Column(db.String(20))
+    id_paciente = db.Column(db.Integer, db.ForeignKey('pacientes.id_paciente'),
+                            nullable=False
+                           )
+    id_doctor = db.Column(db.Integer, db.ForeignKey('doctores.id_doctor'),
+                          nullable=False
+                         )
+    id_centro = db.Column(db.Integer, db.ForeignKey('centro_medico.id_centro'),
+                         nullable=False
+                         )
+    id_usuario = db.Column(db.Integer, db.ForeignKey('usuarios.id_usuario'),
+                           nullable=False
+                          )
+    # Momento en que se archivó la cita
+    archivada = db.Column(db.DateTime, nullable=False)
+
+
+def ocupa_agenda(cita=CitaMedica):
+    '''
+    Condición de las citas que ocupan la hora del doctor: las no canceladas.
+    Es la misma regla al agendar, al modificar y al reasignar citas
+    ('cita' puede ser un alias de CitaMedica)
+    '''
+    return cita.estado != 'cancelada'
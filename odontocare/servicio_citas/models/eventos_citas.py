@@ -0,0 +1,125 @@
+'''
+Declaración del modelo de tabla 'cita_eventos' para la base de datos.
+Cada alta, modificación o cancelación de una cita deja un evento en esta
+tabla dentro de la misma transacción (como el outbox de servicio_gestion),
+así que el flujo de cambios de la agenda (/citas/eventos) solo ve los
+cambios confirmados y puede reanudarse desde cualquier número de evento.
+Las operaciones masivas, que actualizan las citas con una sola sentencia
+UPDATE, registran sus eventos con registrar_cambios.
+'''
+
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, inspect, select
+from sqlalchemy.orm import Session
+
+from servicio_gestion.extensions import db
+from servicio_citas.models.citas import CitaMedica
+
+
+# Segundos entre borrados de los eventos caducados (EVENTOS_TTL)
+INTERVALO_PURGA = 60
+_ultima_purga = 0.0
+
+
+class EventoCita(db.Model):
+    'Define el modelo de la tabla EventoCita para la base de datos'
+    __tablename__ = 'cita_eventos'
+    # Los números de evento nunca se reutilizan, aunque se borren los últimos:
+    # los clientes reanudan el flujo desde el último que recibieron
+    __table_args__ = {'sqlite_autoincrement': True}
+    id_evento = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    id_cita = db.Column(db.Integer, nullable=False)
+    # insert, update o cancel
+    operacion = db.Column(db.String(10), nullable=False)
+    id_doctor = db.Column(db.Integer, nullable=False)
+    id_centro = db.Column(db.Integer, nullable=False)
+    # Doctor y centro anteriores si la cita ha cambiado de doctor o de centro:
+    # el cambio también se envía a quien sigue la agenda de origen
+    id_doctor_anterior = db.Column(db.Integer)
+    id_centro_anterior = db.Column(db.Integer)
+    datos = db.Column(db.JSON, nullable=False)
+    # Los eventos caducados se borran por este índice
+    creado = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        'Serializa el evento a diccionario/JSON para respuestas JSON'
+        return {'id_evento': self.id_evento,
+                'operacion': self.operacion,
+                'id_cita': self.id_cita,
+                'cita': self.datos,
+                'creado': self.creado.isoformat()
+               }
+
+
+def datos_cita(cita):
+    'Serializa la cita con la fecha en el formato de entrada de la API'
+    return dict(cita.to_dict(), fecha=cita.fecha.strftime('%d-%m-%Y %H:%M'))
+
+
+def _fila(cita, operacion, id_doctor_anterior=None, id_centro_anterior=None):
+    'Construye la fila de la tabla cita_eventos para una cita'
+    return {'id_cita': cita.id_cita,
+            'operacion': operacion,
+            'id_doctor': cita.id_doctor,
+            'id_centro': cita.id_centro,
+            'id_doctor_anterior': id_doctor_anterior,
+            'id_centro_anterior': id_centro_anterior,
+            'datos': datos_cita(cita),
+            'creado': datetime.now()}
+
+
+def _anterior(cita, atributo):
+    'Valor anterior del atributo si ha cambiado en este flush (None si no)'
+    historial = getattr(inspect(cita).attrs, atributo).history
+    if historial.has_changes() and historial.deleted:
+        return historial.deleted[0]
+    return None
+
+
+def _insertar(session, filas):
+    '''
+    Inserta los eventos en la conexión de la sesión y marca la sesión para
+    avisar al confirmar. De vez en cuando borra también los caducados
+    '''
+    global _ultima_purga
+    conexion = session.connection()
+    if has_app_context() and time.monotonic() - _ultima_purga > INTERVALO_PURGA:
+        _ultima_purga = time.monotonic()
+        caducados = datetime.now() - timedelta(seconds=current_app.config['EVENTOS_TTL'])
+        conexion.execute(delete(EventoCita.__table__).where(EventoCita.creado < caducados))
+    conexion.execute(EventoCita.__table__.insert(), filas)
+    session.info['eventos_citas'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def registrar_eventos(session, flush_context):
+    '''
+    Tras cada flush, escribe en cita_eventos las altas, modificaciones y
+    cancelaciones de citas. Se usa la misma conexión, así que los eventos
+    se confirman o se deshacen junto con los cambios que los provocan.
+    '''
+    filas = [_fila(cita, 'insert') for cita in session.new if type(cita) is CitaMedica]
+    for cita in session.dirty:
+        if type(cita) is not CitaMedica or not session.is_modified(cita):
+            continue
+        cancelada = (cita.estado == 'cancelada'
+                     and inspect(cita).attrs.estado.history.has_changes())
+        filas.append(_fila(cita, 'cancel' if cancelada else 'update',
+                           _anterior(cita, 'id_doctor'), _anterior(cita, 'id_centro')))
+    if filas:
+        _insertar(session, filas)
+
+
+def registrar_cambios(session, ids, operacion, id_doctor_anterior=None):
+    '''
+    Registra los eventos de citas actualizadas con una sentencia UPDATE (sin
+    pasar por el ORM): lee su estado nuevo en la misma transacción
+    '''
+    if not ids:
+        return
+    citas = session.execute(select(CitaMedica).where(CitaMedica.id_cita.in_(ids))
+                            .execution_options(populate_existing=True)).scalars()
+    _insertar(session, [_fila(cita, operacion, id_doctor_anterior) for cita in citas])
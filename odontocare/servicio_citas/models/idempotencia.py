@@ -0,0 +1,21 @@
+'''
+Declaración del modelo de tabla 'idempotencia' para la base de datos.
+Guarda la respuesta de cada petición de escritura de citas que llega con
+la cabecera Idempotency-Key, para que sus reintentos la repitan sin
+volver a ejecutarla.
+'''
+
+from servicio_gestion.extensions import db
+
+
+class ClaveIdempotencia(db.Model):
+    'Define el modelo de la tabla ClaveIdempotencia para la base de datos'
+    __tablename__ = 'idempotencia'
+    # usuario|MÉTODO ruta|Idempotency-Key
+    clave = db.Column(db.String(400), primary_key=True)
+    # SHA-256 del cuerpo de la petición original
+    huella = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.Integer, nullable=False)
+    cuerpo = db.Column(db.Text, nullable=False)
+    # Las claves caducadas se borran por este índice
+    expira = db.Column(db.DateTime, nullable=False, index=True)
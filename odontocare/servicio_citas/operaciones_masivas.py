@@ -0,0 +1,132 @@
+'''
+Operaciones masivas sobre las citas de un doctor en un rango de fechas:
+    - cancelar todas sus citas
+    - reasignarlas a otro doctor, detectando los conflictos de horario
+      con una única consulta (join con las citas del doctor destino)
+Cada operación se ejecuta en una sola transacción con sentencias UPDATE
+sobre el conjunto de citas, y devuelve el resultado de cada cita.
+Las citas cambiadas se registran en el flujo de cambios de la agenda
+(cita_eventos) dentro de la misma transacción.
+'''
+
+from sqlalchemy import and_, update
+from sqlalchemy.orm import aliased
+
+from servicio_gestion.extensions import db
+from servicio_citas import estadisticas
+from servicio_citas.models.citas import CitaMedica, ocupa_agenda
+from servicio_citas.models.eventos_citas import registrar_cambios
+
+
+class ConflictoConcurrente(Exception):
+    'Otra petición ha modificado las citas afectadas durante la operación'
+
+
+def _formato(fecha):
+    'Fecha de la cita en el formato de entrada de la API'
+    return fecha.strftime('%d-%m-%Y %H:%M')
+
+
+def _citas_del_doctor(consulta, id_doctor, desde, hasta):
+    'Filtra una consulta por doctor y rango de fechas (desde inclusivo, hasta exclusivo)'
+    return consulta.filter(CitaMedica.id_doctor == id_doctor,
+                           CitaMedica.fecha >= desde,
+                           CitaMedica.fecha < hasta)
+
+
+def cancelar_citas(id_doctor, desde, hasta, simular=False):
+    '''
+    Cancela todas las citas del doctor entre 'desde' (inclusivo) y 'hasta'
+    (exclusivo). Devuelve la lista de resultados por cita.
+    '''
+    citas = _citas_del_doctor(
+        db.session.query(CitaMedica.id_cita, CitaMedica.fecha,
+                         CitaMedica.id_paciente, CitaMedica.estado),
+        id_doctor, desde, hasta).order_by(CitaMedica.fecha).all()
+
+    resultados = [{'id_cita': cita.id_cita,
+                   'fecha': _formato(cita.fecha),
+                   'id_paciente': cita.id_paciente,
+                   'resultado': 'ya_cancelada' if cita.estado == 'cancelada' else 'cancelada'}
+                  for cita in citas]
+    ids = [r['id_cita'] for r in resultados if r['resultado'] == 'cancelada']
+
+    if ids:
+        # Un único UPDATE para todas las citas; el filtro por estado evita
+        # contar como canceladas las que otra petición canceló a la vez
+        actualizadas = db.session.execute(
+            update(CitaMedica)
+            .where(CitaMedica.id_cita.in_(ids), CitaMedica.estado != 'cancelada')
+            .values(estado='cancelada')
+            .execution_options(synchronize_session=False)).rowcount
+        if actualizadas != len(ids):
+            db.session.rollback()
+            raise ConflictoConcurrente('Las citas han cambiado durante la cancelación')
+    if simular:
+        db.session.rollback()
+    else:
+        registrar_cambios(db.session, ids, 'cancel')
+        canceladas = set(ids)
+        estadisticas.anotar_cambios(db.session, [cita.fecha for cita in citas
+                                                 if cita.id_cita in canceladas])
+        db.session.commit()
+    return resultados
+
+
+def reasignar_citas(id_doctor, id_doctor_destino, desde, hasta, simular=False):
+    '''
+    Pasa al doctor destino las citas no canceladas del doctor entre 'desde'
+    (inclusivo) y 'hasta' (exclusivo). Las citas que coinciden en fecha y
+    hora con una cita no cancelada del destino no se mueven.
+    Devuelve la lista de resultados por cita.
+    '''
+    destino = aliased(CitaMedica)
+    # Las citas del origen con la cita en conflicto del destino, si la hay
+    filas = _citas_del_doctor(
+        db.session.query(CitaMedica.id_cita, CitaMedica.fecha, CitaMedica.id_paciente,
+                         CitaMedica.estado, destino.id_cita.label('id_conflicto'))
+        .outerjoin(destino, and_(destino.id_doctor == id_doctor_destino,
+                                 destino.fecha == CitaMedica.fecha,
+                                 ocupa_agenda(destino))),
+        id_doctor, desde, hasta).order_by(CitaMedica.fecha).all()
+
+    resultados = []
+    ids = []
+    for fila in filas:
+        resultado = {'id_cita': fila.id_cita,
+                     'fecha': _formato(fila.fecha),
+                     'id_paciente': fila.id_paciente}
+        if fila.estado == 'cancelada':
+            resultado['resultado'] = 'cancelada'
+        elif fila.id_conflicto is not None:
+            resultado['resultado'] = 'conflicto'
+            resultado['id_cita_conflicto'] = fila.id_conflicto
+        else:
+            resultado['resultado'] = 'reasignada'
+            ids.append(fila.id_cita)
+        resultados.append(resultado)
+
+    if ids:
+        # Un único UPDATE; la condición NOT EXISTS repite la comprobación de
+        # conflictos dentro de la sentencia por si el destino ha cambiado
+        libre = ~db.session.query(destino.id_cita).filter(
+            destino.id_doctor == id_doctor_destino,
+            destino.fecha == CitaMedica.fecha,
+            ocupa_agenda(destino)).exists()
+        actualizadas = db.session.execute(
+            update(CitaMedica)
+            .where(CitaMedica.id_cita.in_(ids), CitaMedica.id_doctor == id_doctor, libre)
+            .values(id_doctor=id_doctor_destino)
+            .execution_options(synchronize_session=False)).rowcount
+        if actualizadas != len(ids):
+            db.session.rollback()
+            raise ConflictoConcurrente('Las citas han cambiado durante la reasignación')
+    if simular:
+        db.session.rollback()
+    else:
+        registrar_cambios(db.session, ids, 'update', id_doctor_anterior=id_doctor)
+        reasignadas = set(ids)
+        estadisticas.anotar_cambios(db.session, [fila.fecha for fila in filas
+                                                 if fila.id_cita in reasignadas])
+        db.session.commit()
+    return resultados
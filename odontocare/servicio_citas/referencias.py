@@ -0,0 +1,159 @@
+'''
+Validación de las referencias de una cita (paciente, doctor y centro médico).
+Hay tres backends, seleccionables con REFERENCIAS_BACKEND:
+    - http: consulta cada referencia a servicio_gestion por HTTP
+    - sql: una única consulta con joins sobre la base de datos compartida,
+      válida cuando los dos servicios usan la misma base de datos
+    - replica: réplica local alimentada por el outbox de servicio_gestion,
+      con HTTP para las referencias que aún no estén replicadas
+Todos devuelven, por cada referencia, (clave, status_code, datos), donde
+'datos' son los datos de la entidad (o None si no existe). 'buscar_todas'
+consulta todas a la vez (las de HTTP, en paralelo con el pool de hilos de
+gestion_client) para /citas/agendar con CITAS_REFERENCIAS_PARALELO y
+'buscar_referencia' consulta solo una (p. ej. el doctor destino de
+/citas/reasignar).
+'''
+
+from sqlalchemy import literal, select
+
+from servicio_citas.config import Config
+from servicio_citas import gestion_client, replica
+from servicio_gestion.extensions import db
+from servicio_gestion.models.centros_medicos import CentroMedico
+from servicio_gestion.models.doctores import Doctor
+from servicio_gestion.models.pacientes import Paciente
+
+
+# Clave del JSON de servicio_gestion con los datos de cada entidad
+CLAVES_RESPUESTA = {
+    'paciente': 'Paciente',
+    'doctor': 'Doctor',
+    'centro': 'Centro Médico',
+}
+
+# Modelo de cada referencia (backend sql)
+MODELOS_REFERENCIA = {
+    'paciente': Paciente,
+    'doctor': Doctor,
+    'centro': CentroMedico,
+}
+
+
+def _resultado_respuesta(clave, response):
+    'Convierte una respuesta HTTP de servicio_gestion en (clave, status_code, datos)'
+    datos = None
+    if response.status_code == 200:
+        datos = response.json().get(CLAVES_RESPUESTA[clave])
+    return clave, response.status_code, datos
+
+
+class BackendHTTP:
+    'Consulta las referencias a servicio_gestion por HTTP'
+    nombre = 'http'
+
+    def buscar(self, datos_cita, headers):
+        '''
+        Generador con las referencias consultadas una detrás de otra: si quien
+        lo recorre se detiene en la primera no válida, no se hacen más llamadas.
+        '''
+        for clave in gestion_client.REFERENCIAS:
+            yield self.buscar_referencia(clave, datos_cita, headers)
+
+    def buscar_referencia(self, clave, datos_cita, headers):
+        'Consulta una sola referencia (paciente, doctor o centro)'
+        return _resultado_respuesta(clave, gestion_client.get_referencia(clave, datos_cita, headers))
+
+    def buscar_todas(self, datos_cita, headers, claves=None):
+        'Consulta en paralelo las referencias indicadas (todas si claves es None)'
+        respuestas = gestion_client.get_referencias_paralelo(datos_cita, headers, claves)
+        return [_resultado_respuesta(clave, response) for clave, response in respuestas.items()]
+
+
+class BackendReplica(BackendHTTP):
+    'Consulta las referencias en la réplica local y, si faltan, por HTTP'
+    nombre = 'replica'
+
+    def _locales(self, datos_cita):
+        'Referencias encontradas en la réplica (ninguna si aún no está sincronizada)'
+        if not replica.replica.lista():
+            return {}
+        encontradas = {}
+        for clave in gestion_client.REFERENCIAS:
+            datos = replica.replica.buscar_referencia(clave, datos_cita)
+            if datos is not None:
+                encontradas[clave] = datos
+        return encontradas
+
+    def buscar(self, datos_cita, headers):
+        locales = self._locales(datos_cita)
+        for clave in gestion_client.REFERENCIAS:
+            if clave in locales:
+                yield clave, 200, locales[clave]
+            else:
+                yield super().buscar_referencia(clave, datos_cita, headers)
+
+    def buscar_referencia(self, clave, datos_cita, headers):
+        if replica.replica.lista():
+            datos = replica.replica.buscar_referencia(clave, datos_cita)
+            if datos is not None:
+                return clave, 200, datos
+        return super().buscar_referencia(clave, datos_cita, headers)
+
+    def buscar_todas(self, datos_cita, headers, claves=None):
+        locales = self._locales(datos_cita)
+        pendientes = [clave for clave in gestion_client.REFERENCIAS if clave not in locales]
+        resultados = [(clave, 200, datos) for clave, datos in locales.items()]
+        if not pendientes:
+            return resultados
+        return resultados + super().buscar_todas(datos_cita, headers, pendientes)
+
+
+class BackendSQL:
+    'Valida las tres referencias con una sola consulta sobre la base de datos compartida'
+    nombre = 'sql'
+
+    def buscar(self, datos_cita, headers=None):
+        '''
+        Una fila con LEFT JOIN de paciente, doctor y centro médico: las
+        columnas a NULL indican referencias inexistentes.
+        '''
+        fila = (db.session.query(Paciente.id_paciente, Paciente.estado,
+                                 Doctor.id_doctor, CentroMedico.id_centro)
+                .select_from(select(literal(1).label('uno')).subquery())
+                .outerjoin(Paciente, Paciente.id_paciente == datos_cita['id_paciente'])
+                .outerjoin(Doctor, Doctor.id_doctor == datos_cita['id_doctor'])
+                .outerjoin(CentroMedico, CentroMedico.id_centro == datos_cita['id_centro'])
+                .one())
+        paciente = (None if fila.id_paciente is None
+                    else {'id_paciente': fila.id_paciente, 'estado': fila.estado.value})
+        doctor = None if fila.id_doctor is None else {'id_doctor': fila.id_doctor}
+        centro = None if fila.id_centro is None else {'id_centro': fila.id_centro}
+        for clave, datos in (('paciente', paciente), ('doctor', doctor), ('centro', centro)):
+            yield clave, 404 if datos is None else 200, datos
+
+    def buscar_referencia(self, clave, datos_cita, headers=None):
+        'Consulta una sola referencia por su clave primaria'
+        modelo = MODELOS_REFERENCIA[clave]
+        campo = gestion_client.REFERENCIAS[clave][1]
+        fila = db.session.get(modelo, datos_cita[campo])
+        if fila is None:
+            return clave, 404, None
+        datos = {campo: getattr(fila, campo)}
+        if clave == 'paciente':
+            datos['estado'] = fila.estado.value
+        return clave, 200, datos
+
+    def buscar_todas(self, datos_cita, headers=None, claves=None):
+        # La consulta es local y muy corta: no merece la pena otro hilo
+        return list(self.buscar(datos_cita, headers))
+
+
+BACKENDS = {backend.nombre: backend for backend in (BackendHTTP, BackendReplica, BackendSQL)}
+
+
+def crear_backend(nombre=None):
+    'Crea el backend de referencias indicado (por defecto el de la configuración)'
+    nombre = nombre or Config.REFERENCIAS_BACKEND
+    if nombre not in BACKENDS:
+        raise ValueError(f'Backend de referencias desconocido: {nombre}')
+    return BACKENDS[nombre]()
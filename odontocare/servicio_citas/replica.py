@@ -0,0 +1,149 @@
+'''
+Réplica local (en memoria) de pacientes, doctores y centros médicos.
+Un hilo en segundo plano lee de forma incremental los eventos de la tabla
+outbox de servicio_gestion (/admin/outbox) por número de secuencia y los
+aplica, para que la validación de las citas no necesite llamadas HTTP.
+Si la réplica se ha quedado por detrás de los eventos que conserva el
+outbox (OUTBOX_TTL), vuelve a leerlo entero desde el principio.
+El retraso de la réplica se publica en /metrics.
+'''
+
+import threading
+import time
+from datetime import datetime, timezone
+
+from jwt import encode
+
+from servicio_citas.config import Config
+from servicio_citas import gestion_client
+from servicio_gestion import metrics
+
+
+# Referencia de la cita -> entidad replicada
+ENTIDADES_REFERENCIA = {
+    'paciente': 'paciente',
+    'doctor': 'doctor',
+    'centro': 'centro_medico',
+}
+
+
+class Replica:
+    'Copia en memoria de las entidades replicadas, segura entre hilos'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entidades = {entidad: {} for entidad in ENTIDADES_REFERENCIA.values()}
+        self.ultimo_evento = 0
+        self._eventos_aplicados = 0
+        self._reinicios = 0
+        self._retraso = None
+        self._sincronizada_en = None
+
+    def aplicar(self, eventos):
+        'Aplica una lista de eventos del outbox en orden de secuencia'
+        ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+        with self._lock:
+            for evento in eventos:
+                if evento['id_evento'] <= self.ultimo_evento:
+                    continue
+                self._entidades[evento['entidad']][evento['id_entidad']] = evento['datos']
+                self.ultimo_evento = evento['id_evento']
+                self._eventos_aplicados += 1
+            if eventos:
+                # Tiempo entre la confirmación del último cambio y su llegada aquí
+                creado = datetime.fromisoformat(eventos[-1]['creado'])
+                self._retraso = max(0.0, (ahora - creado).total_seconds())
+
+    def reiniciar(self):
+        '''
+        Vuelve a leer el outbox desde el principio. Las entidades actuales se
+        siguen usando mientras tanto: los eventos las sobrescriben
+        '''
+        with self._lock:
+            self.ultimo_evento = 0
+            self._reinicios += 1
+
+    def marcar_sincronizada(self):
+        'Registra que la réplica ha leído todos los eventos disponibles'
+        with self._lock:
+            self._sincronizada_en = time.monotonic()
+
+    def lista(self):
+        'La réplica se puede usar cuando se ha sincronizado al menos una vez'
+        with self._lock:
+            return self._sincronizada_en is not None
+
+    def buscar(self, entidad, id_entidad):
+        'Devuelve los datos de una entidad replicada o None si no existe'
+        with self._lock:
+            return self._entidades[entidad].get(int(id_entidad))
+
+    def buscar_referencia(self, clave, datos_cita):
+        'Busca una referencia de la cita (paciente, doctor o centro) en la réplica'
+        campo = gestion_client.REFERENCIAS[clave][1]
+        return self.buscar(ENTIDADES_REFERENCIA[clave], datos_cita[campo])
+
+    def estado(self):
+        'Estado de la réplica para las métricas'
+        with self._lock:
+            desde_sincronizacion = (None if self._sincronizada_en is None
+                                    else round(time.monotonic() - self._sincronizada_en, 3))
+            return {'ultimo_evento': self.ultimo_evento,
+                    'eventos_aplicados': self._eventos_aplicados,
+                    'reinicios': self._reinicios,
+                    'entidades': {nombre: len(filas)
+                                  for nombre, filas in self._entidades.items()},
+                    'retraso_segundos': self._retraso,
+                    'segundos_desde_sincronizacion': desde_sincronizacion}
+
+
+# Réplica única del proceso
+replica = Replica()
+metrics.registrar_proveedor('replica_gestion', replica.estado)
+
+
+def _headers_servicio():
+    'Cabeceras con un token de servicio (rol admin) para leer el outbox'
+    ahora = datetime.now(timezone.utc)
+    token = encode({'sub': 'servicio_citas', 'rol': 'admin', 'iat': ahora,
+                    'exp': ahora + Config.JWT_EXPIRATION_DELTA},
+                   key=Config.JWT_SECRET_KEY, algorithm='HS256')
+    return gestion_client.crear_headers(token)
+
+
+def sincronizar():
+    'Lee y aplica todos los eventos pendientes del outbox'
+    headers = _headers_servicio()
+    while True:
+        response = gestion_client.get('/admin/outbox', headers,
+                                      params={'desde': replica.ultimo_evento,
+                                              'limite': Config.REPLICA_LOTE})
+        if response.status_code != 200:
+            raise gestion_client.ErrorGestion(f'HTTP {response.status_code} al leer el outbox')
+        datos = response.json()
+        if datos.get('reinicio'):
+            replica.reiniciar()
+            continue
+        replica.aplicar(datos['eventos'])
+        if datos['completo']:
+            replica.marcar_sincronizada()
+            return
+
+
+def _bucle(app):
+    'Sincroniza la réplica periódicamente'
+    while True:
+        try:
+            sincronizar()
+        except Exception as e:
+            # Cualquier error (HTTP, respuesta inesperada...) se reintenta en la siguiente vuelta
+            metrics.incrementar('replica_errores')
+            app.logger.warning('Error al sincronizar la réplica: %s', e)
+        time.sleep(Config.REPLICA_INTERVALO)
+
+
+def iniciar(app):
+    'Arranca el hilo que mantiene la réplica al día'
+    hilo = threading.Thread(target=_bucle, args=(app,), name='replica_gestion', daemon=True)
+    hilo.start()
+    return hilo
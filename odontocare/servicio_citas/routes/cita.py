@@ -3,19 +3,22 @@ Endpoints para /cita de la API 'OdontoCare' que realiza:
     - creación, actualización, consulta y eliminación de citas
     - validación de disponibilidad de doctores y centros médicos
     - reglas operativas para evitar conflictos en la agenda
+    - flujo de cambios de la agenda de un doctor o centro (server-sent events)
     - respuestas en formato JSON
 '''
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from functools import wraps
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, current_app, g, jsonify, request, stream_with_context
 from marshmallow import ValidationError
 from jwt import decode, exceptions
 
-import requests
-
+from servicio_gestion import campos, trazas
 from servicio_gestion.extensions import db
-from servicio_citas.models.citas import CitaMedica
+from servicio_citas import archivo, cola_escritura, disponibilidad, estadisticas, eventos
+from servicio_citas import gestion_client, idempotencia, operaciones_masivas
+from servicio_citas import referencias
+from servicio_citas.models.citas import CitaMedica, ocupa_agenda
 from servicio_citas.config import Config
 from servicio_citas.schemas import cita_schema
 
@@ -27,9 +30,29 @@ citas_bp = Blueprint('citas_bp', __name__, url_prefix='/citas')
 allowed_roles_crear = ['admin', 'secretaria']
 allowed_roles_listar = ['admin', 'secretaria', 'medico']
 allowed_roles_cancelar = ['admin', 'secretaria']
+allowed_roles_estadisticas = ['admin', 'secretaria']
+allowed_roles_agenda = ['admin', 'secretaria', 'medico']
+allowed_roles_huecos = ['admin', 'secretaria', 'medico', 'paciente']
+allowed_roles_archivar = ['admin']
+
+# Columnas de cada cita en el formato compacto de la agenda
+COLUMNAS_AGENDA = ['id_cita', 'hora', 'id_paciente', 'id_centro', 'estado', 'motivo']
+
+# Backend de validación de paciente, doctor y centro al agendar (http, sql o replica)
+backend_referencias = referencias.crear_backend()
+
+# Plazo total de las llamadas a servicio_gestion para cada petición
+citas_bp.before_request(gestion_client.iniciar_plazo)
+
+
+@citas_bp.errorhandler(gestion_client.ErrorGestion)
+def error_gestion(error):
+    'Responde con el código adecuado cuando servicio_gestion falla o no está disponible'
+    respuesta = jsonify({'error': error.mensaje, 'message': str(error)})
+    if isinstance(error, gestion_client.CircuitoAbierto):
+        respuesta.headers['Retry-After'] = str(int(error.reintentar_en) + 1)
+    return respuesta, error.status
 
-# URL base para comunicarse con otros servicios
-BASE_URL = "http://localhost:5001"
 
 # ----- Decorador de autorización por rol -----
 
@@ -47,7 +70,10 @@ def requiere_rol(allowed_roles):
 
             # Decodificar y validar el token
             try:
-                payload = decode(token, key=Config.JWT_SECRET_KEY, algorithms=['HS256'])
+                with trazas.span('auth'):
+                    payload = decode(token, key=Config.JWT_SECRET_KEY, algorithms=['HS256'])
+                # Se guarda el payload para que la vista no tenga que volver a decodificarlo
+                g.jwt_payload = payload
                 rol_del_usuario = payload.get('rol')
                 if rol_del_usuario not in allowed_roles:
                     return jsonify({'mensaje': 'Permiso denegado'}), 403
@@ -64,91 +90,120 @@ def requiere_rol(allowed_roles):
 
 # --------- Ruta para crear cita -------------
 
-# Define la ruta para POST /agendar
-@citas_bp.route('/agendar', methods=['POST'])
-@requiere_rol(allowed_roles_crear)
-def add_cita():
-    'endpoint POST para agendar una cita'
+# Mensajes de error para cada referencia de la cita
+MENSAJES_REFERENCIAS = {
+    'paciente': ('del paciente', 'El paciente no existe en la base de datos'),
+    'doctor': ('del doctor', 'El doctor no existe en la base de datos'),
+    'centro': ('del centro médico', 'El Centro Médico no existe en la base de datos'),
+}
+
+
+def _cargar_datos_cita():
+    '''
+    Extrae y valida los datos de la cita del cuerpo de la petición.
+    Devuelve (validated_data, None) o (None, respuesta de error).
+    '''
 
     # Obtiene los datos JSON del cuerpo de la petición
     data = request.get_json()
 
     # Asegura que la petición contiene datos JSON
     if not request.is_json:
-        return jsonify({'message': 'Missing JSON in request'}), 400
+        return None, (jsonify({'message': 'Missing JSON in request'}), 400)
 
     # Extrae y valida los datos del cuerpo de la petición (request body)
     try:
         # Parsea la fecha
         data['fecha'] = datetime.strptime(data['fecha'], "%d-%m-%Y %H:%M")
         # Validar y cargar los datos
-        validated_data = cita_schema.cita_medica_schema.load(data)
+        with trazas.span('validacion'):
+            validated_data = cita_schema.cita_medica_schema.load(data)
         # Los datos validados están en validated_data (como diccionario de Python)
     except ValidationError as err:
         # Manejar errores de validación
-        return jsonify(err.messages), 400
+        return None, (jsonify(err.messages), 400)
+    return validated_data, None
 
-    # Si la validación es exitosa, se utilizan los datos (validated_data)
-    # para crear una nueva cita.
 
+def _headers_peticion():
+    'Crea las cabeceras para servicio_gestion con el token de la petición en curso'
     # Extrae el token del header Authorization: Bearer <token>
     auth_header = request.headers.get('Authorization', '')
     partes = auth_header.split()
-    token = partes[1]
-    # Si el token es válido
-    if token:
-        # Crea las cabeceras con el Bearer Token
-        headers = {
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-                }
-
-    # Se busca al paciente mediante una petición GET
-    url = f'{BASE_URL}/admin/paciente/{validated_data['id_paciente']}'
-    response = requests.get(url, headers=headers, timeout=5)
-
-    # Se verifica si la petición fue exitosa
-    if response.status_code == 200:
-        # Decodificar la respuesta JSON en un diccionario o lista de Python
-        paciente = response.json()
-    else:
-        # Maneja códigos de error
-        return jsonify({'error': f'Error al obtener datos del paciente: {response.status_code}',
-                        'message': 'El paciente no existe en la base de datos'})
-
-    # Se comprueba si está activo
-    if paciente['Paciente']['estado'] == 'inactivo':
-        return jsonify({'error': 'Usuario no está activo'}), 200
-
-    # Se busca al doctor mediante una petición GET
-    url = f'{BASE_URL}/admin/doctor/{validated_data['id_doctor']}'
-    response = requests.get(url, headers=headers, timeout=3)
+    return gestion_client.crear_headers(partes[1])
+
+
+def _id_doctor_peticionario(payload, headers):
+    '''
+    id_doctor del médico que hace la petición. Viaja en el token (claim
+    'id_doctor'); solo los tokens emitidos sin ese claim (anteriores al claim
+    o de médicos sin doctor) necesitan consultar a servicio_gestion.
+    Devuelve (id_doctor, None) o (None, respuesta de error).
+    '''
+    id_doctor = payload.get('id_doctor')
+    if id_doctor is not None:
+        return id_doctor, None
+    # Se busca al doctor por el username del peticionario mediante una petición GET
+    response = gestion_client.get('/admin/doctor/username', headers,
+                                  params={'username': payload.get('sub')})
     # Verifica si la petición fue exitosa
     if response.status_code == 200:
         # Decodificar la respuesta JSON en un diccionario o lista de Python
         doctor = response.json()
     else:
         # Maneja códigos de error
-        return jsonify({'error': f'Error al obtener datos del doctor: {response.status_code}',
-                        'message': 'El doctor no existe en la base de datos'})
+        return None, (jsonify({'error': f'Error al obtener datos: {response.status_code}'}),
+                      404 if response.status_code == 404 else 502)
+    # Se comprueba que existe
+    if not doctor:
+        return None, (jsonify({'error': 'El Doctor no existe en la Base de Datos'}), 200)
+    # Se obtiene el id_doctor de la respuesta
+    return doctor['id_doctor'], None
+
+
+def _comprobar_referencia(clave, status_code, datos=None):
+    '''
+    Comprueba una referencia de la cita (código de estado y datos de la entidad).
+    Devuelve una respuesta de error o None si la referencia es válida.
+    '''
 
-    # Se busca el centro médico mediante una petición GET
-    url = f'{BASE_URL}/admin/centro_medico/{validated_data['id_centro']}'
-    response = requests.get(url, headers=headers, timeout=3)
     # Verifica si la petición fue exitosa
-    if response.status_code == 200:
-        # Decodificar la respuesta JSON en un diccionario o lista de Python
-        centro_medico = response.json()
-    else:
-        # Maneja códigos de error
-        return jsonify({'error': f'Error al obtener datos del centro médico: {response.status_code}',
-                        'message': 'El Centro Médico no existe en la base de datos'})
-    
+    if status_code != 200:
+        # Maneja códigos de error: 404 si no existe, 502 para el resto
+        entidad, mensaje = MENSAJES_REFERENCIAS[clave]
+        status = 404 if status_code == 404 else 502
+        return jsonify({'error': f'Error al obtener datos {entidad}: {status_code}',
+                        'message': mensaje}), status
+    # Se comprueba si el paciente está activo
+    if clave == 'paciente' and datos['estado'] == 'inactivo':
+        return jsonify({'error': 'Usuario no está activo'}), 200
+    return None
+
+
+def _escribir(clave_error, operacion, *args):
+    'Ejecuta una escritura de citas (en la cola de escritura si está activa) y crea la respuesta'
+    # Con Idempotency-Key, la respuesta se guarda en la misma transacción
+    operacion = idempotencia.con_registro(operacion)
+    try:
+        with trazas.span('escritura'):
+            cuerpo, status = cola_escritura.ejecutar(operacion, *args)
+    except cola_escritura.EscrituraDescartada as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({clave_error: f'Error {e} al guardar la cita en la base de datos'}), 500
+    return jsonify(cuerpo), status
+
+
+def _insertar_cita(validated_data):
+    'Comprueba la disponibilidad del doctor e inserta la nueva cita (sin commit)'
+
     # Busca citas del doctor en esa misma fecha para ver si está libre
-    cita = CitaMedica.query.filter_by(fecha=validated_data['fecha'],
-                                      id_doctor=validated_data['id_doctor']).first()
+    # (las canceladas no ocupan la hora)
+    cita = CitaMedica.query.filter(CitaMedica.fecha == validated_data['fecha'],
+                                   CitaMedica.id_doctor == validated_data['id_doctor'],
+                                   ocupa_agenda()).first()
     if cita:
-        return jsonify({'error': 'El Doctor ya tiene una cita a esa hora en esa fecha'}), 200
+        return {'error': 'El Doctor ya tiene una cita a esa hora en esa fecha'}, 200
 
     new_cita = CitaMedica(
                           fecha = validated_data['fecha'],
@@ -159,14 +214,61 @@ def add_cita():
                           id_doctor = validated_data['id_doctor'],
                           id_centro = validated_data['id_centro']
                         )
+    db.session.add(new_cita)
+    # El flush asigna el id_cita de la respuesta
+    db.session.flush()
+    return {"message": "Cita registrada", 'cita': new_cita.to_dict()}, 201
 
-    try:
-        db.session.add(new_cita)
-        db.session.commit()
-        return jsonify({"message": "Cita registrada",
-                        'cita': new_cita.to_dict()}), 201
-    except Exception as e:
-        return jsonify({'message': f'Error {e} al guardar la cita en la base de datos'}), 500
+
+def _guardar_cita(validated_data):
+    'Comprueba la disponibilidad del doctor y guarda la nueva cita'
+    return _escribir('message', _insertar_cita, validated_data)
+
+
+@requiere_rol(allowed_roles_crear)
+@idempotencia.idempotente
+def add_cita():
+    'endpoint POST para agendar una cita (modo síncrono)'
+
+    validated_data, error = _cargar_datos_cita()
+    if error:
+        return error
+
+    # Se buscan paciente, doctor y centro médico uno detrás de otro,
+    # parando en la primera referencia no válida
+    for clave, status_code, datos in backend_referencias.buscar(validated_data,
+                                                                _headers_peticion()):
+        error = _comprobar_referencia(clave, status_code, datos)
+        if error:
+            return error
+
+    return _guardar_cita(validated_data)
+
+
+@requiere_rol(allowed_roles_crear)
+@idempotencia.idempotente
+def add_cita_paralelo():
+    'endpoint POST para agendar una cita (referencias consultadas en paralelo)'
+
+    validated_data, error = _cargar_datos_cita()
+    if error:
+        return error
+
+    # Se buscan paciente, doctor y centro médico en paralelo (pool de hilos
+    # compartido por el proceso, con la misma sesión HTTP que add_cita)
+    resultados = backend_referencias.buscar_todas(validated_data, _headers_peticion())
+    for clave, status_code, datos in resultados:
+        error = _comprobar_referencia(clave, status_code, datos)
+        if error:
+            return error
+
+    return _guardar_cita(validated_data)
+
+
+# Define la ruta para POST /agendar según el modo de consulta de referencias configurado
+citas_bp.add_url_rule('/agendar', endpoint='add_cita', methods=['POST'],
+                      view_func=add_cita_paralelo if Config.CITAS_REFERENCIAS_PARALELO
+                      else add_cita)
 
 
 # --------- Rutas para consultar citas -------------
@@ -184,23 +286,28 @@ def get_citas():
     id_centro = request.args.get('id_centro')
     estado = request.args.get('estado')
     id_paciente = request.args.get('id_paciente')
-
-    # Decodifica el token para saber quién hace la petición
+    # Campos a devolver (?fields=a,b): por defecto, todos los de to_dict.
+    # Se consultan solo esas columnas y se serializan las filas sin cargar objetos ORM
+    try:
+        campos_pedidos = campos.campos_solicitados(CitaMedica, request.args.get('fields'))
+    except campos.CamposInvalidos as err:
+        return jsonify({'error': str(err)}), 400
+    # Las citas archivadas se listan también mientras el archivo tenga citas;
+    # con 'historico=false' se consulta solo la tabla de citas activas
+    historico = request.args.get('historico', '').lower() != 'false'
+    consulta_citas = campos.consulta(
+        archivo.entidad_citas(historico and archivo.incluye_archivo(None)), campos_pedidos)
+
+    # Recupera el token ya decodificado por 'requiere_rol' para saber quién hace la petición
     # Extrae el token del header Authorization: Bearer <token>
     auth_header = request.headers.get('Authorization', '')
     partes = auth_header.split()
     token = partes[1]
-    payload = decode(token, key=Config.JWT_SECRET_KEY, algorithms=['HS256'])
-    username = payload.get('sub')
+    payload = g.jwt_payload
     user_rol = payload.get('rol')
 
-    # Si el token es válido
-    if token:
-        # Crea las cabeceras con el Bearer Token
-        headers = {
-                "Authorization": f"Bearer {token}",
-                "Content-Type": "application/json"
-                }
+    # Crea las cabeceras con el Bearer Token (y el identificador de la petición)
+    headers = gestion_client.crear_headers(token)
 
     # Aplica los filtros a las citas según el rol del peticionario y
     # el 'query param' presente en la petición
@@ -208,42 +315,29 @@ def get_citas():
         if user_rol == 'admin':
             try:
                 # Filtra las citas por doctor si se proporciona id_doctor en el query
-                citas_filtradas = CitaMedica.query.filter_by(id_doctor=id_doctor,
-                                                             estado='activa').all()
+                citas_filtradas = consulta_citas.filter_by(id_doctor=id_doctor,
+                                                           estado='activa').all()
                 if not citas_filtradas:
                     return jsonify({'error': 'El doctor no tiene citas agendadas'}), 201
-                citas_salida = [cita.to_dict() for cita in citas_filtradas]
+                citas_salida = campos.serializar(CitaMedica, campos_pedidos, citas_filtradas)
             except ValueError:
                 return jsonify({'error': 'Parámetro id_doctor inválido'}), 400
         elif user_rol == 'medico':
-            # Se recupera el username del peticionario
-            url = f'{BASE_URL}/admin/doctor/username?username={username}'
-            # Se busca al doctor mediante una petición GET
-            response = requests.get(url, headers=headers, timeout=3)
-            # Verifica si la petición fue exitosa
-            if response.status_code == 200:
-                # Decodificar la respuesta JSON en un diccionario o lista de Python
-                doctor = response.json()
-            else:
-                # Maneja códigos de error
-                return jsonify({'error': f'Error al obtener datos: {response.status_code}'})
-            # Se comprueba que existe
-            if not doctor:
-                return jsonify({'error': 'El Doctor no existe en la Base de Datos'}), 200
-            # Se obtiene el id_doctor_peticionario de la respuesta
-            id_doctor_peticionario = doctor['id_doctor']
+            id_doctor_peticionario, error = _id_doctor_peticionario(payload, headers)
+            if error:
+                return error
             # Si el solicitante coincide con el id_doctor para el que se piden las citas
             if id_doctor == str(id_doctor_peticionario):
                 try:
                     # Se filtran las citas por doctor proporcionando id_doctor en el query
-                    citas_filtradas = CitaMedica.query.filter_by(id_doctor=id_doctor,
-                                                                estado='activa').all()
+                    citas_filtradas = consulta_citas.filter_by(id_doctor=id_doctor,
+                                                               estado='activa').all()
                     if not citas_filtradas:
                         return jsonify({'error': 'El doctor no tiene citas agendadas'}), 201
                 except ValueError:
                     return jsonify({'error': 'Parámetro id_doctor inválido'}), 400
                 # Se obtienen las citas buscadas
-                citas_salida = [cita.to_dict() for cita in citas_filtradas]
+                citas_salida = campos.serializar(CitaMedica, campos_pedidos, citas_filtradas)
             else:
                 return jsonify({'error': 'No está autorizado a ver las citas de otro doctor.'}), 400
         else:
@@ -255,11 +349,15 @@ def get_citas():
             try:
                 # Convierte la cadena de fecha a un objeto datetime.datetime
                 fecha_obj = datetime.strptime(fecha, '%d-%m-%Y %H:%M:%S')
+                # Solo las fechas ya archivadas se buscan también en el archivo
+                consulta_fecha = consulta_citas
+                if historico and not archivo.incluye_archivo(fecha_obj):
+                    consulta_fecha = campos.consulta(CitaMedica, campos_pedidos)
                 # Filtra las citas por doctor si se proporciona id_doctor en el query
-                citas_filtradas = CitaMedica.query.filter_by(fecha=fecha_obj).all()
+                citas_filtradas = consulta_fecha.filter_by(fecha=fecha_obj).all()
                 if not citas_filtradas:
                     return jsonify({'error': 'No hay citas agendadas en esa fecha'}), 201
-                citas_salida = [cita.to_dict() for cita in citas_filtradas]
+                citas_salida = campos.serializar(CitaMedica, campos_pedidos, citas_filtradas)
             except ValueError:
                 return jsonify({'error': 'Formato de fecha inválido. Use: DD-MM-YYYY HH:MM:SS'}), 400
         else:
@@ -269,10 +367,10 @@ def get_citas():
         if user_rol == 'admin':
             # Filtra las citas por paciente si se proporciona id_paciente en el query
             try:
-                citas_filtradas = CitaMedica.query.filter_by(id_paciente=id_paciente).all()
+                citas_filtradas = consulta_citas.filter_by(id_paciente=id_paciente).all()
                 if not citas_filtradas:
                     return jsonify({'error': 'No hay citas agendadas para ese paciente'}), 201
-                citas_salida = [cita.to_dict() for cita in citas_filtradas]
+                citas_salida = campos.serializar(CitaMedica, campos_pedidos, citas_filtradas)
             except ValueError:
                 return jsonify({'error': 'Parámetro id_paciente inválido'}), 400
         else:
@@ -282,8 +380,8 @@ def get_citas():
         if user_rol == 'admin':
             # Filtra las citas por centro mèdico si se proporciona id_centro en el query
             try:
-                citas_filtradas = CitaMedica.query.filter_by(id_centro=id_centro).all()
-                citas_salida = [cita.to_dict() for cita in citas_filtradas]
+                citas_filtradas = consulta_citas.filter_by(id_centro=id_centro).all()
+                citas_salida = campos.serializar(CitaMedica, campos_pedidos, citas_filtradas)
             except ValueError:
                 return jsonify({'error': 'Parámetro id_centro inválido'}), 400
         else:
@@ -293,8 +391,8 @@ def get_citas():
         if user_rol == 'admin':
         # Filtra las citas por estado si se proporciona en el query
             try:
-                citas_filtradas = CitaMedica.query.filter_by(estado=estado).all()
-                citas_salida = [cita.to_dict() for cita in citas_filtradas]
+                citas_filtradas = consulta_citas.filter_by(estado=estado).all()
+                citas_salida = campos.serializar(CitaMedica, campos_pedidos, citas_filtradas)
             except ValueError:
                 return jsonify({'error': 'Parámetro estado inválido'}), 400
         else:
@@ -308,116 +406,470 @@ def get_citas():
 
 
 
+# Define la ruta para GET /estadisticas con query params
+@citas_bp.route('/estadisticas', methods=['GET'])
+@requiere_rol(allowed_roles_estadisticas)
+def get_estadisticas():
+    """
+    endpoint GET para obtener el número de citas y la tasa de cancelación
+    agrupados por doctor, centro, estado y/o periodo.
+    Query params:
+        - agrupar: lista separada por comas de 'doctor', 'centro', 'estado'
+        - periodo: 'dia', 'semana' o 'mes'
+        - desde, hasta: fechas DD-MM-YYYY (ambas incluidas)
+        - id_doctor, id_centro: filtros opcionales
+    """
+
+    # Obtiene y valida los valores de los parámetros de consulta
+    agrupar = [a for a in request.args.get('agrupar', '').split(',') if a]
+    periodo = request.args.get('periodo')
+    id_doctor = request.args.get('id_doctor', type=int)
+    id_centro = request.args.get('id_centro', type=int)
+
+    no_validas = [a for a in agrupar if a not in estadisticas.AGRUPACIONES]
+    if no_validas:
+        return jsonify({'error': f'Agrupación no válida: {", ".join(no_validas)}. '
+                                 f'Use: {", ".join(estadisticas.AGRUPACIONES)}'}), 400
+    if periodo and periodo not in estadisticas.PERIODOS:
+        return jsonify({'error': f'Periodo no válido. Use: {", ".join(estadisticas.PERIODOS)}'}), 400
+
+    try:
+        # Convierte las fechas; 'hasta' incluye el día completo
+        desde = request.args.get('desde')
+        desde = datetime.strptime(desde, '%d-%m-%Y') if desde else None
+        hasta = request.args.get('hasta')
+        hasta = datetime.strptime(hasta, '%d-%m-%Y') + timedelta(days=1) if hasta else None
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido. Use: DD-MM-YYYY'}), 400
+
+    filas, desde_cache = estadisticas.calcular_estadisticas(agrupar, periodo, desde, hasta,
+                                                            id_doctor, id_centro)
+    return jsonify({'estadisticas': filas,
+                    'agrupar': agrupar,
+                    'periodo': periodo,
+                    'cache': desde_cache}), 200
+
+
+# Define la ruta para GET /agenda con query params
+@citas_bp.route('/agenda', methods=['GET'])
+@requiere_rol(allowed_roles_agenda)
+def get_agenda():
+    """
+    endpoint GET para obtener la agenda de un doctor o de un centro médico
+    para un día o una semana, agrupada por día y por doctor.
+    Query params:
+        - id_doctor o id_centro (uno de los dos)
+        - fecha: DD-MM-YYYY (por defecto hoy)
+        - vista: 'dia' (por defecto) o 'semana' (de lunes a domingo)
+        - formato: 'compacto' para devolver cada cita como un array
+        - canceladas: 'true' para incluir las citas canceladas
+    """
+
+    # Obtiene los valores de los parámetros de consulta
+    id_doctor = request.args.get('id_doctor', type=int)
+    id_centro = request.args.get('id_centro', type=int)
+    vista = request.args.get('vista', 'dia')
+    compacto = request.args.get('formato') == 'compacto'
+    canceladas = request.args.get('canceladas', 'false').lower() == 'true'
+
+    if (id_doctor is None) == (id_centro is None):
+        return jsonify({'error': 'Indique id_doctor o id_centro (solo uno de los dos).'}), 400
+    if vista not in ('dia', 'semana'):
+        return jsonify({'error': 'Vista no válida. Use: dia, semana'}), 400
+
+    # Un médico solo puede consultar su propia agenda
+    payload = g.jwt_payload
+    if payload.get('rol') == 'medico':
+        id_doctor_peticionario, error = _id_doctor_peticionario(payload, _headers_peticion())
+        if error:
+            return error
+        if id_doctor != id_doctor_peticionario:
+            return jsonify({'error': 'No está autorizado a ver la agenda de otro doctor.'}), 400
+
+    try:
+        fecha = request.args.get('fecha')
+        inicio = datetime.strptime(fecha, '%d-%m-%Y') if fecha else datetime.now()
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido. Use: DD-MM-YYYY'}), 400
+    inicio = inicio.replace(hour=0, minute=0, second=0, microsecond=0)
+    if vista == 'semana':
+        inicio -= timedelta(days=inicio.weekday())
+    fin = inicio + timedelta(days=7 if vista == 'semana' else 1)
+
+    # Las semanas o días ya archivados se leen también del archivo de citas
+    fuente = archivo.entidad_citas(archivo.incluye_archivo(inicio))
+    # Una sola consulta por rango sobre el índice (id_doctor, fecha) o (id_centro, fecha),
+    # leyendo solo las columnas necesarias y ya ordenada por fecha
+    consulta = db.session.query(fuente.id_cita, fuente.fecha, fuente.id_doctor,
+                                fuente.id_paciente, fuente.id_centro,
+                                fuente.estado, fuente.motivo)
+    if id_doctor is not None:
+        consulta = consulta.filter(fuente.id_doctor == id_doctor)
+    else:
+        consulta = consulta.filter(fuente.id_centro == id_centro)
+    consulta = consulta.filter(fuente.fecha >= inicio, fuente.fecha < fin)
+    if not canceladas:
+        consulta = consulta.filter(fuente.estado != 'cancelada')
+
+    # Agrupa por día y, dentro de cada día, por doctor
+    dias = {}
+    for cita in consulta.order_by(fuente.fecha):
+        hora = cita.fecha.strftime('%H:%M')
+        if compacto:
+            fila = [cita.id_cita, hora, cita.id_paciente, cita.id_centro,
+                    cita.estado, cita.motivo]
+        else:
+            fila = dict(zip(COLUMNAS_AGENDA, [cita.id_cita, hora, cita.id_paciente,
+                                              cita.id_centro, cita.estado, cita.motivo]))
+        doctores = dias.setdefault(cita.fecha.strftime('%Y-%m-%d'), {})
+        doctores.setdefault(str(cita.id_doctor), []).append(fila)
+
+    agenda = {'desde': inicio.strftime('%Y-%m-%d'),
+              'hasta': (fin - timedelta(days=1)).strftime('%Y-%m-%d'),
+              'vista': vista}
+    if compacto:
+        agenda['columnas'] = COLUMNAS_AGENDA
+        agenda['dias'] = dias
+    else:
+        agenda['dias'] = [{'fecha': dia,
+                           'doctores': [{'id_doctor': int(doctor), 'citas': citas}
+                                        for doctor, citas in doctores.items()]}
+                          for dia, doctores in dias.items()]
+
+    # ETag para que los calendarios que consultan a menudo reciban 304 si no hay cambios
+    response = jsonify({'agenda': agenda})
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+# Define la ruta para GET /eventos con query params
+@citas_bp.route('/eventos', methods=['GET'])
+@requiere_rol(allowed_roles_agenda)
+def get_eventos():
+    """
+    endpoint GET con los cambios (insert, update, cancel) de las citas de un
+    doctor o de un centro médico a medida que se confirman.
+    Con 'Accept: text/event-stream' (EventSource) responde con un flujo
+    server-sent events que se reanuda con la cabecera Last-Event-ID; si no,
+    espera a que haya cambios (long-poll) y los devuelve en JSON.
+    Query params:
+        - id_doctor o id_centro (uno de los dos)
+        - desde: último id_evento recibido (por defecto, solo cambios nuevos)
+        - espera: segundos máximos de espera del long-poll (0 para no esperar)
+    """
+
+    # Obtiene los valores de los parámetros de consulta
+    id_doctor = request.args.get('id_doctor', type=int)
+    id_centro = request.args.get('id_centro', type=int)
+
+    if (id_doctor is None) == (id_centro is None):
+        return jsonify({'error': 'Indique id_doctor o id_centro (solo uno de los dos).'}), 400
+
+    # Un médico solo puede seguir su propia agenda
+    payload = g.jwt_payload
+    if payload.get('rol') == 'medico':
+        id_doctor_peticionario, error = _id_doctor_peticionario(payload, _headers_peticion())
+        if error:
+            return error
+        if id_doctor != id_doctor_peticionario:
+            return jsonify({'error': 'No está autorizado a ver la agenda de otro doctor.'}), 400
+
+    # EventSource envía Last-Event-ID al reconectar; tiene prioridad sobre 'desde'
+    desde = request.headers.get('Last-Event-ID') or request.args.get('desde')
+    try:
+        desde = int(desde) if desde else None
+    except ValueError:
+        return jsonify({'error': 'El último evento debe ser un número entero.'}), 400
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        response = Response(stream_with_context(eventos.flujo(desde, id_doctor, id_centro)),
+                            mimetype='text/event-stream')
+        # Sin caché ni buffer en proxies (nginx) para que cada evento llegue al momento
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    espera = request.args.get('espera', current_app.config['EVENTOS_ESPERA_MAX'], type=float)
+    espera = min(max(espera, 0), current_app.config['EVENTOS_ESPERA_MAX'])
+    lista, ultimo, reinicio = eventos.esperar_eventos(desde, espera, id_doctor, id_centro)
+    return jsonify({'eventos': lista, 'ultimo': ultimo, 'reinicio': reinicio}), 200
+
+
+# Define la ruta para GET /huecos con query params
+@citas_bp.route('/huecos', methods=['GET'])
+@requiere_rol(allowed_roles_huecos)
+def get_huecos():
+    """
+    endpoint GET para buscar los próximos huecos libres entre todos los doctores
+    de una especialidad, ordenados por fecha.
+    Query params:
+        - especialidad (obligatorio)
+        - id_centro: solo doctores que pasan consulta en ese centro
+        - desde: DD-MM-YYYY o DD-MM-YYYY HH:MM (por defecto ahora)
+        - duracion: minutos del hueco (por defecto CITA_DURACION)
+        - n: número de huecos (por defecto 5, máximo 50)
+    """
+
+    # Obtiene y valida los valores de los parámetros de consulta
+    especialidad = request.args.get('especialidad')
+    id_centro = request.args.get('id_centro', type=int)
+    duracion = request.args.get('duracion', Config.CITA_DURACION, type=int)
+    n = request.args.get('n', 5, type=int)
+
+    if not especialidad:
+        return jsonify({'error': 'Indique la especialidad.'}), 400
+    if not 5 <= duracion <= 480 or not 1 <= n <= 50:
+        return jsonify({'error': 'duracion debe estar entre 5 y 480 minutos y n entre 1 y 50'}), 400
+
+    ahora = datetime.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+    desde = request.args.get('desde')
+    try:
+        if desde:
+            formato = '%d-%m-%Y %H:%M' if ' ' in desde else '%d-%m-%Y'
+            desde = datetime.strptime(desde, formato)
+    except ValueError:
+        return jsonify({'error': 'Formato de fecha inválido. Use: DD-MM-YYYY o DD-MM-YYYY HH:MM'}), 400
+    # No se ofrecen huecos en el pasado
+    desde = max(desde, ahora) if desde else ahora
+
+    ids_doctores = disponibilidad.buscar_doctores(especialidad, id_centro)
+    huecos = disponibilidad.buscar_huecos(ids_doctores, desde, timedelta(minutes=duracion), n)
+
+    return jsonify({'huecos': [{'fecha': fecha.strftime('%d-%m-%Y %H:%M'),
+                                'id_doctor': id_doctor,
+                                'id_centro': id_centro}
+                               for fecha, id_doctor in huecos],
+                    'especialidad': especialidad,
+                    'duracion': duracion,
+                    'doctores': len(ids_doctores)}), 200
+
+
 # --------- Ruta para modificar datos en una cita -------------
 
+def _modificar_cita(id_cita, cambios):
+    '''
+    Comprueba que el doctor está libre en la fecha resultante y aplica los
+    cambios a la cita (sin commit)
+    '''
+
+    # Obtiene la cita por su ID
+    cita = db.session.get(CitaMedica, id_cita)
+    if cita is None:
+        return {'error': 'La cita que quieres modificar, no existe.'}, 404
+
+    # Si cambia la fecha o el doctor, busca citas del doctor en esa fecha para
+    # ver si está libre (antes de modificar nada: la transacción puede ser compartida)
+    if 'fecha' in cambios or 'id_doctor' in cambios:
+        cita_verif = CitaMedica.query.filter(
+            CitaMedica.id_doctor == cambios.get('id_doctor', cita.id_doctor),
+            CitaMedica.fecha == cambios.get('fecha', cita.fecha),
+            CitaMedica.id_cita != cita.id_cita,
+            ocupa_agenda()).first()
+        if cita_verif:
+            return {'error': 'El Doctor ya tiene una cita a esa hora en esa fecha'}, 200
+
+    # Actualiza los atributos del registro con los datos recibidos
+    for campo, valor in cambios.items():
+        setattr(cita, campo, valor)
+    db.session.flush()
+    return {'message': 'Cita actualizada', 'cita': cita.to_dict()}, 201
+
+
 @citas_bp.route('/modificar/<int:id_cita>', methods=['PUT'])
 @requiere_rol(allowed_roles_crear)
+@idempotencia.idempotente
 def update_cita(id_cita):
     """
     endpoint PUT para actualizar la información de una cita existente
     """
 
-    # Obtiene la cita por su ID
-    cita = CitaMedica.query.get_or_404(id_cita)
+    # Comprueba que la cita existe
+    CitaMedica.query.get_or_404(id_cita)
 
     # Extrae los datos a actualizar del body de la solicitud
     data = request.get_json()
+    cambios = {}
 
-    # Actualiza los atributos del registro con los datos recibidos
     if 'fecha' in data:
         # Convierte la cadena de fecha a un objeto datetime.datetime
-        fecha_obj = datetime.strptime(data['fecha'], '%d-%m-%Y %H:%M:%S')
-        # Busca citas del doctor en esa misma fecha para ver si está libre
-        if 'id_doctor' in data:
-            cita_verif = CitaMedica.query.filter_by(id_doctor=data['id_doctor'],
-                                                    fecha=fecha_obj).first()
-            if cita_verif:
-                return jsonify({'error': 'El Doctor ya tiene una cita a esa hora en esa fecha'}), 200
-        else:
-            cita_verif = CitaMedica.query.filter_by(id_doctor=cita.id_doctor,
-                                                    fecha=fecha_obj).first()
-            if cita_verif:
-                return jsonify({'error': 'El Doctor ya tiene una cita a esa hora en esa fecha'}), 200
-        # Se modifica la fecha de la cita
-        cita.fecha = fecha_obj
+        cambios['fecha'] = datetime.strptime(data['fecha'], '%d-%m-%Y %H:%M:%S')
     # Si se quiere cambiar el paciente de la cita
     if 'id_paciente' in data:
         # Extrae el token del header Authorization: Bearer <token>
         auth_header = request.headers.get('Authorization', '')
         partes = auth_header.split()
         token = partes[1]
-        # Si el token es válido
-        if token:
-            # Crea las cabeceras con el Bearer Token
-            headers = {
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json"
-                    }
+        # Crea las cabeceras con el Bearer Token (y el identificador de la petición)
+        headers = gestion_client.crear_headers(token)
         # Se busca al paciente mediante una petición GET
-        url = f'{BASE_URL}/admin/paciente/{data['id_paciente']}'
-        response = requests.get(url, headers=headers, timeout=3)
+        response = gestion_client.get(f'/admin/paciente/{data['id_paciente']}', headers)
         # Se verifica si la petición fue exitosa
         if response.status_code == 200:
             # Decodificar la respuesta JSON en un diccionario o lista de Python
             paciente = response.json()
         else:
             # Maneja códigos de error
-            return jsonify({'error': f'Error al obtener datos: {response.status_code}'})
+            return jsonify({'error': f'Error al obtener datos: {response.status_code}'}), \
+                   404 if response.status_code == 404 else 502
         # Se comprueba que existe el paciente
         if not paciente:
             return jsonify({'error': 'El paciente no existe en la Base de Datos'}), 200
-        #return jsonify({'paciente': paciente})
         # Se comprueba si está activo
         if paciente['Paciente']['estado'] == 'inactivo':
             return jsonify({'error': 'Paciente no está activo',
                             'message': 'Utilice otra id_paciente para actualizar la cita.'}), 200
         # En caso contrario, se modifica el paciente de la cita
-        cita.id_paciente = data['id_paciente']
+        cambios['id_paciente'] = data['id_paciente']
     # Si se quiere cambiar al doctor de la cita
     if 'id_doctor' in data:
-        cita_verif = CitaMedica.query.filter_by(id_doctor=data['id_doctor'],
-                                                fecha=cita.fecha).first()
-        if cita_verif:
-            return jsonify({'error': 'El Doctor ya tiene una cita a esa hora en esa fecha'}), 200
-        else:
-            # Se modifica el doctor de la cita
-            cita.id_doctor = data['id_doctor']
-
+        cambios['id_doctor'] = data['id_doctor']
     # Si se quiere cambiar el centro médico de la cita
     if 'id_centro' in data:
-        # Se modifica el centro médico de la cita
-        cita.id_centro = data['id_centro']
-    print(cita.to_dict())
-    try:
-        db.session.commit()
-        return jsonify({'message': 'Cita actualizada',
-                        'cita': cita.to_dict()}), 201
-    except Exception as e:
-        return jsonify({'message': f'Error {e} al guardar la cita en la base de datos'}), 500
+        cambios['id_centro'] = data['id_centro']
+
+    return _escribir('message', _modificar_cita, id_cita, cambios)
 
 
 # --------- Ruta para cancelar una cita -------------
 
+def _cancelar_cita(id_cita):
+    'Cambia el estado de la cita a cancelada (sin commit)'
+
+    # Obtiene la cita por su ID
+    cita = db.session.get(CitaMedica, id_cita)
+    if cita is None:
+        return {'error': 'La cita que quieres cancelar, no existe.'}, 404
+    # Comprobar si está activa
+    if cita.estado == 'cancelada':
+        return {'error': 'La cita ya estaba cancelada.'}, 200
+    # Se modifica el estado de la cita
+    cita.estado = 'cancelada'
+    db.session.flush()
+    return {'message': 'Cita cancelada', 'cita': cita.to_dict()}, 201
+
+
 # Define la ruta para PUT /cancelar
 @citas_bp.route('/cancelar/<int:id_cita>', methods=['PUT'])
 @requiere_rol(allowed_roles_cancelar)
+@idempotencia.idempotente
 def cancelar_cita(id_cita):
     'endpoint PUT para cancelar una cita'
+    return _escribir('error', _cancelar_cita, id_cita)
+
+
+# --------- Rutas para operaciones masivas -------------
+
+def _datos_operacion_masiva(data, campos):
+    '''
+    Extrae del cuerpo de la petición los doctores y el rango de fechas
+    (DD-MM-YYYY, ambas incluidas) de una operación masiva.
+    Devuelve (datos, None) o (None, respuesta de error).
+    '''
+    if not data:
+        return None, (jsonify({'message': 'Missing JSON in request'}), 400)
+    faltan = [campo for campo in campos + ['desde', 'hasta'] if campo not in data]
+    if faltan:
+        return None, (jsonify({'error': f'Faltan campos: {", ".join(faltan)}'}), 400)
+    try:
+        datos = {campo: int(data[campo]) for campo in campos}
+        datos['desde'] = datetime.strptime(data['desde'], '%d-%m-%Y')
+        # 'hasta' incluye el día completo
+        datos['hasta'] = datetime.strptime(data['hasta'], '%d-%m-%Y') + timedelta(days=1)
+    except (TypeError, ValueError):
+        return None, (jsonify({'error': 'Datos inválidos. Use ids enteros y fechas DD-MM-YYYY'}),
+                      400)
+    if datos['hasta'] <= datos['desde']:
+        return None, (jsonify({'error': '"hasta" no puede ser anterior a "desde"'}), 400)
+    datos['simular'] = bool(data.get('simular', False))
+    return datos, None
+
+
+def _respuesta_masiva(mensaje, resultados, simular):
+    'Respuesta común de las operaciones masivas: resumen y resultado por cita'
+    resumen = {}
+    for resultado in resultados:
+        resumen[resultado['resultado']] = resumen.get(resultado['resultado'], 0) + 1
+    return jsonify({'message': mensaje,
+                    'simulacion': simular,
+                    'resumen': resumen,
+                    'citas': resultados}), 200 if simular else 201
+
+
+# Define la ruta para PUT /cancelar_masivo
+@citas_bp.route('/cancelar_masivo', methods=['PUT'])
+@requiere_rol(allowed_roles_cancelar)
+def cancelar_citas_masivo():
+    """
+    endpoint PUT para cancelar todas las citas de un doctor en un rango de fechas.
+    Body: id_doctor, desde, hasta (DD-MM-YYYY) y simular (opcional, no guarda cambios)
+    """
 
-    # Obtiene la cita por su ID
-    cita = CitaMedica.query.get(id_cita)
+    datos, error = _datos_operacion_masiva(request.get_json(silent=True), ['id_doctor'])
+    if error:
+        return error
+    try:
+        resultados = operaciones_masivas.cancelar_citas(datos['id_doctor'], datos['desde'],
+                                                        datos['hasta'], datos['simular'])
+    except operaciones_masivas.ConflictoConcurrente as e:
+        return jsonify({'error': str(e), 'message': 'Vuelva a intentarlo'}), 409
+    return _respuesta_masiva('Citas canceladas', resultados, datos['simular'])
 
-     # Si la cita existe
-    if cita:
-        # Comprobar si está activa
-        if cita.estado == 'cancelada':
-            return jsonify({'error': 'La cita ya estaba cancelada.'}), 200
-        # Se modifica el estado de la cita y se actualiza
-        cita.estado = 'cancelada'
-        try:
-            db.session.commit()
-            return jsonify({'message': 'Cita cancelada',
-                            'cita': cita.to_dict()}), 201
-        except Exception as e:
-            return jsonify({'error': f'Error {e} al guardar la cita en la base de datos'}), 500
-    return jsonify({'error': 'La cita que quieres cancelar, no existe.'}), 404
+
+# Define la ruta para PUT /reasignar
+@citas_bp.route('/reasignar', methods=['PUT'])
+@requiere_rol(allowed_roles_cancelar)
+def reasignar_citas():
+    """
+    endpoint PUT para pasar las citas de un doctor en un rango de fechas a otro doctor.
+    Las citas que coinciden con otra cita del doctor destino no se mueven.
+    Body: id_doctor, id_doctor_destino, desde, hasta (DD-MM-YYYY)
+          y simular (opcional, no guarda cambios)
+    """
+
+    datos, error = _datos_operacion_masiva(request.get_json(silent=True),
+                                           ['id_doctor', 'id_doctor_destino'])
+    if error:
+        return error
+    if datos['id_doctor'] == datos['id_doctor_destino']:
+        return jsonify({'error': 'El doctor destino debe ser distinto del doctor origen'}), 400
+
+    # Comprueba que el doctor destino existe (con el backend de referencias configurado)
+    error = _comprobar_referencia(*backend_referencias.buscar_referencia(
+        'doctor', {'id_doctor': datos['id_doctor_destino']}, _headers_peticion()))
+    if error:
+        return error
+
+    try:
+        resultados = operaciones_masivas.reasignar_citas(datos['id_doctor'],
+                                                         datos['id_doctor_destino'],
+                                                         datos['desde'], datos['hasta'],
+                                                         datos['simular'])
+    except operaciones_masivas.ConflictoConcurrente as e:
+        return jsonify({'error': str(e), 'message': 'Vuelva a intentarlo'}), 409
+    return _respuesta_masiva('Citas reasignadas', resultados, datos['simular'])
+
+
+# Define la ruta para POST /archivar
+@citas_bp.route('/archivar', methods=['POST'])
+@requiere_rol(allowed_roles_archivar)
+def archivar_citas():
+    """
+    endpoint POST para mover al archivo las citas anteriores al corte
+    (hoy menos ARCHIVO_DIAS días) sin esperar al archivado periódico.
+    Query params:
+        - lotes: número máximo de lotes de ARCHIVO_LOTE citas (por defecto, todos)
+    """
+
+    lotes = request.args.get('lotes', type=int)
+    if lotes is not None and lotes < 1:
+        return jsonify({'error': 'El número de lotes debe ser mayor que 0'}), 400
+    try:
+        movidas, pendientes = archivo.archivar(max_lotes=lotes)
+    except archivo.ConflictoArchivo as e:
+        return jsonify({'error': str(e), 'message': 'Vuelva a intentarlo'}), 409
+    frontera = archivo.frontera()
+    return jsonify({'message': 'Citas archivadas',
+                    'archivadas': movidas,
+                    'pendientes': pendientes,
+                    'corte': archivo.corte().strftime('%d-%m-%Y'),
+                    'frontera': frontera.strftime('%d-%m-%Y %H:%M') if frontera else None}), 200
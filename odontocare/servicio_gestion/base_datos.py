@@ -0,0 +1,126 @@
+'''
+Configuración de la conexión a la base de datos compartida por los dos
+servicios, leída de variables de entorno:
+    - DATABASE_URL: URL completa de SQLAlchemy (tiene prioridad)
+    - DB_PATH: ruta del fichero SQLite (Docker)
+    - DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT: tamaño del pool,
+      conexiones extra permitidas y segundos de espera por una conexión libre
+    - DB_POOL_RECYCLE: segundos tras los que se renueva una conexión
+    - DB_POOL_PRE_PING: comprobar la conexión antes de usarla
+    - DB_STATEMENT_TIMEOUT: milisegundos máximos por sentencia (0 sin límite)
+    - DB_BUSY_TIMEOUT: segundos que SQLite espera por un bloqueo de escritura
+El ciclo de vida de las conexiones es seguro con servidores multiproceso:
+al hacer fork (por ejemplo, gunicorn con --preload), el proceso hijo
+descarta las conexiones heredadas del padre sin cerrarlas y abre las suyas.
+'''
+
+import os
+import sqlite3
+import time
+from os import getenv
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from servicio_gestion import metrics
+from servicio_gestion.extensions import db
+
+
+def url_base_datos(ruta_local):
+    '''
+    URL de la base de datos: DATABASE_URL, el fichero de DB_PATH o, si no
+    se indica ninguna, el fichero SQLite local 'ruta_local'
+    '''
+    url = getenv('DATABASE_URL')
+    if url:
+        return url
+    ruta = getenv('DB_PATH')
+    if ruta:
+        return 'sqlite:///' + ruta
+    return 'sqlite:///' + ruta_local
+
+
+def opciones_motor(url, plazo_ms=0):
+    '''
+    Opciones de create_engine (SQLALCHEMY_ENGINE_OPTIONS) para la URL indicada;
+    'plazo_ms' es el plazo por sentencia en milisegundos (0 sin límite)
+    '''
+    url = make_url(url)
+    opciones = {'pool_pre_ping': getenv('DB_POOL_PRE_PING', 'false').lower() == 'true'}
+    en_memoria = url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+    # SQLite en memoria usa un pool de una sola conexión sin estos parámetros
+    if not en_memoria:
+        opciones['pool_size'] = int(getenv('DB_POOL_SIZE', '5'))
+        opciones['max_overflow'] = int(getenv('DB_MAX_OVERFLOW', '10'))
+        opciones['pool_timeout'] = float(getenv('DB_POOL_TIMEOUT', '30'))
+        opciones['pool_recycle'] = int(getenv('DB_POOL_RECYCLE', '-1'))
+    if url.get_backend_name() == 'sqlite':
+        opciones['connect_args'] = {'timeout': float(getenv('DB_BUSY_TIMEOUT', '5'))}
+    elif url.get_backend_name() == 'postgresql' and plazo_ms:
+        # PostgreSQL aplica el plazo en el propio servidor
+        opciones['connect_args'] = {'options': f'-c statement_timeout={plazo_ms}'}
+    return opciones
+
+
+def _limitar_sentencias_sqlite(engine, plazo_ms):
+    '''
+    SQLite no tiene plazo por sentencia: un 'progress handler' interrumpe la
+    sentencia (OperationalError 'interrupted') cuando pasa del plazo.
+    El plazo empieza al ejecutar cada sentencia y cubre también la lectura
+    de sus filas.
+    '''
+    plazo = plazo_ms / 1000
+
+    @event.listens_for(engine, 'connect')
+    def instalar(dbapi_connection, connection_record):
+        estado = {'limite': None}
+        connection_record.info['plazo_sentencia'] = estado
+        dbapi_connection.set_progress_handler(
+            lambda: estado['limite'] is not None and time.monotonic() > estado['limite'], 1000)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def iniciar(conn, cursor, statement, parameters, context, executemany):
+        estado = conn.info.get('plazo_sentencia')
+        if estado is not None:
+            estado['limite'] = time.monotonic() + plazo
+
+    @event.listens_for(engine, 'checkin')
+    def terminar(dbapi_connection, connection_record):
+        estado = connection_record.info.get('plazo_sentencia')
+        if estado is not None:
+            estado['limite'] = None
+
+    @event.listens_for(engine, 'handle_error')
+    def contar(contexto):
+        if (isinstance(contexto.original_exception, sqlite3.OperationalError)
+                and 'interrupted' in str(contexto.original_exception)):
+            metrics.incrementar('bd_sentencias_interrumpidas')
+
+
+def estado_pool(engine):
+    'Conexiones del pool: tamaño, en uso, libres y extra (overflow)'
+    pool = engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {'pool': type(pool).__name__}
+    return {'pool': type(pool).__name__,
+            'tamano': pool.size(),
+            'en_uso': pool.checkedout(),
+            'libres': pool.checkedin(),
+            'overflow': pool.overflow()}
+
+
+def init_app(app):
+    '''
+    Completa la configuración del motor de la app (db.init_app ya llamado):
+    plazo por sentencia en SQLite, métricas del pool y reinicio del pool en
+    los procesos hijos tras un fork
+    '''
+    with app.app_context():
+        engine = db.engine
+    plazo_ms = app.config.get('DB_STATEMENT_TIMEOUT', 0)
+    if plazo_ms and engine.dialect.name == 'sqlite':
+        _limitar_sentencias_sqlite(engine, plazo_ms)
+    metrics.registrar_proveedor('pool_bd', lambda: estado_pool(engine))
+    if hasattr(os, 'register_at_fork'):
+        # close=False: las conexiones del padre siguen siendo suyas, el hijo solo las olvida
+        os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
@@ -0,0 +1,229 @@
+'''
+Caché de respuestas de los listados que cambian poco (doctores y centros
+médicos), con dos niveles:
+    - local: diccionario LRU en la memoria del proceso
+    - compartido (opcional): fichero SQLite en RESPUESTAS_CACHE_RUTA que
+      comparten todos los procesos (workers) del servicio
+La clave es el grupo (listado), su versión, el endpoint y los query params.
+Cada commit que inserta, modifica o borra un doctor o un centro médico
+incrementa la versión de su grupo (en el fichero compartido, si lo hay),
+así que las respuestas anteriores dejan de usarse en todos los procesos.
+Las entradas caducan además a los RESPUESTAS_CACHE_TTL segundos, lo que
+acota el tiempo que un proceso sin nivel compartido puede servir un
+listado modificado por otro proceso.
+'''
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from servicio_gestion import metrics
+from servicio_gestion.models.centros_medicos import CentroMedico
+from servicio_gestion.models.doctores import Doctor
+
+
+# Grupos de respuestas que invalida cada entidad
+GRUPOS = {
+    Doctor: 'doctores',
+    CentroMedico: 'centros_medicos',
+}
+
+_cache = OrderedDict()
+_versiones = {}
+_contadores = {'aciertos_local': 0, 'aciertos_compartida': 0, 'fallos': 0}
+_cache_lock = threading.Lock()
+# Conexión al fichero compartido de cada hilo
+_conexiones = threading.local()
+
+SENTENCIAS_COMPARTIDA = [
+    'CREATE TABLE IF NOT EXISTS versiones ('
+    'grupo TEXT PRIMARY KEY, version INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS respuestas ('
+    'clave TEXT PRIMARY KEY, grupo TEXT NOT NULL, version INTEGER NOT NULL, '
+    'cuerpo BLOB NOT NULL, mimetype TEXT NOT NULL, expira REAL NOT NULL)',
+]
+
+
+def _compartida():
+    'Conexión del hilo al fichero compartido, o None si no está configurado'
+    ruta = current_app.config['RESPUESTAS_CACHE_RUTA']
+    if not ruta:
+        return None
+    conexion = getattr(_conexiones, 'conexion', None)
+    if conexion is None or _conexiones.ruta != ruta:
+        conexion = sqlite3.connect(ruta, timeout=5, isolation_level=None)
+        conexion.execute('PRAGMA journal_mode=WAL')
+        conexion.execute('PRAGMA synchronous=NORMAL')
+        for sentencia in SENTENCIAS_COMPARTIDA:
+            conexion.execute(sentencia)
+        _conexiones.conexion, _conexiones.ruta = conexion, ruta
+    return conexion
+
+
+def _error_compartida(error):
+    'Un fallo del nivel compartido no debe romper la petición: se sigue sin él'
+    metrics.incrementar('respuestas_cache_errores_compartida')
+    current_app.logger.warning('Caché de respuestas compartida no disponible: %s', error)
+
+
+def _version(grupo):
+    'Versión actual del grupo (la del fichero compartido si lo hay)'
+    try:
+        conexion = _compartida()
+        if conexion is not None:
+            fila = conexion.execute('SELECT version FROM versiones WHERE grupo = ?',
+                                    (grupo,)).fetchone()
+            return fila[0] if fila else 0
+    except sqlite3.Error as error:
+        _error_compartida(error)
+    with _cache_lock:
+        return _versiones.get(grupo, 0)
+
+
+def _buscar(clave):
+    'Devuelve (cuerpo, mimetype, nivel) de una entrada vigente o None'
+    ahora = time.time()
+    with _cache_lock:
+        entrada = _cache.get(clave)
+        if entrada is not None and entrada[2] > ahora:
+            _cache.move_to_end(clave)
+            _contadores['aciertos_local'] += 1
+            return entrada[0], entrada[1], 'local'
+    try:
+        conexion = _compartida()
+        if conexion is not None:
+            fila = conexion.execute(
+                'SELECT cuerpo, mimetype, expira FROM respuestas WHERE clave = ? AND expira > ?',
+                (clave, ahora)).fetchone()
+            if fila is not None:
+                _guardar_local(clave, fila[0], fila[1], fila[2])
+                with _cache_lock:
+                    _contadores['aciertos_compartida'] += 1
+                return fila[0], fila[1], 'compartida'
+    except sqlite3.Error as error:
+        _error_compartida(error)
+    with _cache_lock:
+        _contadores['fallos'] += 1
+    return None
+
+
+def _guardar_local(clave, cuerpo, mimetype, expira):
+    'Guarda la entrada en el nivel local, descartando las menos usadas'
+    with _cache_lock:
+        _cache[clave] = (cuerpo, mimetype, expira)
+        _cache.move_to_end(clave)
+        while len(_cache) > current_app.config['RESPUESTAS_CACHE_MAX']:
+            _cache.popitem(last=False)
+
+
+def _guardar(clave, grupo, version, cuerpo, mimetype):
+    'Guarda la respuesta en los dos niveles'
+    ahora = time.time()
+    expira = ahora + current_app.config['RESPUESTAS_CACHE_TTL']
+    _guardar_local(clave, cuerpo, mimetype, expira)
+    try:
+        conexion = _compartida()
+        if conexion is not None:
+            conexion.execute('DELETE FROM respuestas WHERE expira <= ?', (ahora,))
+            conexion.execute('INSERT OR REPLACE INTO respuestas VALUES (?, ?, ?, ?, ?, ?)',
+                             (clave, grupo, version, cuerpo, mimetype, expira))
+    except sqlite3.Error as error:
+        _error_compartida(error)
+
+
+def invalidar(grupo):
+    'Pasa el grupo a una versión nueva y descarta sus respuestas guardadas'
+    metrics.incrementar('respuestas_cache_invalidaciones')
+    prefijo = f'{grupo}|'
+    with _cache_lock:
+        _versiones[grupo] = _versiones.get(grupo, 0) + 1
+        for clave in [clave for clave in _cache if clave.startswith(prefijo)]:
+            del _cache[clave]
+    try:
+        conexion = _compartida()
+        if conexion is not None:
+            conexion.execute('INSERT INTO versiones VALUES (?, 1) ON CONFLICT(grupo) '
+                             'DO UPDATE SET version = version + 1', (grupo,))
+            conexion.execute('DELETE FROM respuestas WHERE grupo = ?', (grupo,))
+    except sqlite3.Error as error:
+        _error_compartida(error)
+
+
+def vaciar():
+    'Descarta todas las respuestas del nivel local'
+    with _cache_lock:
+        _cache.clear()
+
+
+def cacheada(grupo):
+    '''
+    Decorador para vistas GET cuya respuesta solo depende de los query params
+    y de las entidades del grupo. Se aplica debajo de 'requiere_rol' para que
+    la autorización se compruebe siempre.
+    '''
+    def decorador(vista):
+        @wraps(vista)
+        def envoltorio(*args, **kwargs):
+            if not current_app.config['RESPUESTAS_CACHE']:
+                return vista(*args, **kwargs)
+            version = _version(grupo)
+            parametros = '&'.join(f'{nombre}={valor}' for nombre, valor
+                                  in sorted(request.args.items(multi=True)))
+            clave = f'{grupo}|{version}|{request.endpoint}|{parametros}'
+
+            entrada = _buscar(clave)
+            if entrada is not None:
+                cuerpo, mimetype, nivel = entrada
+                respuesta = current_app.response_class(cuerpo, mimetype=mimetype)
+                respuesta.headers['X-Cache'] = f'HIT-{nivel}'
+                return respuesta
+
+            respuesta = current_app.make_response(vista(*args, **kwargs))
+            if respuesta.status_code == 200 and not respuesta.is_streamed:
+                _guardar(clave, grupo, version, respuesta.get_data(), respuesta.mimetype)
+            respuesta.headers['X-Cache'] = 'MISS'
+            return respuesta
+        return envoltorio
+    return decorador
+
+
+def estado():
+    'Aciertos, fallos y proporción de aciertos de la caché'
+    with _cache_lock:
+        datos = dict(_contadores, entradas=len(_cache))
+    consultas = datos['aciertos_local'] + datos['aciertos_compartida'] + datos['fallos']
+    aciertos = datos['aciertos_local'] + datos['aciertos_compartida']
+    datos['ratio_aciertos'] = round(aciertos / consultas, 4) if consultas else 0.0
+    return datos
+
+
+metrics.registrar_proveedor('respuestas_cache', estado)
+
+
+@event.listens_for(Session, 'after_flush')
+def anotar_grupos(session, flush_context):
+    'Anota en la sesión los grupos afectados por los cambios de este flush'
+    grupos = session.info.setdefault('respuestas_cache_grupos', set())
+    for objeto in (*session.new, *session.dirty, *session.deleted):
+        grupo = GRUPOS.get(type(objeto))
+        if grupo is not None:
+            grupos.add(grupo)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidar_grupos(session):
+    'Tras confirmar la transacción, invalida los grupos anotados'
+    for grupo in session.info.pop('respuestas_cache_grupos', ()):
+        invalidar(grupo)
+
+
+@event.listens_for(Session, 'after_rollback')
+def descartar_grupos(session):
+    'Los cambios deshechos no invalidan nada'
+    session.info.pop('respuestas_cache_grupos', None)
@@ -0,0 +1,178 @@
+'''
+Calentamiento del servicio al arrancar, en un hilo en segundo plano:
+    - conexiones_bd: abre las conexiones del pool de la base de datos
+    - consultas_orm: ejecuta una vez las consultas de la escritura de citas
+      para que SQLAlchemy guarde su SQL compilado
+    - caches_referencias: rellena la réplica local (si se usa) y la caché de
+      los listados de doctores y centros médicos
+    - peticiones: peticiones internas a los endpoints de consulta más usados
+      (primera decodificación de JWT, consultas y serialización)
+    - conexiones_http: abre conexiones con servicio_gestion en la sesión
+      compartida de gestion_client (solo con CALENTAMIENTO_HTTP)
+GET /ready responde 503 hasta que termina y después 200 con el tiempo de
+cada paso. Un paso que falla no bloquea el arranque: se anota su error.
+'''
+
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.pool import QueuePool
+
+from servicio_gestion import metrics
+from servicio_gestion.extensions import db
+from servicio_gestion.routes import auth
+from servicio_citas import gestion_client, referencias, replica
+from servicio_citas.config import Config
+from servicio_citas.models.citas import CitaMedica, ocupa_agenda
+from servicio_citas.models.idempotencia import ClaveIdempotencia
+
+
+class Calentamiento:
+    'Estado del calentamiento de una app'
+
+    def __init__(self):
+        self.listo = False
+        self.pasos = {}
+        self.errores = {}
+        self.total_ms = None
+
+    def estado(self):
+        'Estado para /ready y /metrics'
+        return {'listo': self.listo,
+                'total_ms': self.total_ms,
+                'pasos_ms': dict(self.pasos),
+                'errores': dict(self.errores)}
+
+
+def _conexiones_bd(app):
+    'Abre a la vez todas las conexiones del pool y las devuelve libres'
+    pool = db.engine.pool
+    n = pool.size() if isinstance(pool, QueuePool) else 1
+    conexiones = [db.engine.connect() for _ in range(n)]
+    for conexion in conexiones:
+        conexion.exec_driver_sql('SELECT 1')
+    for conexion in conexiones:
+        conexion.close()
+
+
+def _consultas_orm(app):
+    'Consultas de agendar, modificar y cancelar con valores que no existen'
+    CitaMedica.query.filter(CitaMedica.fecha == datetime.now(), CitaMedica.id_doctor == 0,
+                            ocupa_agenda()).first()
+    db.session.get(CitaMedica, 0)
+    db.session.get(ClaveIdempotencia, '')
+    if Config.REFERENCIAS_BACKEND == 'sql':
+        list(referencias.BackendSQL().buscar({'id_paciente': 0, 'id_doctor': 0,
+                                             'id_centro': 0}))
+    db.session.rollback()
+
+
+def _get(cliente, headers, url):
+    'Petición interna de calentamiento; falla si la respuesta es un error del servidor'
+    respuesta = cliente.get(url, headers=headers)
+    if respuesta.status_code >= 500:
+        raise RuntimeError(f'{url}: HTTP {respuesta.status_code}')
+
+
+def _cliente(app):
+    'Cliente de pruebas de la app y cabeceras con un token de administrador'
+    token = auth.generate_jwt_token('calentamiento', 'admin')
+    return app.test_client(), {'Authorization': f'Bearer {token}'}
+
+
+def _caches_referencias(app):
+    'Réplica local de referencias y caché de los listados de doctores y centros'
+    if Config.REFERENCIAS_BACKEND == 'replica':
+        replica.sincronizar()
+    cliente, headers = _cliente(app)
+    for url in ('/admin/doctores', '/admin/centros_medicos'):
+        _get(cliente, headers, url)
+
+
+def _peticiones(app):
+    'Endpoints de consulta de citas más usados'
+    cliente, headers = _cliente(app)
+    hoy = datetime.now().strftime('%d-%m-%Y')
+    for url in ('/citas/listar_citas?id_doctor=0',
+                f'/citas/agenda?id_doctor=0&fecha={hoy}&vista=semana',
+                '/admin/doctor/0', '/admin/centro_medico/0', '/admin/paciente/0'):
+        _get(cliente, headers, url)
+
+
+def _conexiones_http(app):
+    'Abre a la vez CALENTAMIENTO_CONEXIONES_HTTP conexiones con servicio_gestion'
+    if not app.config.get('CALENTAMIENTO_HTTP', False):
+        return
+    url = Config.GESTION_URL + '/'
+    errores = []
+
+    def conectar():
+        try:
+            gestion_client.session.get(url, timeout=Config.GESTION_PLAZO)
+        except Exception as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=conectar)
+             for _ in range(app.config.get('CALENTAMIENTO_CONEXIONES_HTTP', 4))]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    if errores:
+        raise errores[0]
+
+
+PASOS = [
+    ('conexiones_bd', _conexiones_bd),
+    ('consultas_orm', _consultas_orm),
+    ('caches_referencias', _caches_referencias),
+    ('peticiones', _peticiones),
+    ('conexiones_http', _conexiones_http),
+]
+
+
+def calentar(app):
+    'Ejecuta los pasos del calentamiento y marca la app como lista'
+    calentamiento = app.extensions['calentamiento']
+    t_inicio = time.perf_counter()
+    for nombre, paso in PASOS:
+        t0 = time.perf_counter()
+        with app.app_context():
+            try:
+                paso(app)
+            except Exception as e:
+                db.session.rollback()
+                calentamiento.errores[nombre] = str(e)
+                app.logger.warning('Error en el paso %s del calentamiento: %s', nombre, e)
+            finally:
+                db.session.remove()
+        calentamiento.pasos[nombre] = round((time.perf_counter() - t0) * 1000, 1)
+    calentamiento.total_ms = round((time.perf_counter() - t_inicio) * 1000, 1)
+    calentamiento.listo = True
+    metrics.fijar('calentamiento_ms', calentamiento.total_ms)
+
+
+def iniciar(app):
+    '''
+    Arranca el calentamiento en un hilo en segundo plano (o marca la app como
+    lista si CALENTAMIENTO está desactivado)
+    '''
+    calentamiento = Calentamiento()
+    app.extensions['calentamiento'] = calentamiento
+    metrics.registrar_proveedor('calentamiento', calentamiento.estado)
+    if not app.config.get('CALENTAMIENTO', True):
+        calentamiento.listo = True
+        return None
+    hilo = threading.Thread(target=calentar, args=(app,), name='calentamiento', daemon=True)
+    hilo.start()
+    return hilo
+
+
+def estado():
+    'Estado del calentamiento de la app en curso (lista si no se ha iniciado)'
+    calentamiento = current_app.extensions.get('calentamiento')
+    if calentamiento is None:
+        return {'listo': True, 'total_ms': None, 'pasos_ms': {}, 'errores': {}}
+    return calentamiento.estado()
@@ -0,0 +1,59 @@
+'''
+Selección de campos (sparse fieldsets) para los listados: ?fields=a,b,c
+Los listados consultan solo las columnas pedidas (por defecto, los campos
+públicos del modelo, los mismos que devuelve to_dict) y obtienen filas
+(tuplas) en lugar de objetos ORM, así que no pasan por el identity map de
+la sesión y se serializan sin crear ni modificar instancias de los modelos.
+Las filas se ordenan por la clave primaria: sin ORDER BY, el orden (y el
+contenido de cada página) dependería de los campos pedidos, porque SQLite
+puede leer un índice de cobertura en lugar de la tabla.
+'''
+
+from sqlalchemy import inspect
+
+from servicio_gestion.extensions import db
+
+
+class CamposInvalidos(ValueError):
+    'El parámetro fields contiene campos que el listado no tiene'
+
+
+def campos_solicitados(modelo, texto):
+    '''
+    Devuelve la lista de campos del parámetro 'fields' (texto separado por
+    comas) o todos los campos públicos del modelo si no se indica.
+    Lanza CamposInvalidos si algún campo no existe.
+    '''
+    if not texto:
+        return list(modelo.CAMPOS)
+    campos = list(dict.fromkeys(campo.strip() for campo in texto.split(',') if campo.strip()))
+    desconocidos = [campo for campo in campos if campo not in modelo.CAMPOS]
+    if not campos or desconocidos:
+        raise CamposInvalidos(f'Campos no válidos: {", ".join(desconocidos) or texto}. '
+                              f'Campos disponibles: {", ".join(modelo.CAMPOS)}')
+    return campos
+
+
+def consulta(modelo, campos):
+    '''
+    Consulta de solo las columnas indicadas, ordenada por la clave primaria
+    (admite filter_by, paginate, ...). 'modelo' puede ser un alias del modelo
+    '''
+    clave = [getattr(modelo, columna.key) for columna in inspect(modelo).mapper.primary_key]
+    return db.session.query(*(getattr(modelo, campo) for campo in campos)).order_by(*clave)
+
+
+def serializar(modelo, campos, filas):
+    'Convierte las filas en diccionarios; las columnas Enum se devuelven por su valor'
+    enums = [campo for campo in campos
+             if getattr(getattr(modelo, campo).type, 'enum_class', None) is not None]
+    if not enums:
+        return [dict(zip(campos, fila)) for fila in filas]
+    resultado = []
+    for fila in filas:
+        datos = dict(zip(campos, fila))
+        for campo in enums:
+            if datos[campo] is not None:
+                datos[campo] = datos[campo].value
+        resultado.append(datos)
+    return resultado
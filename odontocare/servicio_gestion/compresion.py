@@ -0,0 +1,208 @@
+'''
+Compresión negociada de las respuestas HTTP de los dos servicios.
+Según la cabecera Accept-Encoding del cliente se elige el primer algoritmo
+disponible de COMPRESION_ALGORITMOS que acepte (con la mayor calidad 'q'):
+    - gzip: siempre disponible (zlib de la librería estándar)
+    - br: si está instalado el paquete 'brotli'
+    - zstd: si está instalado el paquete 'zstandard'
+Solo se comprimen los tipos de contenido de texto (JSON, HTML, ...) y las
+respuestas de al menos COMPRESION_UMBRAL bytes. Las respuestas en streaming
+se comprimen trozo a trozo, vaciando el compresor después de cada trozo para
+no retrasar su envío al cliente.
+Publica en /metrics los bytes originales, los enviados, los ahorrados y el
+tiempo de CPU dedicado a comprimir.
+'''
+
+import time
+import zlib
+
+from flask import current_app, request
+
+from servicio_gestion import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Tipos de contenido que se comprimen (las imágenes o PDF ya van comprimidos)
+TIPOS_COMPRIMIBLES = ('text/', 'application/json', 'application/javascript',
+                      'application/xml', 'image/svg+xml')
+
+
+class CompresorGzip:
+    'Compresor gzip incremental'
+
+    def __init__(self, nivel):
+        self.compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+
+    def comprimir(self, datos):
+        'Comprime un trozo (puede quedar parte en el búfer interno)'
+        return self.compresor.compress(datos)
+
+    def vaciar(self):
+        'Devuelve todo lo pendiente sin cerrar el flujo'
+        return self.compresor.flush(zlib.Z_SYNC_FLUSH)
+
+    def terminar(self):
+        'Devuelve lo pendiente y cierra el flujo'
+        return self.compresor.flush()
+
+
+class CompresorBrotli:
+    'Compresor brotli incremental'
+
+    def __init__(self, nivel):
+        self.compresor = brotli.Compressor(quality=nivel)
+
+    def comprimir(self, datos):
+        'Comprime un trozo (puede quedar parte en el búfer interno)'
+        return self.compresor.process(datos)
+
+    def vaciar(self):
+        'Devuelve todo lo pendiente sin cerrar el flujo'
+        return self.compresor.flush()
+
+    def terminar(self):
+        'Devuelve lo pendiente y cierra el flujo'
+        return self.compresor.finish()
+
+
+class CompresorZstd:
+    'Compresor zstd incremental'
+
+    def __init__(self, nivel):
+        self.compresor = zstandard.ZstdCompressor(level=nivel).compressobj()
+
+    def comprimir(self, datos):
+        'Comprime un trozo (puede quedar parte en el búfer interno)'
+        return self.compresor.compress(datos)
+
+    def vaciar(self):
+        'Devuelve todo lo pendiente sin cerrar el flujo'
+        return self.compresor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def terminar(self):
+        'Devuelve lo pendiente y cierra el flujo'
+        return self.compresor.flush()
+
+
+# Algoritmos disponibles: codificación -> (clase del compresor, clave del nivel)
+COMPRESORES = {'gzip': (CompresorGzip, 'COMPRESION_NIVEL')}
+if brotli is not None:
+    COMPRESORES['br'] = (CompresorBrotli, 'COMPRESION_NIVEL_BR')
+if zstandard is not None:
+    COMPRESORES['zstd'] = (CompresorZstd, 'COMPRESION_NIVEL_ZSTD')
+
+
+def negociar(accept_encodings, preferencias):
+    '''
+    Elige la codificación a usar entre las preferidas por el servidor que
+    estén disponibles, según la calidad que les da el cliente.
+    Devuelve None si el cliente no acepta ninguna.
+    '''
+    elegida = None
+    mejor_calidad = 0
+    for codificacion in preferencias:
+        if codificacion not in COMPRESORES:
+            continue
+        calidad = accept_encodings.quality(codificacion)
+        # Con la misma calidad gana el orden de preferencia del servidor
+        if calidad > mejor_calidad:
+            elegida, mejor_calidad = codificacion, calidad
+    return elegida
+
+
+def _crear_compresor(codificacion):
+    'Crea un compresor de la codificación con el nivel configurado'
+    clase, clave_nivel = COMPRESORES[codificacion]
+    return clase(current_app.config[clave_nivel])
+
+
+def _registrar(codificacion, originales, enviados, segundos_cpu):
+    'Acumula las métricas de compresión'
+    metrics.incrementar('compresion_bytes_originales', originales)
+    metrics.incrementar('compresion_bytes_enviados', enviados)
+    metrics.incrementar('compresion_bytes_ahorrados', originales - enviados)
+    metrics.incrementar('compresion_cpu_ms', segundos_cpu * 1000)
+    metrics.incrementar(f'compresion_bytes_ahorrados_{codificacion}', originales - enviados)
+
+
+def _comprimir_streaming(trozos, compresor, codificacion, cerrar):
+    'Genera la respuesta comprimida trozo a trozo'
+    try:
+        for trozo in trozos:
+            if isinstance(trozo, str):
+                trozo = trozo.encode()
+            if not trozo:
+                continue
+            inicio = time.thread_time()
+            comprimido = compresor.comprimir(trozo) + compresor.vaciar()
+            _registrar(codificacion, len(trozo), len(comprimido), time.thread_time() - inicio)
+            yield comprimido
+        inicio = time.thread_time()
+        final = compresor.terminar()
+        _registrar(codificacion, 0, len(final), time.thread_time() - inicio)
+        yield final
+    finally:
+        # Cierra el iterable original (libera la sesión de base de datos, etc.)
+        if cerrar is not None:
+            cerrar()
+
+
+def comprimir_respuesta(response):
+    'Comprime la respuesta si el cliente lo acepta y merece la pena'
+    config = current_app.config
+    if not config['COMPRESION_ACTIVA']:
+        return response
+    if not (response.mimetype or '').startswith(TIPOS_COMPRIMIBLES):
+        return response
+    # Las cachés intermedias deben distinguir la versión comprimida
+    response.vary.add('Accept-Encoding')
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.direct_passthrough):
+        return response
+
+    codificacion = negociar(request.accept_encodings, config['COMPRESION_ALGORITMOS'])
+    if codificacion is None:
+        return response
+
+    if response.is_streamed:
+        original = response.response
+        compresor = _crear_compresor(codificacion)
+        response.response = _comprimir_streaming(original, compresor, codificacion,
+                                                 getattr(original, 'close', None))
+        response.headers.pop('Content-Length', None)
+    else:
+        datos = response.get_data()
+        if len(datos) < config['COMPRESION_UMBRAL']:
+            return response
+        inicio = time.thread_time()
+        compresor = _crear_compresor(codificacion)
+        comprimido = compresor.comprimir(datos) + compresor.terminar()
+        segundos_cpu = time.thread_time() - inicio
+        if len(comprimido) >= len(datos):
+            metrics.incrementar('compresion_descartadas')
+            return response
+        _registrar(codificacion, len(datos), len(comprimido), segundos_cpu)
+        response.set_data(comprimido)
+
+    metrics.incrementar(f'compresion_respuestas_{codificacion}')
+    response.headers['Content-Encoding'] = codificacion
+    # El ETag fuerte identifica los bytes exactos: el comprimido pasa a ser débil
+    etag, debil = response.get_etag()
+    if etag and not debil:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    'Registra la compresión de respuestas en la app'
+    app.after_request(comprimir_respuesta)
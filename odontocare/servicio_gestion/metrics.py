@@ -0,0 +1,43 @@
+'''
+Registro de métricas en memoria del proceso, compartido por los dos servicios.
+    - contadores: valores que solo crecen (peticiones, fallos, ...)
+    - valores: último valor fijado (tamaños, estados, ...)
+    - proveedores: funciones que calculan un valor al consultar las métricas
+Se consultan en formato JSON desde el endpoint /metrics.
+'''
+
+import threading
+
+_lock = threading.Lock()
+_contadores = {}
+_valores = {}
+_proveedores = {}
+
+
+def incrementar(nombre, cantidad=1):
+    'Suma una cantidad al contador indicado'
+    with _lock:
+        _contadores[nombre] = _contadores.get(nombre, 0) + cantidad
+
+
+def fijar(nombre, valor):
+    'Fija el valor actual de una métrica'
+    with _lock:
+        _valores[nombre] = valor
+
+
+def registrar_proveedor(nombre, funcion):
+    'Registra una función sin argumentos cuyo resultado se publica como métrica'
+    with _lock:
+        _proveedores[nombre] = funcion
+
+
+def snapshot():
+    'Devuelve una copia de todas las métricas en un diccionario serializable'
+    with _lock:
+        contadores = dict(_contadores)
+        valores = dict(_valores)
+        proveedores = dict(_proveedores)
+    for nombre, funcion in proveedores.items():
+        valores[nombre] = funcion()
+    return {'contadores': contadores, 'valores': valores}
@@ -0,0 +1,220 @@
+'''
+Migraciones ligeras para bases de datos ya existentes.
+'db.create_all()' solo crea las tablas que faltan, así que los índices
+añadidos a los modelos después de crear la base de datos se crean aquí,
+y las restricciones UNIQUE eliminadas de los modelos o el AUTOINCREMENT
+añadido se aplican reconstruyendo la tabla (SQLite no permite cambiarlos
+con ALTER TABLE).
+'''
+
+from sqlalchemy import MetaData, UniqueConstraint, func, inspect, select, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from servicio_gestion.extensions import db
+from servicio_gestion.models import busqueda_pacientes
+from servicio_gestion.models.outbox import ENTIDADES, EventoOutbox, fila_evento
+from servicio_gestion.models.pacientes import Paciente
+from servicio_citas.models.citas import CitaArchivada, CitaMedica
+from servicio_citas.models.eventos_citas import EventoCita
+from servicio_citas.models.idempotencia import ClaveIdempotencia
+
+
+def _unicas_sobrantes(inspector, tabla):
+    'Restricciones UNIQUE de la base de datos que ya no están en el modelo'
+    del_modelo = {tuple(columna.name for columna in restriccion.columns)
+                  for restriccion in tabla.constraints
+                  if isinstance(restriccion, UniqueConstraint)}
+    return [unica['column_names'] for unica in inspector.get_unique_constraints(tabla.name)
+            if tuple(unica['column_names']) not in del_modelo]
+
+
+def _falta_autoincremento(tabla):
+    'La tabla declara sqlite_autoincrement en el modelo pero no en la base de datos'
+    if db.engine.dialect.name != 'sqlite' or not tabla.dialect_options['sqlite']['autoincrement']:
+        return False
+    sql = db.session.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' "
+                                  "AND name = :nombre"), {'nombre': tabla.name}).scalar()
+    return sql is not None and 'AUTOINCREMENT' not in sql.upper()
+
+
+def _reconstruir_tabla(tabla, columnas):
+    '''
+    Reconstruye una tabla con la definición actual del modelo copiando sus
+    filas: se crea la tabla nueva, se copian las columnas comunes, se borra
+    la antigua y se renombra la nueva (así las claves ajenas de otras tablas,
+    que hacen referencia al nombre, siguen siendo válidas).
+    Los índices se crean después en 'crear_indices'.
+    '''
+    metadata = MetaData()
+    # Las tablas referenciadas por claves ajenas se copian para poder declararlas
+    for clave in tabla.foreign_keys:
+        if clave.column.table.name not in metadata.tables:
+            clave.column.table.to_metadata(metadata)
+    nueva = tabla.to_metadata(metadata, name=f'{tabla.name}_migracion')
+    nueva.indexes.clear()
+    lista = ', '.join(columna for columna in columnas if columna in tabla.columns)
+    with db.engine.begin() as conexion:
+        conexion.exec_driver_sql(f'DROP TABLE IF EXISTS {nueva.name}')
+        nueva.create(bind=conexion)
+        conexion.exec_driver_sql(f'INSERT INTO {nueva.name} ({lista}) '
+                                 f'SELECT {lista} FROM {tabla.name}')
+        conexion.exec_driver_sql(f'DROP TABLE {tabla.name}')
+        conexion.exec_driver_sql(f'ALTER TABLE {nueva.name} RENAME TO {tabla.name}')
+
+
+def eliminar_restricciones(app):
+    '''
+    Quita las restricciones UNIQUE que ya no están declaradas en los modelos
+    y añade el AUTOINCREMENT a las tablas que lo declaran
+    '''
+    with app.app_context():
+        try:
+            inspector = inspect(db.engine)
+            for tabla in db.metadata.sorted_tables:
+                if not inspector.has_table(tabla.name):
+                    continue
+                sobrantes = _unicas_sobrantes(inspector, tabla)
+                if sobrantes:
+                    print(f'Eliminando restricciones UNIQUE {sobrantes} de {tabla.name}')
+                elif _falta_autoincremento(tabla):
+                    print(f'Añadiendo AUTOINCREMENT a {tabla.name}')
+                if sobrantes or _falta_autoincremento(tabla):
+                    columnas = [columna['name'] for columna in inspector.get_columns(tabla.name)]
+                    _reconstruir_tabla(tabla, columnas)
+            db.session.remove()
+        except OperationalError as e:
+            # Sin base de datos accesible el servicio arranca igualmente
+            print(f'No se han podido eliminar las restricciones: {e}')
+
+
+def crear_indices(app):
+    'Crea los índices declarados en los modelos que aún no existan en la base de datos'
+    with app.app_context():
+        try:
+            inspector = inspect(db.engine)
+            for tabla in db.metadata.sorted_tables:
+                # Si la tabla todavía no existe, la creará 'db.create_all()' con sus índices
+                if not inspector.has_table(tabla.name):
+                    continue
+                for indice in tabla.indexes:
+                    try:
+                        indice.create(bind=db.engine, checkfirst=True)
+                    except IntegrityError as e:
+                        # Un índice único no se puede crear si ya hay valores repetidos
+                        print(f'No se ha podido crear el índice {indice.name}: {e.orig}')
+        except OperationalError as e:
+            # Sin base de datos accesible el servicio arranca igualmente
+            print(f'No se han podido crear los índices: {e}')
+
+
+def inicializar_outbox(app):
+    '''
+    Crea la tabla outbox en bases de datos existentes y, si está vacía,
+    registra un evento 'insert' por cada paciente, doctor y centro médico
+    ya existente para que las réplicas puedan arrancar desde cero.
+    '''
+    with app.app_context():
+        try:
+            inspector = inspect(db.engine)
+            # Si la base de datos no tiene tablas, la creará 'db.create_all()'
+            if not inspector.has_table(Paciente.__tablename__):
+                return
+            EventoOutbox.__table__.create(bind=db.engine, checkfirst=True)
+            if EventoOutbox.query.first() is not None:
+                return
+            filas = []
+            for clase in ENTIDADES:
+                filas += [fila_evento(objeto, 'insert') for objeto in clase.query.all()]
+            if filas:
+                db.session.execute(EventoOutbox.__table__.insert(), filas)
+            db.session.commit()
+        except OperationalError as e:
+            # Sin base de datos accesible el servicio arranca igualmente
+            print(f'No se ha podido inicializar la tabla outbox: {e}')
+
+
+def _ajustar_secuencia(nombre_tabla, columna):
+    'Sube el siguiente id AUTOINCREMENT de la tabla por encima del mayor valor de la columna'
+    with db.engine.begin() as conexion:
+        maximo = conexion.execute(select(func.max(columna))).scalar()
+        if maximo is None:
+            return
+        secuencia = conexion.execute(text('SELECT seq FROM sqlite_sequence WHERE name = :tabla'),
+                                     {'tabla': nombre_tabla}).scalar()
+        if secuencia is None:
+            conexion.execute(text('INSERT INTO sqlite_sequence (name, seq) VALUES (:tabla, :seq)'),
+                             {'tabla': nombre_tabla, 'seq': maximo})
+        elif secuencia < maximo:
+            conexion.execute(text('UPDATE sqlite_sequence SET seq = :seq WHERE name = :tabla'),
+                             {'tabla': nombre_tabla, 'seq': maximo})
+
+
+def inicializar_archivo_citas(app):
+    'Crea la tabla de archivo de citas en bases de datos existentes'
+    with app.app_context():
+        try:
+            # Si la base de datos no tiene tablas, la creará 'db.create_all()'
+            if not inspect(db.engine).has_table(CitaMedica.__tablename__):
+                return
+            CitaArchivada.__table__.create(bind=db.engine, checkfirst=True)
+            for indice in CitaArchivada.__table__.indexes:
+                indice.create(bind=db.engine, checkfirst=True)
+            # Los id_cita nuevos deben ser mayores que los ya archivados
+            # (bases de datos creadas antes del AUTOINCREMENT)
+            if db.engine.dialect.name == 'sqlite':
+                _ajustar_secuencia(CitaMedica.__tablename__, CitaArchivada.id_cita)
+        except OperationalError as e:
+            # Sin base de datos accesible el servicio arranca igualmente
+            print(f'No se ha podido crear la tabla de archivo de citas: {e}')
+
+
+def inicializar_idempotencia(app):
+    'Crea la tabla de claves de idempotencia en bases de datos existentes'
+    with app.app_context():
+        try:
+            # Si la base de datos no tiene tablas, la creará 'db.create_all()'
+            if not inspect(db.engine).has_table(CitaMedica.__tablename__):
+                return
+            ClaveIdempotencia.__table__.create(bind=db.engine, checkfirst=True)
+            for indice in ClaveIdempotencia.__table__.indexes:
+                indice.create(bind=db.engine, checkfirst=True)
+        except OperationalError as e:
+            # Sin base de datos accesible el servicio arranca igualmente
+            print(f'No se ha podido crear la tabla de claves de idempotencia: {e}')
+
+
+def inicializar_eventos_citas(app):
+    'Crea la tabla de eventos de cambios de citas en bases de datos existentes'
+    with app.app_context():
+        try:
+            # Si la base de datos no tiene tablas, la creará 'db.create_all()'
+            if not inspect(db.engine).has_table(CitaMedica.__tablename__):
+                return
+            EventoCita.__table__.create(bind=db.engine, checkfirst=True)
+            for indice in EventoCita.__table__.indexes:
+                indice.create(bind=db.engine, checkfirst=True)
+        except OperationalError as e:
+            # Sin base de datos accesible el servicio arranca igualmente
+            print(f'No se ha podido crear la tabla de eventos de citas: {e}')
+
+
+def crear_busqueda_pacientes(app):
+    '''
+    Crea el índice de búsqueda de pacientes (FTS5) y sus triggers en bases
+    de datos existentes, copiando en él los pacientes que ya haya.
+    '''
+    with app.app_context():
+        try:
+            inspector = inspect(db.engine)
+            # Si la base de datos no tiene tablas, 'db.create_all()' creará también el índice
+            if not inspector.has_table(Paciente.__tablename__):
+                return
+            existia = inspector.has_table(busqueda_pacientes.TABLA_FTS)
+            with db.engine.begin() as conexion:
+                for sentencia in busqueda_pacientes.SENTENCIAS:
+                    conexion.execute(text(sentencia))
+                if not existia:
+                    conexion.execute(text(busqueda_pacientes.POBLAR))
+        except OperationalError as e:
+            # Sin base de datos accesible (o sin FTS5 en SQLite) el servicio arranca igualmente
+            print(f'No se ha podido crear el índice de búsqueda de pacientes: {e}')
@@ -0,0 +1,102 @@
+'''
+Índice de búsqueda de texto completo (SQLite FTS5) sobre el nombre y el
+teléfono de los pacientes.
+La tabla virtual 'pacientes_fts' se mantiene sincronizada con 'pacientes'
+mediante triggers. El tokenizador 'unicode61' con 'remove_diacritics 2'
+ignora mayúsculas y acentos, así que 'vizcai' encuentra 'Vizcaíno'.
+Del teléfono se indexan, sin el prefijo internacional, los grupos de
+dígitos y el número completo, para poder buscar por cualquiera de ellos.
+'''
+
+import re
+
+from sqlalchemy import DDL, event, text
+
+from servicio_gestion.extensions import db
+from servicio_gestion.models.pacientes import Paciente
+
+
+TABLA_FTS = 'pacientes_fts'
+
+
+def _digitos(expresion):
+    'Expresión SQL que quita separadores habituales de un teléfono'
+    for caracter in ' +-().':
+        expresion = f"replace({expresion}, '{caracter}', '')"
+    return expresion
+
+
+def _terminos_telefono(columna):
+    '''
+    Expresión SQL con los términos indexados de un teléfono: si empieza por
+    '+' se quita el prefijo internacional (hasta el primer espacio), que
+    compartirían casi todos los pacientes
+    '''
+    sin_prefijo = (f"CASE WHEN substr({columna}, 1, 1) = '+' "
+                   f"THEN substr({columna}, instr({columna}, ' ') + 1) ELSE {columna} END")
+    return f"{sin_prefijo} || ' ' || {_digitos(sin_prefijo)}"
+
+
+def _insertar(fila):
+    'Sentencia que copia una fila de pacientes (new u old) al índice'
+    telefono = _terminos_telefono(f'{fila}.telefono')
+    return (f'INSERT INTO {TABLA_FTS}(rowid, nombre, telefono) '
+            f'VALUES ({fila}.id_paciente, {fila}.nombre, {telefono});')
+
+
+SENTENCIAS = [
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5('
+    f'nombre, telefono, tokenize="unicode61 remove_diacritics 2")',
+    f'CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ai AFTER INSERT ON pacientes BEGIN '
+    f'{_insertar("new")} END',
+    f'CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_ad AFTER DELETE ON pacientes BEGIN '
+    f'DELETE FROM {TABLA_FTS} WHERE rowid = old.id_paciente; END',
+    f'CREATE TRIGGER IF NOT EXISTS {TABLA_FTS}_au AFTER UPDATE OF nombre, telefono '
+    f'ON pacientes BEGIN DELETE FROM {TABLA_FTS} WHERE rowid = old.id_paciente; '
+    f'{_insertar("new")} END',
+]
+
+# Copia al índice los pacientes existentes (al crearlo en una base de datos con datos)
+POBLAR = (f'INSERT INTO {TABLA_FTS}(rowid, nombre, telefono) '
+          f'SELECT id_paciente, nombre, {_terminos_telefono("telefono")} FROM pacientes')
+
+
+# Las bases de datos nuevas crean el índice junto con la tabla 'pacientes'
+for sentencia in SENTENCIAS:
+    event.listen(Paciente.__table__, 'after_create',
+                 DDL(sentencia).execute_if(dialect='sqlite'))
+
+
+def consulta_fts(texto):
+    '''
+    Convierte el texto buscado en una consulta FTS5: cada palabra se busca
+    como prefijo y deben aparecer todas. Un prefijo internacional al
+    principio ('+34 ...') se ignora porque no está indexado.
+    Devuelve None si no hay palabras.
+    '''
+    texto = (texto or '').strip()
+    if texto.startswith('+'):
+        texto = texto.partition(' ')[2]
+    palabras = re.findall(r'\w+', texto)
+    if not palabras:
+        return None
+    return ' '.join(f'"{palabra}"*' for palabra in palabras)
+
+
+def buscar_pacientes(texto, limite=20):
+    '''
+    Busca pacientes por prefijos del nombre o del teléfono.
+    Los resultados salen en el orden del índice (id_paciente): ordenar por
+    relevancia obligaría a puntuar todas las coincidencias de prefijos
+    cortos antes de aplicar el límite.
+    Devuelve la lista de pacientes.
+    '''
+    consulta = consulta_fts(texto)
+    if consulta is None:
+        return []
+    ids = [fila[0] for fila in db.session.execute(
+        text(f'SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH :consulta '
+             f'LIMIT :limite'),
+        {'consulta': consulta, 'limite': limite})]
+    pacientes = {p.id_paciente: p for p in Paciente.query.filter(Paciente.id_paciente.in_(ids))}
+    return [pacientes[id_paciente] for id_paciente in ids if id_paciente in pacientes]
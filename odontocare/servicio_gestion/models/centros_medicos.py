@@ -12,6 +12,9 @@ class CentroMedico(db.Model):
     nombre = db.Column(db.String(40), nullable=False, unique=True)
     direccion = db.Column(db.String(80), nullable=False, unique=True)
 
+    # Campos públicos (los de to_dict), seleccionables con ?fields= en los listados
+    CAMPOS = ('id_centro', 'nombre', 'direccion')
+
     def to_dict(self):
         'Serializa el centro médico a diccionario/JSON para respuestas JSON'
         return {'id_centro': self.id_centro,
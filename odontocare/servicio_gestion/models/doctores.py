@@ -12,12 +12,16 @@ class Doctor(db.Model):
     id_usuario = db.Column(db.Integer, db.ForeignKey('usuarios.id_usuario'),
                            nullable=False, unique=True
                           )
-    nombre = db.Column(db.String(80), nullable=False)
+    # Índice secundario: las altas comprueban si ya existe el mismo nombre
+    nombre = db.Column(db.String(80), nullable=False, index=True)
     especialidad = db.Column(db.String(30), nullable=False)
     # Define la relación con la tabla 'Usuario'.
     # El 'backref' permite acceder al id_doctor desde Usuarios.
     usuarios = db.relationship('Usuario', backref='doctor')
 
+    # Campos públicos (los de to_dict), seleccionables con ?fields= en los listados
+    CAMPOS = ('id_doctor', 'id_usuario', 'nombre', 'especialidad')
+
     def to_dict(self):
         'Serializa el doctor a diccionario/JSON para respuestas JSON'
         return {'id_doctor': self.id_doctor,
@@ -0,0 +1,121 @@
+'''
+Declaración del modelo de tabla 'outbox' para la base de datos.
+Cada alta o modificación de Paciente, Doctor o CentroMedico deja un evento
+en esta tabla dentro de la misma transacción, de modo que otros servicios
+pueden replicar esas entidades leyendo los eventos por número de secuencia.
+Los eventos con más de OUTBOX_TTL segundos se borran si hay otro posterior
+de la misma entidad: la tabla conserva siempre el último evento de cada
+entidad, así que leerla desde el principio reconstruye todas las entidades.
+'''
+
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, has_app_context
+from sqlalchemy import delete, event, select
+from sqlalchemy.orm import Session, aliased
+
+from servicio_gestion.extensions import db
+from servicio_gestion.models.centros_medicos import CentroMedico
+from servicio_gestion.models.doctores import Doctor
+from servicio_gestion.models.pacientes import Paciente
+
+
+# Entidades replicadas: clase -> nombre de la entidad en los eventos
+ENTIDADES = {
+    Paciente: 'paciente',
+    Doctor: 'doctor',
+    CentroMedico: 'centro_medico',
+}
+
+# Nombre de la clave primaria de cada entidad
+CLAVES = {
+    Paciente: 'id_paciente',
+    Doctor: 'id_doctor',
+    CentroMedico: 'id_centro',
+}
+
+# Segundos entre borrados de los eventos caducados (OUTBOX_TTL)
+INTERVALO_PURGA = 60
+_ultima_purga = 0.0
+
+
+class EventoOutbox(db.Model):
+    'Define el modelo de la tabla EventoOutbox para la base de datos'
+    __tablename__ = 'outbox'
+    __table_args__ = (
+        # Eventos posteriores de la misma entidad (borrado de los caducados)
+        db.Index('ix_outbox_entidad_evento', 'entidad', 'id_entidad', 'id_evento'),
+    )
+    id_evento = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    entidad = db.Column(db.String(20), nullable=False)
+    id_entidad = db.Column(db.Integer, nullable=False)
+    operacion = db.Column(db.String(10), nullable=False)
+    datos = db.Column(db.JSON, nullable=False)
+    # Los eventos caducados se buscan por este índice
+    creado = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        'Serializa el evento a diccionario/JSON para respuestas JSON'
+        return {'id_evento': self.id_evento,
+                'entidad': self.entidad,
+                'id_entidad': self.id_entidad,
+                'operacion': self.operacion,
+                'datos': self.datos,
+                'creado': self.creado.isoformat()
+               }
+
+
+def datos_entidad(objeto):
+    'Serializa una entidad replicada (los Enum se guardan por su valor)'
+    return {clave: getattr(valor, 'value', valor) for clave, valor in objeto.to_dict().items()}
+
+
+def fila_evento(objeto, operacion):
+    'Construye la fila de la tabla outbox para una entidad replicada'
+    clase = type(objeto)
+    return {'entidad': ENTIDADES[clase],
+            'id_entidad': getattr(objeto, CLAVES[clase]),
+            'operacion': operacion,
+            'datos': datos_entidad(objeto),
+            'creado': datetime.now(timezone.utc).replace(tzinfo=None)}
+
+
+@event.listens_for(Session, 'after_flush')
+def registrar_eventos(session, flush_context):
+    '''
+    Tras cada flush, escribe en la tabla outbox las altas y modificaciones de
+    las entidades replicadas. Se usa la misma conexión, así que los eventos
+    se confirman o se deshacen junto con los cambios que los provocan.
+    '''
+    filas = [fila_evento(objeto, 'insert') for objeto in session.new
+             if type(objeto) in ENTIDADES]
+    filas += [fila_evento(objeto, 'update') for objeto in session.dirty
+              if type(objeto) in ENTIDADES
+              and session.is_modified(objeto, include_collections=False)]
+    if filas:
+        conexion = session.connection()
+        purgar(conexion)
+        conexion.execute(EventoOutbox.__table__.insert(), filas)
+
+
+def purgar(conexion, forzar=False):
+    '''
+    Cada INTERVALO_PURGA segundos (o con 'forzar'), borra los eventos con más
+    de OUTBOX_TTL segundos que tienen otro evento posterior de la misma entidad
+    '''
+    global _ultima_purga
+    if not has_app_context() or (not forzar
+                                 and time.monotonic() - _ultima_purga <= INTERVALO_PURGA):
+        return 0
+    _ultima_purga = time.monotonic()
+    caducados = (datetime.now(timezone.utc).replace(tzinfo=None)
+                 - timedelta(seconds=current_app.config['OUTBOX_TTL']))
+    tabla = EventoOutbox.__table__
+    posterior = aliased(tabla)
+    sustituido = select(posterior.c.id_evento).where(
+        posterior.c.entidad == tabla.c.entidad,
+        posterior.c.id_entidad == tabla.c.id_entidad,
+        posterior.c.id_evento > tabla.c.id_evento).exists()
+    return conexion.execute(delete(tabla).where(tabla.c.creado < caducados,
+                                                sustituido)).rowcount
@@ -11,10 +11,14 @@ class Paciente(db.Model):
     id_usuario = db.Column(db.Integer, db.ForeignKey('usuarios.id_usuario'),
                            nullable=False, unique=True
                           )
-    nombre = db.Column(db.String(80), nullable=False)
+    # Índice secundario: las altas comprueban si ya existe el mismo nombre
+    nombre = db.Column(db.String(80), nullable=False, index=True)
     telefono = db.Column(db.String(25), nullable=False)
     estado = db.Column(db.Enum(EstadoUsuario), default=False, nullable=False)
 
+    # Campos públicos (los de to_dict), seleccionables con ?fields= en los listados
+    CAMPOS = ('id_paciente', 'id_usuario', 'nombre', 'telefono', 'estado')
+
     def to_dict(self):
         'Serializa el paciente a diccionario/JSON para respuestas JSON'
         return {'id_paciente': self.id_paciente,
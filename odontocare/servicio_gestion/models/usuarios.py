@@ -11,8 +11,9 @@ class Usuario(db.Model):
     'Define el modelo de la tabla Usuario para la base de datos'
     __tablename__ = 'usuarios'
     id_usuario = db.Column(db.Integer, primary_key=True, unique=True, autoincrement=True)
-    username = db.Column(db.String(80), nullable=False)
-    password = db.Column(db.String(128), nullable=False, unique=True)
+    # Índice único: login y las altas buscan siempre por 'username'
+    username = db.Column(db.String(80), nullable=False, unique=True, index=True)
+    password = db.Column(db.String(128), nullable=False)
     rol = db.Column(db.String(15), nullable=False)
 
     def set_password(self, password):
@@ -23,6 +24,9 @@ class Usuario(db.Model):
         'compara password y password'
         return check_password_hash(self.password, password)
 
+    # Campos públicos (los de to_dict), seleccionables con ?fields= en los listados
+    CAMPOS = ('id_usuario', 'username', 'rol')
+
     def to_dict(self):
         'Serializa el usuario a diccionario/JSON para respuestas JSON'
         return {'id_usuario': self.id_usuario,
@@ -0,0 +1,177 @@
+'''
+Perfilado bajo demanda (cProfile) de los endpoints de los dos servicios.
+Con PERFILADO activo se perfila:
+    - cada petición con la cabecera X-Perfilar y un token de administrador
+    - una fracción PERFILADO_MUESTREO (0 a 1) del resto de peticiones
+Los perfiles se acumulan en memoria por ruta y método (por ejemplo
+'POST /citas/agendar') y se consultan en /admin/perfiles: las funciones con
+más tiempo acumulado o el fichero pstats para abrirlo con snakeviz o pstats.
+Desde Python 3.12 solo puede haber un cProfile activo por proceso y mide
+todos los hilos: las peticiones se perfilan de una en una (si otra ya se
+está perfilando, se omite) y, con peticiones concurrentes, el perfil puede
+incluir funciones de otras peticiones del mismo proceso.
+Cada proceso (worker) guarda sus propios perfiles.
+'''
+
+import cProfile
+import marshal
+import pstats
+import random
+import threading
+import time
+
+from flask import g, request
+from jwt import decode
+from jwt import exceptions
+
+from servicio_gestion import metrics
+import servicio_gestion.config as config
+
+
+CABECERA = 'X-Perfilar'
+ORDENES = {'acumulado': 3, 'propio': 2, 'llamadas': 1}
+
+_perfiles = {}
+_contadores = {'perfiladas': 0, 'omitidas': 0}
+_lock = threading.Lock()
+# Solo un cProfile puede estar activo a la vez en el proceso
+_activo = threading.Lock()
+
+
+class Perfil:
+    'Perfil acumulado de una ruta'
+
+    def __init__(self):
+        self.peticiones = 0
+        self.total_ms = 0.0
+        self.stats = None
+
+    def anadir(self, perfilador, duracion_ms):
+        'Suma el perfil de una petición'
+        self.peticiones += 1
+        self.total_ms += duracion_ms
+        if self.stats is None:
+            self.stats = pstats.Stats(perfilador)
+        else:
+            self.stats.add(perfilador)
+
+    def resumen(self):
+        'Peticiones perfiladas y tiempo medio'
+        return {'peticiones': self.peticiones,
+                'media_ms': round(self.total_ms / self.peticiones, 3)}
+
+
+def _es_admin():
+    'True si la petición trae un token válido con rol de administrador'
+    partes = request.headers.get('Authorization', '').split()
+    if len(partes) != 2 or partes[0].lower() != 'bearer':
+        return False
+    try:
+        payload = decode(partes[1], key=config.Config.JWT_SECRET_KEY, algorithms=['HS256'])
+    except exceptions.InvalidTokenError:
+        return False
+    return payload.get('rol') == 'admin'
+
+
+def _perfilar(muestreo):
+    'Decide si se perfila la petición en curso'
+    if request.headers.get(CABECERA) and _es_admin():
+        return True
+    return muestreo > 0 and random.random() < muestreo
+
+
+def init_app(app):
+    'Registra el perfilado de peticiones si PERFILADO está activo'
+    if not app.config.get('PERFILADO', False):
+        return
+    muestreo = app.config.get('PERFILADO_MUESTREO', 0.0)
+
+    @app.before_request
+    def iniciar_perfil():
+        if request.url_rule is None or not _perfilar(muestreo):
+            return
+        if not _activo.acquire(blocking=False):
+            with _lock:
+                _contadores['omitidas'] += 1
+            return
+        perfilador = cProfile.Profile()
+        try:
+            perfilador.enable()
+        except ValueError:
+            # Hay otra herramienta de perfilado activa en el proceso
+            _activo.release()
+            with _lock:
+                _contadores['omitidas'] += 1
+            return
+        g.perfil = (perfilador, time.perf_counter())
+
+    @app.after_request
+    def marcar_perfilada(response):
+        if 'perfil' in g:
+            response.headers['X-Perfilado'] = 'true'
+        return response
+
+    @app.teardown_request
+    def guardar_perfil(error):
+        perfil = g.pop('perfil', None)
+        if perfil is None:
+            return
+        perfilador, t0 = perfil
+        perfilador.disable()
+        _activo.release()
+        duracion_ms = (time.perf_counter() - t0) * 1000
+        clave = f'{request.method} {request.url_rule.rule}'
+        with _lock:
+            _contadores['perfiladas'] += 1
+            _perfiles.setdefault(clave, Perfil()).anadir(perfilador, duracion_ms)
+
+
+def rutas():
+    'Resumen de las rutas con perfiles'
+    with _lock:
+        return {clave: perfil.resumen() for clave, perfil in sorted(_perfiles.items())}
+
+
+def funciones(clave, orden='acumulado', limite=30):
+    '''
+    Funciones del perfil de la ruta ordenadas por tiempo acumulado, tiempo
+    propio o llamadas (None si la ruta no tiene perfil)
+    '''
+    with _lock:
+        perfil = _perfiles.get(clave)
+        if perfil is None:
+            return None
+        filas = sorted(perfil.stats.stats.items(),
+                       key=lambda fila: -fila[1][ORDENES[orden]])[:limite]
+        peticiones = perfil.peticiones
+        resumen = perfil.resumen()
+    return dict(resumen, funciones=[{
+        'funcion': pstats.func_std_string(pstats.func_strip_path(funcion)),
+        'llamadas': llamadas,
+        'llamadas_primitivas': primitivas,
+        'propio_ms': round(propio * 1000, 3),
+        'acumulado_ms': round(acumulado * 1000, 3),
+        'acumulado_por_peticion_ms': round(acumulado * 1000 / peticiones, 3),
+    } for funcion, (primitivas, llamadas, propio, acumulado, _) in filas])
+
+
+def exportar(clave):
+    'Perfil de la ruta en formato pstats (el de Stats.dump_stats) o None'
+    with _lock:
+        perfil = _perfiles.get(clave)
+        return None if perfil is None else marshal.dumps(perfil.stats.stats)
+
+
+def reiniciar():
+    'Borra los perfiles acumulados'
+    with _lock:
+        _perfiles.clear()
+
+
+def estado():
+    'Peticiones perfiladas y omitidas, y rutas con perfil'
+    with _lock:
+        return dict(_contadores, rutas=len(_perfiles))
+
+
+metrics.registrar_proveedor('perfilado', estado)
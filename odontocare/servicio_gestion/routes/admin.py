@@ -9,13 +9,18 @@ Endpoints para /admin de la API 'OdontoCare' que realiza:
 
 from flask import Blueprint, jsonify, request
 from marshmallow import ValidationError
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, OperationalError
 from werkzeug.security import generate_password_hash
 
+from servicio_gestion import cache_respuestas, campos, perfilado, trazas
 from servicio_gestion.extensions import db
 from servicio_gestion.models.usuarios import Usuario
 from servicio_gestion.models.doctores import Doctor
 from servicio_gestion.models.pacientes import Paciente
 from servicio_gestion.models.centros_medicos import CentroMedico
+from servicio_gestion.models import busqueda_pacientes
+from servicio_gestion.models.outbox import EventoOutbox
 from servicio_gestion.routes.auth import requiere_rol
 from servicio_gestion.schemas import doctor_schema, paciente_schema
 from servicio_gestion.schemas import centro_medico_schema, user_schema
@@ -26,6 +31,8 @@ admin_bp = Blueprint('admin_bp', __name__, url_prefix='/admin')
 # Roles permitidos
 allowed_roles =['admin', 'secretaria']
 allowed_roles_doctor_username =['admin', 'medico']
+allowed_roles_outbox =['admin']
+allowed_roles_perfiles =['admin']
 
 
 # --------- Rutas para /admin/usuario -------------
@@ -55,7 +62,8 @@ def add_usuario():
     # Extrae y valida los datos del cuerpo de la petición (request body)
     try:
         # Validar y cargar los datos
-        validated_data = user_schema.usuario_schema.load(data)
+        with trazas.span('validacion'):
+            validated_data = user_schema.usuario_schema.load(data)
         # Los datos validados están en validated_data (como diccionario de Python)
     except ValidationError as err:
         # Manejar errores de validación
@@ -113,11 +121,18 @@ def get_usuarios():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 5, type=int)
 
-    # Usa el método paginate() en la consulta
-    pagination = Usuario.query.paginate(page=page, per_page=per_page, error_out=False)
+    # Campos a devolver (?fields=a,b): por defecto, todos los de to_dict
+    try:
+        campos_pedidos = campos.campos_solicitados(Usuario, request.args.get('fields'))
+    except campos.CamposInvalidos as err:
+        return jsonify({'error': str(err)}), 400
+
+    # Usa el método paginate() en una consulta de solo esas columnas
+    consulta = campos.consulta(Usuario, campos_pedidos)
+    pagination = consulta.paginate(page=page, per_page=per_page, error_out=False)
 
-    # Serializa los elementos de la página actual
-    usuarios_on_page = [usuario.to_dict() for usuario in pagination.items]
+    # Serializa las filas de la página actual (sin cargar objetos ORM)
+    usuarios_on_page = campos.serializar(Usuario, campos_pedidos, pagination.items)
 
     if page > pagination.pages:
         return jsonify({
@@ -168,85 +183,76 @@ def add_doctor():
     else:
         return jsonify({'error': 'El campo "password" no debe estar vacío.'}), 400
 
-    # Comienza la creación de los registros
+    # Valida los datos de Usuario
     try:
-        # Valida los datos de Usuario
-        try:
-            user_data = ({'username': username,'password': password, 'rol': rol})
+        user_data = ({'username': username,'password': password, 'rol': rol})
+        with trazas.span('validacion'):
             validated_data_user = user_schema.usuario_schema.load(user_data)
-            # Los datos validados están en validated_data_user (como diccionario de Python)
-        except ValidationError as err:
-            # Manejar errores de validación
-            return jsonify(err.messages), 400
-
-        # Si la validación es exitosa, se utilizan los datos (validated_data_user)
-        # para crear un nuevo usuario.
+        # Los datos validados están en validated_data_user (como diccionario de Python)
+    except ValidationError as err:
+        # Manejar errores de validación
+        return jsonify(err.messages), 400
 
-        # Verifica si el usuario ya existe en la base de datos
-        if Usuario.query.filter_by(username=validated_data_user['username']).first():
-            return jsonify({'error': 'El usuario ya existe'}), 409
+    # Valida los datos de Doctor ('id_usuario' se conoce al guardar el usuario)
+    try:
+        doctor_data = ({'nombre': nombre,'especialidad': especialidad})
+        with trazas.span('validacion'):
+            validated_data_doctor = doctor_schema.doc_schema.load(doctor_data,
+                                                                  partial=('id_usuario',))
+        # Los datos validados están en validated_data_doctor (como diccionario de Python)
+    except ValidationError as err:
+        # Manejar errores de validación
+        return jsonify(err.messages), 400
 
+    # Usuario y doctor se guardan en una única transacción
+    try:
         # Crea el nuevo usuario
         new_user = Usuario(
                             username=validated_data_user['username'],
                             password=validated_data_user['password'],
                             rol = validated_data_user['rol']
                         )
-
-        # Se guarda en la base de datos
         db.session.add(new_user)
-
-        # Averiguamos el último id_usuario existente en la tabla 'usuarios'
-        last_user = Usuario.query.order_by(Usuario.id_usuario.desc()).first()
-
-        if last_user:
-            id_usuario = last_user.id_usuario + 1
-        else:
-            print("La tabla de usuarios está vacía.")
-
-        # Valida los datos de Doctor
-        try:
-            doctor_data = ({'nombre': nombre,'especialidad': especialidad, 'id_usuario': id_usuario})
-            validated_data_doctor = doctor_schema.doc_schema.load(doctor_data)
-            # Los datos validados están en validated_data_doctor (como diccionario de Python)
-        except ValidationError as err:
-            # Manejar errores de validación
-            return jsonify(err.messages), 400
-
-        # Si la validación es exitosa, se utilizan los datos (validated_data)
-        # para crear un nuevo doctor.
-
-        # Verifica si el doctor ya existe en la base de datos
+        # El flush inserta el usuario (sin confirmar) y asigna su 'id_usuario'.
+        # Se escribe antes de cualquier consulta: la transacción toma el bloqueo
+        # de escritura al empezar (una lectura previa tendría que ampliarlo y,
+        # con altas concurrentes, SQLite lo rechaza con 'database is locked').
+        # Un 'username' repetido lo detecta el índice único (IntegrityError)
+        db.session.flush()
+
+        # Verifica, ya dentro de la transacción de escritura, si el doctor ya existe
         if Doctor.query.filter_by(nombre=validated_data_doctor['nombre']).first():
+            db.session.rollback()
             return jsonify({'error': 'El doctor ya existe'}), 409
 
-        # Crea el nuevo doctor
+        # Crea el nuevo doctor enlazado al usuario
         new_doctor = Doctor(
-                            id_usuario=validated_data_doctor['id_usuario'],
+                            id_usuario=new_user.id_usuario,
                             nombre=validated_data_doctor['nombre'],
                             especialidad=validated_data_doctor['especialidad']
                         )
-
-        # Se guarda en la base de datos
         db.session.add(new_doctor)
 
         # Se hace commit de los dos registros en la base de datos
         db.session.commit()
 
         return jsonify({'message': 'Usuario y Doctor registrados exitosamente',
-                        'id_usuario': id_usuario,
+                        'id_usuario': new_user.id_usuario,
                         'id_doctor': new_doctor.id_doctor
                     }), 201
 
+    except IntegrityError:
+        # El usuario ya existe, o lo ha creado otra petición a la vez (índice único de 'username')
+        db.session.rollback()
+        return jsonify({'error': 'El usuario ya existe'}), 409
+    except OperationalError as e:
+        # Bloqueo de la base de datos (otra escritura en curso): se puede reintentar
+        db.session.rollback()
+        return jsonify({'error': f'Base de datos ocupada, reintente la petición: {e.orig}'}), \
+            503, {'Retry-After': '1'}
     except Exception as e:
-         # En caso de error, se hace rollback para no dejar registros de doctor inconsistentes
+        # El rollback deshace a la vez el usuario y el doctor
         db.session.rollback()
-        # Después, se elimina el usuario que ya se había creado
-        user_to_delete = Usuario.query.get(id_usuario)
-        print(id_usuario)
-        if user_to_delete:
-            db.session.delete(user_to_delete)
-            db.session.commit() # Confirmar la eliminación del usuario
         # Se informa del error
         return jsonify({'message': f'Error {e} al guardar usuario/doctor en la base de datos'}), 500
 
@@ -303,6 +309,7 @@ def get_doctor_username():
 
 @admin_bp.route('/doctores', methods=['GET'])
 @requiere_rol(allowed_roles)
+@cache_respuestas.cacheada('doctores')
 def get_doctores():
     """
     Endpoint GET para obtener los datos de todos los doctores.
@@ -313,11 +320,18 @@ def get_doctores():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 5, type=int)
 
-    # Usa el método paginate() en la consulta
-    pagination = Doctor.query.paginate(page=page, per_page=per_page, error_out=False)
+    # Campos a devolver (?fields=a,b): por defecto, todos los de to_dict
+    try:
+        campos_pedidos = campos.campos_solicitados(Doctor, request.args.get('fields'))
+    except campos.CamposInvalidos as err:
+        return jsonify({'error': str(err)}), 400
+
+    # Usa el método paginate() en una consulta de solo esas columnas
+    consulta = campos.consulta(Doctor, campos_pedidos)
+    pagination = consulta.paginate(page=page, per_page=per_page, error_out=False)
 
-    # Serializa los elementos de la página actual
-    doctores_on_page = [doctor.to_dict() for doctor in pagination.items]
+    # Serializa las filas de la página actual (sin cargar objetos ORM)
+    doctores_on_page = campos.serializar(Doctor, campos_pedidos, pagination.items)
 
     if page > pagination.pages:
         return jsonify({
@@ -370,79 +384,81 @@ def add_paciente():
     else:
         return jsonify({'error': 'El campo "password" no debe estar vacío.'}), 400
 
-    # Comienza la creación de los registros
+    # Valida los datos de Usuario
     try:
-        # Valida los datos de Usuario
-        try:
-            user_data = ({'username': username,'password': password, 'rol': rol})
+        user_data = ({'username': username,'password': password, 'rol': rol})
+        with trazas.span('validacion'):
             validated_data_user = user_schema.usuario_schema.load(user_data)
-            # Los datos validados están en validated_data (como diccionario de Python)
-        except ValidationError as err:
-            # Manejar errores de validación
-            return jsonify(err.messages), 400
-
-        # Verifica si el usuario ya existe en la base de datos
-        if Usuario.query.filter_by(username=validated_data_user['username']).first():
-            return jsonify({'error': 'El usuario ya existe'}), 409
+        # Los datos validados están en validated_data (como diccionario de Python)
+    except ValidationError as err:
+        # Manejar errores de validación
+        return jsonify(err.messages), 400
 
-        # Si los datos son correctos, se utilizan para crear el usuario
+    # Valida los datos de Paciente ('id_usuario' se conoce al guardar el usuario)
+    try:
+        paciente_data = ({
+                          'nombre': nombre,
+                          'telefono': telefono,
+                          'estado': estado
+                         })
+        with trazas.span('validacion'):
+            validated_data_paciente = paciente_schema.pacient_schema.load(
+                paciente_data, partial=('id_usuario',))
+        # Los datos validados están en validated_data_paciente (como diccionario de Python)
+    except ValidationError as err:
+        # Manejar errores de validación
+        return jsonify(err.messages), 400
 
+    # Usuario y paciente se guardan en una única transacción
+    try:
         # Crea el nuevo usuario
         new_user = Usuario(
                             username=validated_data_user['username'],
                             password=validated_data_user['password'],
                             rol = validated_data_user['rol']
                         )
-        # Se guarda en la base de datos
         db.session.add(new_user)
-        db.session.commit()
-
-        # Ahora ya está disponible el 'id_usuario' para dar de alta al Paciente
-        id_usuario = new_user.id_usuario
-
-        # Valida los datos de Paciente
-        try:
-            paciente_data = ({
-                              'nombre': nombre,
-                              'telefono': telefono, 
-                              'estado': estado, 
-                              'id_usuario': id_usuario
-                             })
-            validated_data_paciente = paciente_schema.pacient_schema.load(paciente_data)
-            # Los datos validados están en validated_data_paciente (como diccionario de Python)
-        except ValidationError as err:
-            # Manejar errores de validación
-            return jsonify(err.messages), 400
-
-        # Verifica si el paciente ya existe en la base de datos
+        # El flush inserta el usuario (sin confirmar) y asigna su 'id_usuario'.
+        # Se escribe antes de cualquier consulta: la transacción toma el bloqueo
+        # de escritura al empezar (una lectura previa tendría que ampliarlo y,
+        # con altas concurrentes, SQLite lo rechaza con 'database is locked').
+        # Un 'username' repetido lo detecta el índice único (IntegrityError)
+        db.session.flush()
+
+        # Verifica, ya dentro de la transacción de escritura, si el paciente ya existe
         if Paciente.query.filter_by(nombre=validated_data_paciente['nombre']).first():
+            db.session.rollback()
             return jsonify({'error': 'El paciente ya existe'}), 409
 
-        # Si los datos son correctos, se utilizan para crear el paciente
-
-        # Crea el nuevo paciente
+        # Crea el nuevo paciente enlazado al usuario
         new_paciente = Paciente(
-                            id_usuario=validated_data_paciente['id_usuario'],
+                            id_usuario=new_user.id_usuario,
                             nombre=validated_data_paciente['nombre'],
                             telefono=validated_data_paciente['telefono'],
                             estado=validated_data_paciente['estado']
                         )
-        # Se guarda en la base de datos
         db.session.add(new_paciente)
+
+        # Se hace commit de los dos registros en la base de datos
         db.session.commit()
 
         return jsonify({'message': 'Usuario y Paciente registrados exitosamente',
-                        'id_usuario': id_usuario,
+                        'id_usuario': new_user.id_usuario,
                         'id_paciente': new_paciente.id_paciente
                         }), 201
 
+    except IntegrityError:
+        # El usuario ya existe, o lo ha creado otra petición a la vez (índice único de 'username')
+        db.session.rollback()
+        return jsonify({'error': 'El usuario ya existe'}), 409
+    except OperationalError as e:
+        # Bloqueo de la base de datos (otra escritura en curso): se puede reintentar
+        db.session.rollback()
+        return jsonify({'error': f'Base de datos ocupada, reintente la petición: {e.orig}'}), \
+            503, {'Retry-After': '1'}
     except Exception as e:
-        # En caso de error, hacer rollback para no dejar rastro del registro del paciente
+        # El rollback deshace a la vez el usuario y el paciente
         db.session.rollback()
-        # Después debemos deshacer el guardado del registro de usuario
-        usuario_a_eliminar = Usuario.query.filter_by(id=id_usuario).one()
-        db.session.delete(usuario_a_eliminar)
-        db.session.commit()
         return jsonify({'message': f'Error {e} al guardar usuario/paciente en la base de datos'}), 500
 
 
@@ -476,14 +492,18 @@ def get_pacientes():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 5, type=int)
 
-    # Usa el método paginate() en la consulta
-    pagination = Paciente.query.paginate(page=page, per_page=per_page, error_out=False)
+    # Campos a devolver (?fields=a,b): por defecto, todos los de to_dict
+    try:
+        campos_pedidos = campos.campos_solicitados(Paciente, request.args.get('fields'))
+    except campos.CamposInvalidos as err:
+        return jsonify({'error': str(err)}), 400
 
-    # Serializa los elementos de la página actual
-    pacientes_on_page = []
-    for paciente in pagination.items:
-        paciente.estado = paciente.estado.value
-        pacientes_on_page.append(paciente.to_dict())
+    # Usa el método paginate() en una consulta de solo esas columnas
+    consulta = campos.consulta(Paciente, campos_pedidos)
+    pagination = consulta.paginate(page=page, per_page=per_page, error_out=False)
+
+    # Serializa las filas de la página actual (sin cargar objetos ORM)
+    pacientes_on_page = campos.serializar(Paciente, campos_pedidos, pagination.items)
 
     if page > pagination.pages:
         return jsonify({
@@ -501,6 +521,34 @@ def get_pacientes():
         })
 
 
+@admin_bp.route('/pacientes/buscar', methods=['GET'])
+@requiere_rol(allowed_roles)
+def buscar_pacientes():
+    """
+    Endpoint GET para buscar pacientes por el principio de las palabras de su
+    nombre o de su teléfono, sin distinguir mayúsculas ni acentos.
+    Query params:
+        - q: texto a buscar (p. ej. 'vizcai mar' o '600 12')
+        - limite: número máximo de resultados (por defecto 20, máximo 100)
+    """
+
+    texto = request.args.get('q', '')
+    limite = min(max(request.args.get('limite', 20, type=int), 1), 100)
+    if busqueda_pacientes.consulta_fts(texto) is None:
+        return jsonify({'error': 'Indique el texto a buscar en el parámetro "q".'}), 400
+
+    try:
+        pacientes = busqueda_pacientes.buscar_pacientes(texto, limite)
+    except OperationalError as e:
+        return jsonify({'error': f'Búsqueda de pacientes no disponible: {e.orig}'}), 503
+
+    # El estado se serializa por su valor sin modificar los objetos de la sesión
+    resultados = [dict(paciente.to_dict(), estado=paciente.estado.value)
+                  for paciente in pacientes]
+    return jsonify({'pacientes': resultados,
+                    'total': len(resultados)})
+
+
 # --------- Rutas para /admin/centro_medico -------------
 
 @admin_bp.route('/centro_medico', methods=['POST'])
@@ -520,7 +568,8 @@ def add_centro():
     # Extrae y valida los datos del cuerpo de la petición (request body)
     try:
         # Validar y cargar los datos
-        validated_data = centro_medico_schema.centr_medico_schema.load(data)
+        with trazas.span('validacion'):
+            validated_data = centro_medico_schema.centr_medico_schema.load(data)
         # Los datos validados están en validated_data (como diccionario de Python)
     except ValidationError as err:
         # Manejar errores de validación
@@ -565,6 +614,7 @@ def get_centro(id_centro):
 
 @admin_bp.route('/centros_medicos', methods=['GET'])
 @requiere_rol(allowed_roles)
+@cache_respuestas.cacheada('centros_medicos')
 def get_centros():
     """
     Endpoint GET para obtener los datos de todos los centros médicos.
@@ -575,11 +625,18 @@ def get_centros():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 5, type=int)
 
-    # Usa el método paginate() en la consulta
-    pagination = CentroMedico.query.paginate(page=page, per_page=per_page, error_out=False)
+    # Campos a devolver (?fields=a,b): por defecto, todos los de to_dict
+    try:
+        campos_pedidos = campos.campos_solicitados(CentroMedico, request.args.get('fields'))
+    except campos.CamposInvalidos as err:
+        return jsonify({'error': str(err)}), 400
+
+    # Usa el método paginate() en una consulta de solo esas columnas
+    consulta = campos.consulta(CentroMedico, campos_pedidos)
+    pagination = consulta.paginate(page=page, per_page=per_page, error_out=False)
 
-    # Serializa los elementos de la página actual
-    centros_on_page = [centro.to_dict() for centro in pagination.items]
+    # Serializa las filas de la página actual (sin cargar objetos ORM)
+    centros_on_page = campos.serializar(CentroMedico, campos_pedidos, pagination.items)
 
     if page > pagination.pages:
         return jsonify({
@@ -595,3 +652,104 @@ def get_centros():
                                 'per_page': pagination.per_page
                                 }
         })
+
+
+# --------- Rutas para /admin/outbox -------------
+
+@admin_bp.route('/outbox', methods=['GET'])
+@requiere_rol(allowed_roles_outbox)
+def get_outbox():
+    """
+    Endpoint GET para leer los eventos de cambios de pacientes, doctores y
+    centros médicos posteriores a un número de secuencia.
+    Query params: 'desde' (último id_evento ya leído) y 'limite'.
+    Si ya se han borrado eventos posteriores a 'desde' (OUTBOX_TTL), o
+    'desde' no existe, responde con 'reinicio': el consumidor debe volver a
+    leer desde 0, que contiene el último evento de cada entidad.
+    """
+
+    # Obtiene los parámetros de la URL. Por defecto, desde el principio y 500 eventos
+    desde = request.args.get('desde', 0, type=int)
+    limite = min(request.args.get('limite', 500, type=int), 5000)
+
+    if desde > 0:
+        primero, ultimo = db.session.query(func.min(EventoOutbox.id_evento),
+                                           func.max(EventoOutbox.id_evento)).one()
+        if desde > (ultimo or 0) or (primero is not None and primero > desde + 1):
+            return jsonify({'eventos': [], 'ultimo': 0, 'completo': False, 'reinicio': True})
+
+    # Recorre la clave primaria a partir del último evento leído
+    eventos = EventoOutbox.query.filter(EventoOutbox.id_evento > desde) \
+                                .order_by(EventoOutbox.id_evento).limit(limite).all()
+
+    return jsonify({
+                    'eventos': [evento.to_dict() for evento in eventos],
+                    'ultimo': eventos[-1].id_evento if eventos else desde,
+                    'completo': len(eventos) < limite,
+                    'reinicio': False
+        })
+
+
+# --------- Rutas para /admin/perfiles -------------
+
+def _clave_perfil():
+    'Ruta y método del perfil pedido (query params "ruta" y "metodo")'
+    return f"{request.args.get('metodo', 'GET').upper()} {request.args.get('ruta', '')}"
+
+
+@admin_bp.route('/perfiles', methods=['GET'])
+@requiere_rol(allowed_roles_perfiles)
+def get_perfiles():
+    """
+    Endpoint GET para listar las rutas perfiladas en este proceso (PERFILADO),
+    con el número de peticiones perfiladas y su tiempo medio.
+    """
+
+    return jsonify({'perfiles': perfilado.rutas(), **perfilado.estado()}), 200
+
+
+@admin_bp.route('/perfiles/funciones', methods=['GET'])
+@requiere_rol(allowed_roles_perfiles)
+def get_perfil_funciones():
+    """
+    Endpoint GET para consultar las funciones con más tiempo del perfil de una ruta.
+    Query params: 'ruta' (por ejemplo /citas/agendar), 'metodo' (por defecto GET),
+    'orden' (acumulado, propio o llamadas) y 'limite'.
+    """
+
+    orden = request.args.get('orden', 'acumulado')
+    if orden not in perfilado.ORDENES:
+        return jsonify({'error': f'orden debe ser uno de: {", ".join(perfilado.ORDENES)}'}), 400
+    limite = min(request.args.get('limite', 30, type=int), 500)
+
+    resultado = perfilado.funciones(_clave_perfil(), orden, limite)
+    if resultado is None:
+        return jsonify({'error': f'No hay perfiles de {_clave_perfil()}'}), 404
+    return jsonify(resultado), 200
+
+
+@admin_bp.route('/perfiles/descargar', methods=['GET'])
+@requiere_rol(allowed_roles_perfiles)
+def descargar_perfil():
+    """
+    Endpoint GET para descargar el perfil acumulado de una ruta en formato pstats
+    (se abre con pstats.Stats o snakeviz). Query params: 'ruta' y 'metodo'.
+    """
+
+    datos = perfilado.exportar(_clave_perfil())
+    if datos is None:
+        return jsonify({'error': f'No hay perfiles de {_clave_perfil()}'}), 404
+    nombre = _clave_perfil().replace(' ', '').replace('/', '_').strip('_') + '.prof'
+    return datos, 200, {'Content-Type': 'application/octet-stream',
+                        'Content-Disposition': f'attachment; filename="{nombre}"'}
+
+
+@admin_bp.route('/perfiles', methods=['DELETE'])
+@requiere_rol(allowed_roles_perfiles)
+def delete_perfiles():
+    """
+    Endpoint DELETE para borrar los perfiles acumulados en este proceso.
+    """
+
+    perfilado.reiniciar()
+    return jsonify({'mensaje': 'Perfiles borrados'}), 200
@@ -13,8 +13,10 @@ from jwt import encode, decode
 from jwt import exceptions
 from werkzeug.security import check_password_hash
 
-
+from servicio_gestion import trazas
 from servicio_gestion.models.usuarios import Usuario
+from servicio_gestion.models.doctores import Doctor
+from servicio_gestion.models.pacientes import Paciente
 import servicio_gestion.config as config
 
 # Crea una instancia de Blueprint para 'auth_bp'
@@ -25,7 +27,7 @@ allowed_roles =['admin']
 
 # ---------- Genera token -----------------
 
-def generate_jwt_token(username, rol):
+def generate_jwt_token(username, rol, id_usuario=None, id_doctor=None, id_paciente=None):
     'genera un token JWT para un usuario'
 
     # Construye el payload con el ROL incluido
@@ -35,6 +37,10 @@ def generate_jwt_token(username, rol):
         'iat': datetime.now(timezone.utc),
         'exp': datetime.now(timezone.utc) + config.Config.JWT_EXPIRATION_DELTA
     }
+    # Añade los identificadores del usuario para que los servicios puedan
+    # autorizar sin consultar la base de datos (solo los que correspondan)
+    claims = {'id_usuario': id_usuario, 'id_doctor': id_doctor, 'id_paciente': id_paciente}
+    payload.update({clave: valor for clave, valor in claims.items() if valor is not None})
 
     token = encode(payload, key=config.Config.JWT_SECRET_KEY, algorithm='HS256')
 
@@ -62,8 +68,26 @@ def login():
     if not check_password_hash(user.password, password):
         return jsonify({'error': 'Password incorrecta'}), 401
 
-    # Credenciales correctas
-    token = generate_jwt_token(username, rol)
+    # El rol del token es el guardado del usuario: se rechaza otro rol pedido
+    # (si no se indica, se usa el guardado)
+    if rol and rol != user.rol:
+        return jsonify({'error': f'El rol {rol} no corresponde al usuario {username}.'}), 401
+    rol = user.rol
+
+    # Credenciales correctas: se buscan los registros de doctor o paciente
+    # asociados al usuario para incluir sus identificadores en el token
+    id_doctor = None
+    id_paciente = None
+    if user.rol == 'medico':
+        doctor = Doctor.query.filter_by(id_usuario=user.id_usuario).first()
+        if doctor:
+            id_doctor = doctor.id_doctor
+    elif user.rol == 'paciente':
+        paciente = Paciente.query.filter_by(id_usuario=user.id_usuario).first()
+        if paciente:
+            id_paciente = paciente.id_paciente
+    token = generate_jwt_token(username, rol, id_usuario=user.id_usuario,
+                               id_doctor=id_doctor, id_paciente=id_paciente)
     expiration = datetime.now(timezone.utc) + config.Config.JWT_EXPIRATION_DELTA
 
     return jsonify({'token':token,
@@ -87,7 +111,9 @@ def requiere_rol(allowed_roles):
 
             # Decodificar y validar el token
             try:
-                payload = decode(token, key=config.Config.JWT_SECRET_KEY, algorithms=['HS256'])
+                with trazas.span('auth'):
+                    payload = decode(token, key=config.Config.JWT_SECRET_KEY,
+                                     algorithms=['HS256'])
                 rol_del_usuario = payload.get('rol')
                 if rol_del_usuario not in allowed_roles:
                     return jsonify({'mensaje': 'Permiso denegado'}), 403
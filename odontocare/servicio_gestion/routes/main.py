@@ -4,6 +4,8 @@ Endpoint para la raíz de la API 'Odontocare'.
 
 from flask import Blueprint, jsonify
 
+from servicio_gestion import calentamiento, metrics
+
 # Crea una instancia de Blueprint para 'main'
 main = Blueprint('main_bp', __name__)
 
@@ -26,3 +28,27 @@ def home():
             'citas': '/servicio_citas/modulos/citas',
         }
     }), 200
+
+
+# Define la ruta para las métricas del proceso
+@main.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Devuelve las métricas internas del servicio en formato JSON.
+    """
+
+    return jsonify(metrics.snapshot()), 200
+
+
+# Define la ruta para la comprobación de disponibilidad (readiness)
+@main.route('/ready', methods=['GET'])
+def get_ready():
+    """
+    Devuelve 200 cuando el servicio ha terminado el calentamiento de arranque
+    (con el tiempo de cada paso) y 503 mientras tanto.
+    """
+
+    estado = calentamiento.estado()
+    if not estado['listo']:
+        return jsonify(estado), 503, {'Retry-After': '1'}
+    return jsonify(estado), 200
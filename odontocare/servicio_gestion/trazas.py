@@ -0,0 +1,161 @@
+'''
+Trazas por petición compartidas por los dos servicios.
+Cada petición tiene un identificador (cabecera X-Request-ID): el que envía
+el cliente o uno nuevo. Se devuelve en la respuesta y gestion_client lo
+propaga en sus llamadas a servicio_gestion, así que las peticiones de los
+dos servicios para una misma cita comparten identificador.
+Con TRAZAS activo, cada petición anota además sus spans (tramos medidos):
+    - auth: decodificación del token JWT
+    - validacion: validación del cuerpo con los esquemas de marshmallow
+    - gestion: cada llamada a servicio_gestion
+    - bd: cada sentencia SQL ejecutada en el hilo de la petición
+    - escritura: espera de la escritura de la cita (y de la cola, si está activa)
+    - serializacion: cada conversión a JSON de una respuesta
+y al terminar escribe una línea JSON en el fichero TRAZAS_RUTA. El script
+'resumen_trazas.py' agrega ese fichero en un desglose de latencia por endpoint.
+'''
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+
+from servicio_gestion.extensions import db
+
+
+CABECERA = 'X-Request-ID'
+LONGITUD_MAX = 128
+
+_fichero = {'fd': None, 'ruta': None}
+_lock = threading.Lock()
+
+
+class Traza:
+    'Spans de una petición'
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.spans = []
+
+    def anotar(self, nombre, t0, detalle=None):
+        'Añade un span que empezó en t0 (perf_counter) y termina ahora'
+        span = {'nombre': nombre,
+                'inicio_ms': round((t0 - self.inicio) * 1000, 3),
+                'duracion_ms': round((time.perf_counter() - t0) * 1000, 3)}
+        if detalle:
+            span['detalle'] = detalle
+        self.spans.append(span)
+
+
+def id_peticion():
+    'Identificador de la petición en curso (None fuera de una petición)'
+    return g.get('id_peticion') if has_app_context() else None
+
+
+def _traza():
+    'Traza de la petición en curso, o None si no se está trazando'
+    return g.get('traza') if has_app_context() else None
+
+
+@contextmanager
+def span(nombre, detalle=None):
+    'Mide el bloque como un span de la petición en curso (si se está trazando)'
+    traza = _traza()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if traza is not None:
+            traza.anotar(nombre, t0, detalle)
+
+
+class ProveedorJSON(DefaultJSONProvider):
+    'Proveedor JSON de Flask que mide cada serialización de una respuesta'
+
+    def response(self, *args, **kwargs):
+        with span('serializacion'):
+            return super().response(*args, **kwargs)
+
+
+def _escribir(ruta, registro):
+    'Añade el registro al fichero de trazas con una sola escritura (O_APPEND)'
+    linea = (json.dumps(registro, ensure_ascii=False, default=str) + '\n').encode()
+    with _lock:
+        if _fichero['ruta'] != ruta:
+            _fichero['fd'] = os.open(ruta, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _fichero['ruta'] = ruta
+        os.write(_fichero['fd'], linea)
+
+
+def init_app(app):
+    'Registra el identificador de petición y, con TRAZAS, la medida de spans'
+    trazar = app.config.get('TRAZAS', False)
+    ruta = app.config.get('TRAZAS_RUTA', 'trazas.jsonl')
+    servicio = app.config.get('TRAZAS_SERVICIO', app.import_name)
+
+    @app.before_request
+    def iniciar_peticion():
+        recibido = request.headers.get(CABECERA, '')
+        g.id_peticion = recibido if 0 < len(recibido) <= LONGITUD_MAX else uuid.uuid4().hex
+        if trazar:
+            g.traza = Traza()
+            g.traza_epoch = time.time()
+
+    @app.after_request
+    def devolver_id(response):
+        if 'id_peticion' in g:
+            response.headers[CABECERA] = g.id_peticion
+            g.traza_status = response.status_code
+        return response
+
+    if not trazar:
+        return
+
+    @app.teardown_request
+    def escribir_traza(error):
+        traza = g.pop('traza', None)
+        if traza is None:
+            return
+        registro = {'id': g.id_peticion,
+                    'servicio': servicio,
+                    'metodo': request.method,
+                    'endpoint': request.endpoint,
+                    'ruta': request.path,
+                    'status': g.get('traza_status', 500),
+                    'inicio': g.traza_epoch,
+                    'duracion_ms': round((time.perf_counter() - traza.inicio) * 1000, 3),
+                    'spans': traza.spans}
+        try:
+            _escribir(ruta, registro)
+        except OSError as e:
+            app.logger.warning('No se ha podido escribir la traza: %s', e)
+
+    app.json = ProveedorJSON(app)
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def antes_sentencia(conn, cursor, statement, parameters, context, executemany):
+        if _traza() is not None:
+            conn.info.setdefault('traza_t0', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def despues_sentencia(conn, cursor, statement, parameters, context, executemany):
+        traza = _traza()
+        pendientes = conn.info.get('traza_t0')
+        if traza is not None and pendientes:
+            # La primera línea de la sentencia identifica la consulta
+            traza.anotar('bd', pendientes.pop(), statement.split('\n', 1)[0][:80])
+
+    @event.listens_for(engine, 'handle_error')
+    def error_sentencia(contexto):
+        pendientes = contexto.connection.info.get('traza_t0') if contexto.connection else None
+        if pendientes:
+            pendientes.pop()